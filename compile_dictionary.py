@@ -0,0 +1,37 @@
+'''
+This script compiles a word list into the binary Dictionary format,
+which solve_xword.py can memory-map instead of loading the words.
+'''
+
+import argparse
+import logging
+
+from littleboxes.dictionary import Dictionary
+
+
+def opts():
+    parser = argparse.ArgumentParser(description='Compile a Dictionary from a word list')
+    parser.add_argument('words', type=argparse.FileType('r'),
+                        help='Word list, with one word per line')
+    parser.add_argument('--output', required=True,
+                        help='Output Dictionary file')
+    parser.add_argument('--logging',
+                        choices=('debug', 'info', 'warning',
+                                 'error', 'critical'),
+                        default='info', help='Logging level (default: %(default)s)')
+    return parser
+
+
+def main():
+    args = opts().parse_args()
+    logging.basicConfig(level=getattr(logging, args.logging.upper()))
+
+    logging.info("Loading words from %s", args.words.name)
+    dictionary = Dictionary.load(args.words, index='compact')
+
+    logging.info("Saving %d words to %s", dictionary.size, args.output)
+    with open(args.output, 'wb') as fd:
+        dictionary.save(fd)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,36 @@
 '''
-This script can be used to generate a ClueDB in *.mpk format
-from a set of input *.puz files.
+This script can be used to generate a ClueDB in *.mpk format, or in the
+binary format read by ClueDB.open, from a set of input *.puz files.
+
+Puzzles are parsed in a pool of worker processes.  Each worker writes the
+clue records of a batch of puzzles to a sorted shard file, and the shards
+are merged into the output one clue at a time, as in an external sort, so
+memory use does not grow with the number of records.  (The binary format
+is written as the clues are merged too, but it holds the distinct clues and
+their fuzzy index in memory until the end.)
+
+With --append, the new clues are added to an existing binary ClueDB as a
+new segment instead, without reading the rest of it, and the file is
+compacted into one segment once it has more than --max-segments.
 '''
 
 import argparse
 import glob
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from littleboxes.cluedb import ClueDB, merge_shards, parse_puzzle, write_shard
+
 
-from littleboxes.cluedb import ClueDB
-from littleboxes.xword import Crossword
+def source(value):
+    '''Checks that a --source fits in the source column of a clue record'''
+    if len(value) > 3:
+        raise argparse.ArgumentTypeError(
+            'must be at most three letters: %r' % value)
+    return value
 
 
 def opts():
@@ -16,7 +38,33 @@ def opts():
     parser.add_argument('pattern', nargs='+',
                         help='Pattern for *.puz files to include in ClueDB')
     parser.add_argument('--output', required=True,
-                        help='Output ClueDB file, in *.mpk format')
+                        help='Output ClueDB file')
+    parser.add_argument('--format', choices=('msgpack', 'binary'),
+                        default='msgpack',
+                        help='Output format: *.mpk, or the binary format '
+                        'read by ClueDB.open, which holds the distinct clues '
+                        'and their fuzzy index in memory while it is written '
+                        '(default: %(default)s)')
+    parser.add_argument('--append', action='store_true',
+                        help='Add the clues to the binary ClueDB at --output '
+                        '(which is created if needed) instead of replacing it; '
+                        'the new clues and their fuzzy index are held in memory '
+                        'while they are written')
+    parser.add_argument('--max-segments', type=int, default=8,
+                        help='With --append, compact the ClueDB when it has '
+                        'more segments than this (default: %(default)s)')
+    parser.add_argument('--source', type=source, default=None,
+                        help='Three-letter source to record for the clues, '
+                        'e.g. NYT (default: unk)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes to parse puzzles '
+                        'with (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Number of puzzles per sorted shard '
+                        '(default: %(default)s)')
+    parser.add_argument('--tmpdir', default=None,
+                        help='Directory for the shards (default: the '
+                        'system temporary directory)')
     parser.add_argument('--logging',
                         choices=('debug', 'info', 'warning',
                                  'error', 'critical'),
@@ -24,29 +72,78 @@ def opts():
     return parser
 
 
+def parse_batch(task):
+    '''Parses a batch of puzzles and writes their records to a sorted shard
+
+    Arguments:
+        task: tuple (list of *.puz paths, source, shard path)
+
+    Returns:
+        tuple(str, int, int): the shard path, and the number of puzzles
+            parsed and that could not be parsed
+    '''
+    paths, source, shard = task
+    records = []
+    n_errors = 0
+    for path in paths:
+        try:
+            records.extend(parse_puzzle(path, source))
+        except Exception:
+            logging.exception("Error loading: %s", path)
+            n_errors += 1
+
+    write_shard(records, shard)
+    return shard, len(paths) - n_errors, n_errors
+
+
 def main():
-    args = opts().parse_args()
+    parser = opts()
+    args = parser.parse_args()
     logging.basicConfig(level=getattr(logging, args.logging.upper()))
+    if args.append and args.format != 'binary':
+        parser.error('--append requires --format binary')
 
-    db = ClueDB()
-
-    logging.info("Loading puzzles into the ClueDB")
+    paths = []
     for pattern in args.pattern:
         logging.info("Finding files matching pattern: %s", pattern)
-        for puz in glob.iglob(pattern):
-            logging.debug("Processing: %s", puz)
-            try:
-                with open(puz, 'rb') as fd:
-                    x = Crossword.load(fd, include_solution=True)
-                    for clue in x.clues:
-                        word = ''.join(x.get_fill(clue))
-                        db.add(clue.text, word)
-            except Exception:
-                logging.exception("Error loading: %s", puz)
-
-    logging.info("Saving ClueDB to %s", args.output)
-    with open(args.output, 'w') as fd:
-        db.serialize(fd)
+        paths.extend(glob.iglob(pattern))
+    paths.sort()
+
+    tmpdir = tempfile.mkdtemp(prefix='cluedb-', dir=args.tmpdir)
+    try:
+        tasks = [(paths[i:i + args.batch_size], args.source,
+                  os.path.join(tmpdir, 'shard-%06d.txt' % n))
+                 for n, i in enumerate(range(0, len(paths), args.batch_size))]
+
+        logging.info("Parsing %d puzzles into %d shards", len(paths), len(tasks))
+        shards = []
+        pool = multiprocessing.Pool(args.processes)
+        try:
+            results = pool.imap_unordered(parse_batch, tasks)
+            for shard, n_parsed, n_errors in results:
+                logging.debug("Wrote %s from %d puzzles (%d errors)",
+                              shard, n_parsed, n_errors)
+                shards.append(shard)
+        finally:
+            pool.close()
+            pool.join()
+
+        if args.append:
+            logging.info("Appending shards to the ClueDB at %s", args.output)
+            n_segments = ClueDB.append(args.output, merge_shards(shards))
+            if n_segments > args.max_segments:
+                logging.info("Compacting %d segments", n_segments)
+                ClueDB.compact(args.output)
+            return
+
+        logging.info("Merging shards into the ClueDB at %s", args.output)
+        with open(args.output, 'wb') as fd:
+            if args.format == 'binary':
+                ClueDB.save_answers(fd, merge_shards(shards))
+            else:
+                ClueDB.serialize_answers(fd, merge_shards(shards))
+    finally:
+        shutil.rmtree(tmpdir)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,42 @@
+from array import array
+import bisect
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
 import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
 import msgpack
-from ngram import NGram
+import puz
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from littleboxes.fuzzy import NGramIndex
+from littleboxes.mapped import (
+    UINT32,
+    MappedStrings,
+    Sections,
+    map_file_with_id,
+    string_table_bytes,
+    uint32_bytes,
+)
 
 
 class ClueDBRecord(object):
+    '''One use of an answer for a clue, as a line of a clue archive:
+
+        answer (26 columns), num, year, source (3 columns), then the clue
+    '''
 
     def __init__(self, text, answer, source=None, year=None, num=None):
         self.text = text
@@ -20,22 +53,116 @@ class ClueDBRecord(object):
             year = int(line[28:32])
         except ValueError:
             year = -1
-        source = line[33:36]
+        source = line[33:36].rstrip()
         text = line[37:].rstrip()
         return cls(text, answer, source, year, num)
 
+    def format(self):
+        '''The record as a line that parse() reads back, without a newline
+
+        Raises ValueError if the answer or source does not fit in its column.
+        '''
+        if len(self.answer) > 26:
+            raise ValueError('Answer too long for a ClueDB record: %s'
+                             % self.answer)
+        if self.source is not None and len(self.source) > 3:
+            raise ValueError('Source too long for a ClueDB record: %s'
+                             % self.source)
+        # Unknown years and sources are written as in the clue archive.
+        year = self.year if self.year is not None and self.year >= 0 else '----'
+        return '%-26s%d %4s %-3s %s' % (
+            self.answer, min(self.num or 0, 9), year, self.source or 'unk',
+            ' '.join(self.text.splitlines()))
+
+    def sort_key(self):
+        '''The clue and answer, normalized as by ClueDB'''
+        return (self.text.lower(), self.answer.upper())
+
     def __str__(self):
         return "%s: %s (%s, %s, %s)" % (
             self.text, self.answer, self.source, self.year, self.num)
 
 
+def parse_puzzle(path, source=None):
+    '''The clue records of a *.puz file with its solution
+
+    The year is taken from the puzzle's copyright notice, if it has one.
+    Clues are on one line without trailing space, as ClueDBRecord.parse
+    reads them back.
+
+    Returns:
+        list(ClueDBRecord)
+    '''
+    with open(path, 'rb') as fd:
+        p = puz.load(fd.read())
+    match = re.search(r'\b(19|20)\d\d\b', p.copyright or '')
+    year = int(match.group(0)) if match else -1
+
+    numbering = p.clue_numbering()
+    answers = []
+    for clue in numbering.across:
+        answers.append((clue, p.solution[clue['cell']:clue['cell'] + clue['len']]))
+    for clue in numbering.down:
+        answers.append((clue, ''.join(p.solution[clue['cell'] + i * p.width]
+                                      for i in range(clue['len']))))
+    return [ClueDBRecord(' '.join(clue['clue'].splitlines()).rstrip(), answer,
+                         source, year, 1)
+            for clue, answer in answers]
+
+
+def write_shard(records, path):
+    '''Writes clue records to a file, sorted for merge_shards
+
+    Records that cannot be formatted are logged and skipped.
+    '''
+    records = sorted(records, key=ClueDBRecord.sort_key)
+    with open(path, 'w', encoding='utf-8') as fd:
+        for record in records:
+            try:
+                line = record.format()
+            except ValueError:
+                ClueDB.logger.exception('Invalid record for: %s', path)
+                continue
+            fd.write(line + '\n')
+
+
+def merge_shards(shards):
+    '''Merges files from write_shard into the distinct clues and their
+    answers, as an external sort: only one record of each file is read at
+    a time.
+
+    Yields:
+        tuples (str, set(str)) of normalized clues and answers, in order
+    '''
+    files = [open(shard, encoding='utf-8') for shard in shards]
+    try:
+        streams = [(ClueDBRecord.parse(line) for line in fd) for fd in files]
+        keys = (record.sort_key()
+                for record in heapq.merge(*streams, key=ClueDBRecord.sort_key))
+        for clue, group in itertools.groupby(keys, key=lambda key: key[0]):
+            yield clue, set(answer for _, answer in group)
+    finally:
+        for fd in files:
+            fd.close()
+
+
 class ClueDB(object):
     logger = logging.getLogger('littleboxes.xword.ClueDB')
 
     def __init__(self, N=3):
-        # Map of clue -> set of answers that have been used for that clue.
+        # Map of clue -> length -> set of answers of that length that have
+        # been used for that clue.
         self._clue_to_answers = {}
-        self._fuzzy_clueset = NGram(N=N)
+        self._fuzzy_clueset = NGramIndex(N=N)
+        # Map of length -> set of ids in self._fuzzy_clueset of the clues
+        # that have an answer of that length.
+        self._clues_by_length = {}
+        self.N = N
+        # Read-only ClueDBSegments of a file from ClueDB.open.  Clues added
+        # since are kept in memory, and every query covers both.
+        self._segments = []
+        # Number of distinct clues in self._segments, once counted.
+        self._n_segment_clues = None
 
     @classmethod
     def load(cls, istream, source=None, year_range=None):
@@ -91,17 +218,222 @@ class ClueDB(object):
         Returns:
             Nothing
         """
-        for clue, answers in self._clue_to_answers.items():
+        self.serialize_answers(file_object, self._all_answers().items())
+
+    @staticmethod
+    def serialize_answers(file_object, clue_answers):
+        """Serialize clues and their answers as by ClueDB.serialize, one at
+        a time, without building a ClueDB
+
+        Arguments:
+            file_object: a binary file open for writing
+            clue_answers: iterable(tuple(str, iterable(str))) of distinct
+                clues and their answers
+        """
+        for clue, answers in clue_answers:
             msgpack.pack((clue, list(answers)), file_object)
 
+    @classmethod
+    def open(cls, path):
+        """Memory-map a ClueDB file written by ClueDB.save
+
+        Nothing is decoded up front: clues and answers are read from the
+        mapped pages as queries need them, and the fuzzy index is searched
+        in place, so the pages are shared by every process that opens the
+        file.  Clues can still be added; they are kept in memory.
+
+        Each segment of the file, as from ClueDB.append, is searched in
+        turn.  An incomplete segment at the end, from an append that did not
+        finish, is ignored.
+
+        Raises ValueError if the file is not in the expected format.
+        """
+        start = time.time()
+        N, segments, _, _ = cls._map_segments(path)
+        db = cls(N=N)
+        db._segments = segments
+        db.logger.debug('Mapped %d segments of clues in %0.3f seconds',
+                        len(db._segments), time.time() - start)
+        return db
+
+    @property
+    def n_segments(self):
+        '''The number of segments mapped from a file by ClueDB.open'''
+        return len(self._segments)
+
+    @classmethod
+    def append(cls, path, clue_answers, N=3):
+        """Add clues and their answers to a ClueDB file as a new segment
+
+        The rest of the file is neither read nor rewritten, so the cost
+        depends only on the new clues.  Queries search each segment, so a
+        file with many segments should be compacted from time to time.
+
+        Changes to the file are serialized by locking a "<path>.lock" file
+        next to it (where fcntl is available), which is left in place.
+
+        Arguments:
+            path: a file written by ClueDB.save, which is created with
+                fuzzy index N if it does not exist
+            clue_answers: normalized clues and their normalized answers, as
+                for ClueDB.save_answers
+
+        Returns:
+            int: the number of segments in the file
+        """
+        with _locked(path):
+            cls._create(path, N)
+            N, segments, end, _ = cls._map_segments(path)
+            with open(path, 'r+b') as ostream:
+                # Drop what is left of an append that did not finish.
+                ostream.truncate(end)
+                ostream.seek(end)
+                ClueDBSegment.write(ostream, clue_answers, N)
+        return len(segments) + 1
+
+    @classmethod
+    def merge(cls, path, other_path):
+        """Add the clues of another ClueDB file to a ClueDB file
+
+        The segments of other_path are copied to the end of path as they
+        are, without being decoded or indexed again.  The two files must
+        have the same fuzzy index N.  path is created if it does not exist,
+        and is locked as by ClueDB.append.
+
+        Returns:
+            int: the number of segments in path
+        """
+        other_N, other_segments, other_end, _ = cls._map_segments(other_path)
+        with _locked(path):
+            cls._create(path, other_N)
+            N, segments, end, _ = cls._map_segments(path)
+            if N != other_N:
+                raise ValueError('Cannot merge a ClueDB file of %d-grams into '
+                                 'one of %d-grams' % (other_N, N))
+            with open(path, 'r+b') as ostream, open(other_path, 'rb') as istream:
+                ostream.truncate(end)
+                ostream.seek(end)
+                istream.seek(len(_MAGIC) + _HEADER.size)
+                _copy(istream, ostream, other_end - istream.tell())
+        return len(segments) + len(other_segments)
+
+    @classmethod
+    def compact(cls, path, background=False):
+        """Rewrite a ClueDB file as a single segment
+
+        The new file is written next to the old one and moved into its
+        place, so processes that have the old file open keep reading it.
+        Segments appended while the new file is written are copied to its
+        end before it is moved, while holding the "<path>.lock" file that
+        ClueDB.append locks; the lock file is left in place.
+
+        Arguments:
+            background: if True, compact in a background thread.  Files are
+                compacted one at a time, in the order they were requested.
+
+        Returns:
+            concurrent.futures.Future of the compaction if background is
+                True, or else nothing
+        """
+        if background:
+            return _compactor().submit(cls.compact, path)
+
+        start = time.time()
+        N, segments, end, file_id = cls._map_segments(path)
+        db = cls(N=N)
+        db._segments = segments
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.compact-', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                db.save(ostream)
+                with _locked(path):
+                    _, _, new_end, new_id = cls._map_segments(path)
+                    if new_id != file_id:
+                        cls.logger.warning('%s was replaced while it was being '
+                                           'compacted', path)
+                        os.remove(tmp_path)
+                        return
+                    with open(path, 'rb') as istream:
+                        istream.seek(end)
+                        _copy(istream, ostream, new_end - end)
+                    ostream.flush()
+                    os.fsync(ostream.fileno())
+                    shutil.copymode(path, tmp_path)
+                    os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        cls.logger.info('Compacted %d segments of %s in %0.3f seconds',
+                        len(segments), path, time.time() - start)
+
+    @staticmethod
+    def _map_segments(path):
+        '''Maps a ClueDB file
+
+        Returns:
+            tuple(int, list(ClueDBSegment), int, tuple): the N of the fuzzy
+                index, the complete segments, the end of the last one, and
+                the identity of the file, from mapped.map_file_with_id
+        '''
+        buf, file_id = map_file_with_id(path)
+        N = _read_header(buf, path)
+        segments, end = _read_segments(buf, N, path, file_id)
+        return N, segments, end, file_id
+
+    @staticmethod
+    def _create(path, N):
+        '''Writes the header of a ClueDB file with no segments, unless the
+        file already exists'''
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as ostream:
+                ostream.write(_MAGIC)
+                ostream.write(_HEADER.pack(_VERSION, N))
+
+    def save(self, file_object):
+        """Write the ClueDB in the binary format read by ClueDB.open
+
+        The file starts with a magic string, the version and the N of the
+        fuzzy index, followed by a segment with every clue; see
+        ClueDBSegment.write.
+
+        Arguments:
+            file_object: a binary file open for writing
+        """
+        self.save_answers(file_object, self._all_answers(), self.N)
+
+    @staticmethod
+    def save_answers(file_object, clue_answers, N=3):
+        """Write clues and their answers as by ClueDB.save, without building
+        a ClueDB
+
+        Arguments:
+            file_object: a binary file open for writing
+            clue_answers: dict(str: set(str)) of normalized clues and their
+                normalized answers, or an iterable of (clue, answers) pairs
+                in order of the clues' UTF-8 encoding, as from merge_shards,
+                which are read one at a time
+            N: the N of the fuzzy index
+
+        Raises ValueError if the clues of an iterable are out of order.
+        """
+        file_object.write(_MAGIC)
+        file_object.write(_HEADER.pack(_VERSION, N))
+        ClueDBSegment.write(file_object, clue_answers, N)
+
     def add(self, clue, answer):
         '''Add a clue-answer pair to the DB.'''
         clue = self._normalize_clue(clue)
         answer = self._normalize_answer(answer)
         if clue not in self._clue_to_answers:
-            self._clue_to_answers[clue] = set()
-        self._clue_to_answers[clue].add(answer)
-        self._fuzzy_clueset.add(clue)
+            self._clue_to_answers[clue] = {}
+        by_length = self._clue_to_answers[clue]
+        if len(answer) not in by_length:
+            by_length[len(answer)] = set()
+            clue_id = self._fuzzy_clueset.add(clue)
+            self._clues_by_length.setdefault(len(answer), set()).add(clue_id)
+        by_length[len(answer)].add(answer)
 
     def search(self, clue, threshold=1.0):
         '''Search the DB for clues similar to @clue.
@@ -118,19 +450,118 @@ class ClueDB(object):
         clue = self._normalize_clue(clue)
         # NOTE: Performance hack for when doing exact matches.
         if threshold == 1.0:
-            if clue in self._clue_to_answers:
+            if self._has_clue(clue):
                 return {(clue, 1.0)}
             else:
                 return {}
-        return self._fuzzy_clueset.search(clue, threshold=threshold)
+        matches = self._fuzzy_clueset.search(clue, threshold=threshold)
+        if not self._segments:
+            return matches
+        return self._merge_matches(
+            [matches] + [segment.fuzzy.search(clue, threshold=threshold)
+                         for segment in self._segments])
+
+    def search_many(self, queries, threshold=1.0):
+        '''Search the DB for clues similar to each of several clues at once,
+        such as all of the clues of a puzzle, with their answers.
+
+        The clues are normalized once, repeated clues are only searched
+        for once, and the N-gram index is scanned once for all of them.
+
+        Args:
+            queries (iterable(tuple(str, int))): The search strings, and the
+                length of the answers to return for each.
+            threshold (float, 0.0-1.0): Fraction of similar N-grams
+                in clue required for match.
+
+        Returns:
+            list(list(tuple(str, float, set(str)))): For each query, in the
+                same order, the matching clues that have answers of the
+                requested length, with their similarity and those answers,
+                in descending order from most similar.
+        '''
+        queries = [(self._normalize_clue(clue), length)
+                   for clue, length in queries]
+        distinct = sorted(set(queries))
+        if threshold == 1.0:
+            matches = [[(clue, 1.0)] if self._has_clue(clue, length) else []
+                       for clue, length in distinct]
+        else:
+            # Only clues with an answer of the right length can match.
+            empty = set()
+            texts = [clue for clue, _ in distinct]
+            matches = self._fuzzy_clueset.search_many(
+                texts, threshold,
+                [self._clues_by_length.get(length, empty)
+                 for _, length in distinct])
+            if self._segments:
+                searches = [matches] + [
+                    segment.fuzzy.search_many(
+                        texts, threshold,
+                        [segment.clues_of_length(length)
+                         for _, length in distinct])
+                    for segment in self._segments]
+                matches = [self._merge_matches(lists)
+                           for lists in zip(*searches)]
+        matches = dict(zip(distinct, matches))
+
+        return [[(match, similarity, self.answers(match, length))
+                 for match, similarity in matches[clue, length]]
+                for clue, length in queries]
 
     def answers(self, clue, length=None):
         '''Get previous answers for @clue.'''
         clue = self._normalize_clue(clue)
-        answers = self._clue_to_answers[clue]
-        if length is not None:
-            return set(answer for answer in answers if len(answer) == length)
-        return set(answers)
+        found = clue in self._clue_to_answers
+        if found:
+            by_length = self._clue_to_answers[clue]
+            if length is not None:
+                answers = set(by_length.get(length, ()))
+            else:
+                answers = set().union(*by_length.values())
+        else:
+            answers = set()
+
+        for segment in self._segments:
+            clue_id = segment.find(clue)
+            if clue_id is not None:
+                found = True
+                answers |= segment.answers(clue_id, length)
+        if not found:
+            raise KeyError(clue)
+        return answers
+
+    def _has_clue(self, clue, length=None):
+        '''Whether the normalized clue is in the DB, with an answer of
+        length if given'''
+        by_length = self._clue_to_answers.get(clue)
+        if by_length is not None and (length is None or length in by_length):
+            return True
+        for segment in self._segments:
+            clue_id = segment.find(clue)
+            if clue_id is not None and (
+                    length is None or segment.answers(clue_id, length)):
+                return True
+        return False
+
+    def _all_answers(self):
+        '''Map of clue -> set of answers, for every clue in the DB'''
+        answers = {}
+        for segment in self._segments:
+            for clue, clue_answers in segment:
+                answers.setdefault(clue, set()).update(clue_answers)
+        for clue, by_length in self._clue_to_answers.items():
+            answers.setdefault(clue, set()).update(*by_length.values())
+        return answers
+
+    @staticmethod
+    def _merge_matches(match_lists):
+        '''Combines the results of searching several fuzzy indexes, which
+        give a clue the same similarity wherever it is found'''
+        matches = {}
+        for match_list in match_lists:
+            matches.update(match_list)
+        return sorted(matches.items(), key=lambda match: (-match[1], match[0]))
 
     def _normalize_clue(self, clue):
         return clue.lower()
@@ -139,7 +570,304 @@ class ClueDB(object):
         return answer.upper()
 
     def __len__(self):
-        return len(self._clue_to_answers)
+        '''The number of distinct clues
+
+        With one mapped segment, this is constant time.  With several, the
+        first call looks up each clue of all but the largest segment in the
+        larger ones, without decoding, and the count is kept.  Clues added
+        in memory are each looked up in the segments.
+        '''
+        if not self._segments:
+            return len(self._clue_to_answers)
+        if self._n_segment_clues is None:
+            self._n_segment_clues = self._count_segment_clues()
+        return self._n_segment_clues + sum(
+            1 for clue in self._clue_to_answers
+            if all(segment.find(clue) is None for segment in self._segments))
+
+    def _count_segment_clues(self):
+        '''The number of distinct clues across the mapped segments'''
+        segments = sorted(self._segments, key=len, reverse=True)
+        total = len(segments[0])
+        for i, segment in enumerate(segments[1:], 1):
+            larger = segments[:i]
+            total += sum(
+                1 for key in segment.clues.iter_encoded()
+                if all(other.clues.find_encoded(key) is None
+                       for other in larger))
+        return total
 
     def __eq__(self, other):
-        return (self._clue_to_answers == other._clue_to_answers)
+        return (self._all_answers() == other._all_answers())
+
+
+class ClueDBSegment(object):
+    '''A read-only set of clues and answers, in a block of a file written
+    by ClueDB.save
+
+    The answers are interned in a table sorted by string, and the clues in a
+    table sorted by their UTF-8 encoding, so that a clue's id is its position
+    and lookups bisect the table.  Both are decoded only when they are read.
+    The rest of the block is flat arrays of ids:
+
+        the answer ids of each clue, sorted by length (CSR: an array of the
+            start of each clue's run, and the runs one after another)
+        the ids of the clues with an answer of each length (CSR, by length)
+        the N-gram postings of the clues, as from NGramIndex.to_arrays
+    '''
+
+    def __init__(self, buf, offset, N=3, path=None, file_id=None):
+        '''Reads the segment at offset in buf
+
+        Arguments:
+            buf: a buffer (e.g. an mmap) of a file written by ClueDB.save
+            offset: the position of the segment in buf
+            N: the N of the fuzzy index, from the file header
+            path: the file that buf maps, if any.  A segment with a path is
+                pickled as a reference to the file rather than its arrays.
+            file_id: the identity of the file at path, as from
+                mapped.map_file_with_id
+
+        Raises ValueError if there is no complete segment at offset.
+        '''
+        sections = Sections(buf, offset)
+        if sections.tag != _SEGMENT or len(sections) != _N_SECTIONS:
+            raise ValueError('No ClueDB segment at offset %d' % offset)
+        self.size = sections.size
+        self._mapping = None
+        if path is not None:
+            self._mapping = (path, offset, N, file_id)
+
+        self._answers = MappedStrings(sections.uint32s(_ANSWER_OFFSETS),
+                                      sections.raw(_ANSWERS))
+        self.clues = MappedStrings(sections.uint32s(_CLUE_OFFSETS),
+                                   sections.raw(_CLUES))
+        self._clue_starts = sections.uint32s(_CLUE_STARTS)
+        self._clue_answers = sections.uint32s(_CLUE_ANSWERS)
+        self._lengths = sections.uint32s(_LENGTHS)
+        self._length_starts = sections.uint32s(_LENGTH_STARTS)
+        self._length_clues = sections.uint32s(_LENGTH_CLUES)
+        self.fuzzy = NGramIndex.from_arrays(
+            self.clues, sections.uint32s(_GRAM_COUNTS),
+            MappedStrings(sections.uint32s(_GRAM_OFFSETS),
+                          sections.raw(_GRAMS)),
+            sections.uint32s(_POSTING_STARTS), sections.uint32s(_POSTINGS),
+            N=N)
+
+    @staticmethod
+    def write(file_object, clue_answers, N=3):
+        '''Writes a segment
+
+        The clues are read one at a time, so given a stream in order (e.g.
+        from merge_shards) only the tables and the fuzzy index of the
+        segment are held in memory.
+
+        Arguments:
+            file_object: a binary file open for writing
+            clue_answers: dict(str: set(str)) of normalized clues and their
+                answers, or an iterable of (clue, answers) pairs of distinct
+                clues in order of their UTF-8 encoding
+            N: the N of the fuzzy index
+
+        Returns:
+            int: the number of bytes written
+
+        Raises ValueError if the clues of an iterable are out of order.
+        '''
+        if isinstance(clue_answers, dict):
+            clue_answers = sorted(clue_answers.items(),
+                                  key=lambda item: item[0].encode('utf-8'))
+
+        # Answers are numbered as they are seen, and renumbered in order
+        # once they are all known.
+        answers = []
+        answer_ids = {}
+        clue_starts = array(UINT32, [0])
+        ids = array(UINT32)
+        by_length = {}
+        fuzzy = NGramIndex(N=N)
+        last = None
+        for clue_id, (clue, answer_set) in enumerate(clue_answers):
+            key = clue.encode('utf-8')
+            if last is not None and key <= last:
+                raise ValueError('Clues out of order at %r' % clue)
+            last = key
+            fuzzy.add(clue)
+            ordered = sorted(answer_set,
+                             key=lambda answer: (len(answer), answer))
+            for answer in ordered:
+                if answer not in answer_ids:
+                    answer_ids[answer] = len(answers)
+                    answers.append(answer)
+                ids.append(answer_ids[answer])
+            clue_starts.append(len(ids))
+            for length in set(len(answer) for answer in ordered):
+                by_length.setdefault(length, []).append(clue_id)
+
+        order = sorted(range(len(answers)), key=answers.__getitem__)
+        renumbered = array(UINT32, [0]) * len(answers)
+        for answer_id, seen_id in enumerate(order):
+            renumbered[seen_id] = answer_id
+        ids = array(UINT32, (renumbered[seen_id] for seen_id in ids))
+        answers = [answers[seen_id] for seen_id in order]
+        clues = fuzzy.items
+
+        lengths = sorted(by_length)
+        length_starts = [0]
+        length_clues = []
+        for length in lengths:
+            length_clues.extend(by_length[length])
+            length_starts.append(len(length_clues))
+
+        gram_counts, grams, posting_starts, postings = fuzzy.to_arrays()
+        answer_offsets, answer_blob = string_table_bytes(answers)
+        clue_offsets, clue_blob = string_table_bytes(clues)
+        gram_offsets, gram_blob = string_table_bytes(grams)
+        sections = [
+            answer_offsets, answer_blob,
+            clue_offsets, clue_blob,
+            uint32_bytes(clue_starts), uint32_bytes(ids),
+            uint32_bytes(lengths), uint32_bytes(length_starts),
+            uint32_bytes(length_clues),
+            gram_offsets, gram_blob,
+            uint32_bytes(posting_starts), uint32_bytes(postings),
+            uint32_bytes(gram_counts),
+        ]
+        return Sections.write(file_object, _SEGMENT, sections)
+
+    def __len__(self):
+        return len(self.clues)
+
+    def __iter__(self):
+        '''Iterates over (clue, set of answers) pairs'''
+        for clue_id, clue in enumerate(self.clues):
+            yield clue, self.answers(clue_id)
+
+    def find(self, clue):
+        '''The id of a normalized clue, or None'''
+        return self.clues.find(clue)
+
+    def answers(self, clue_id, length=None):
+        '''The answers of a clue, of length if given'''
+        answers = (self._answers[answer_id] for answer_id in
+                   self._clue_answers[self._clue_starts[clue_id]:
+                                      self._clue_starts[clue_id + 1]])
+        if length is None:
+            return set(answers)
+        return set(answer for answer in answers if len(answer) == length)
+
+    def clues_of_length(self, length):
+        '''The ids of the clues with an answer of length, for `in` tests'''
+        i = bisect.bisect_left(self._lengths, length)
+        if i == len(self._lengths) or self._lengths[i] != length:
+            return _SortedIds(())
+        return _SortedIds(self._length_clues[self._length_starts[i]:
+                                             self._length_starts[i + 1]])
+
+    def __getstate__(self):
+        if self._mapping is None:
+            raise TypeError('Cannot pickle a ClueDBSegment without a path')
+        # Unpickling maps the file again rather than copying the arrays.
+        return {'_mapping': self._mapping}
+
+    def __setstate__(self, state):
+        path, offset, N, file_id = state['_mapping']
+        buf, mapped_id = map_file_with_id(path)
+        if mapped_id != file_id:
+            # The offset is only meaningful in the file that was pickled.
+            raise ValueError('%s was replaced after it was opened' % path)
+        self.__init__(buf, offset, N, path=path, file_id=file_id)
+
+
+class _SortedIds(object):
+    '''A sorted array of ids, with `in` tests by bisection'''
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __contains__(self, item_id):
+        i = bisect.bisect_left(self._ids, item_id)
+        return i < len(self._ids) and self._ids[i] == item_id
+
+
+def _read_header(buf, path):
+    '''Checks the header of a mapped ClueDB file, and returns the N of its
+    fuzzy index'''
+    if buf[:len(_MAGIC)] != _MAGIC:
+        raise ValueError('%s is not a ClueDB file' % path)
+    if len(buf) < len(_MAGIC) + _HEADER.size:
+        raise ValueError('Truncated ClueDB file %s' % path)
+    version, N = _HEADER.unpack_from(buf, len(_MAGIC))
+    if version != _VERSION:
+        raise ValueError('Unsupported ClueDB file version %d in %s'
+                         % (version, path))
+    return N
+
+
+def _read_segments(buf, N, path, file_id=None):
+    '''The complete segments of a mapped ClueDB file, and the end of the
+    last one'''
+    segments = []
+    offset = len(_MAGIC) + _HEADER.size
+    while offset < len(buf):
+        try:
+            segment = ClueDBSegment(buf, offset, N, path=path, file_id=file_id)
+        except ValueError:
+            ClueDB.logger.warning('Ignoring an incomplete segment at offset '
+                                  '%d of %s', offset, path)
+            break
+        segments.append(segment)
+        offset += segment.size
+    return segments, offset
+
+
+def _copy(istream, ostream, n_bytes):
+    '''Copies n_bytes from istream to ostream'''
+    while n_bytes > 0:
+        chunk = istream.read(min(n_bytes, 1 << 20))
+        if not chunk:
+            raise ValueError('Unexpected end of file')
+        ostream.write(chunk)
+        n_bytes -= len(chunk)
+
+
+@contextlib.contextmanager
+def _locked(path):
+    '''Holds an exclusive lock on changes to a ClueDB file, where fcntl is
+    available, by locking a .lock file next to it'''
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_COMPACTOR = None
+_COMPACTOR_LOCK = threading.Lock()
+
+
+def _compactor():
+    '''The executor for ClueDB.compact(background=True)'''
+    global _COMPACTOR
+    with _COMPACTOR_LOCK:
+        if _COMPACTOR is None:
+            _COMPACTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return _COMPACTOR
+
+
+# Layout of the binary format written by ClueDB.save: a magic string, then the
+# version and the N of the fuzzy index, then one or more segments (one per
+# ClueDB.save or ClueDB.append), each a mapped.Sections block tagged _SEGMENT
+# with these arrays in this order.
+_MAGIC = b'LBCLUEDB'
+_VERSION = 1
+_HEADER = struct.Struct('<II')
+_SEGMENT = b'CSEG'
+(_ANSWER_OFFSETS, _ANSWERS, _CLUE_OFFSETS, _CLUES, _CLUE_STARTS, _CLUE_ANSWERS,
+ _LENGTHS, _LENGTH_STARTS, _LENGTH_CLUES, _GRAM_OFFSETS, _GRAMS,
+ _POSTING_STARTS, _POSTINGS, _GRAM_COUNTS) = range(14)
+_N_SECTIONS = 14
@@ -3,11 +3,25 @@ Created on Dec 27, 2015
 
 @author: justinpalpant
 '''
+from array import array
+import bisect
+import heapq
 import itertools
 import logging
+import math
+import random
+import re
+import struct
 import time
 import collections
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from littleboxes.mapped import map_file, padded, uint32_bytes, uint32_view
+
 
 class Dictionary(object):
     '''Stores a dictionary of words as a dictionary of length-binned Tries
@@ -19,7 +33,7 @@ class Dictionary(object):
         Finding all words of length matching pattern (MUCH faster than list)
     '''
 
-    def __init__(self, fast=True):
+    def __init__(self, fast=True, index='trie', cache_size=None):
         '''Creates an empty Dictionary
 
         Initializes logging and the dict used to store Tries. The boolean fast
@@ -27,19 +41,45 @@ class Dictionary(object):
         you probably shouldn't use this class) - it causes each Trie to store a
         master list of words to speed up the special case when you want all
         words of a given length.
+
+        The string index selects the structure used for each length bin:
+            'trie': a Trie (the default)
+            'bitset': a BitsetIndex, which answers pattern queries with a
+                few bitwise ANDs instead of a tree walk
+            'compact': a CompactTrie, which stores the trie in flat arrays
+                and uses several times less memory
+            'dawg': a Dawg, which also merges the states for common suffixes
+            'numpy': a LetterMatrix, which matches patterns with vectorized
+                NumPy comparisons (requires NumPy)
+
+        If cache_size is given, the results of up to that many get_words
+        queries are kept, and the least recently used are evicted first.  A
+        query that is not cached, but that has one more letter than a cached
+        query, is answered by refining the cached words rather than from the
+        tries.  count_words and sample_word then answer from the cached
+        words too.  See cache_info for the hit, miss and eviction counts.
         '''
+        if index not in INDEXES:
+            raise ValueError("Unknown index type %r (expected one of %s)" % (
+                index, ', '.join(sorted(INDEXES))))
+        if cache_size is not None and cache_size < 1:
+            raise ValueError("cache_size must be positive, not %r" % cache_size)
 
         self.fast = fast
+        self.index = index
         self.binned_tries = {}
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._hits = self._misses = self._evictions = self._refinements = 0
         self.logger = logging.getLogger('Dictionary.logger')
         if self.fast:
             self.logger.debug('Created a FAST Dictionary')
 
     @classmethod
-    def load(cls, istream, fast=False):
+    def load(cls, istream, fast=False, index='trie', cache_size=None):
         '''Load a line-delineated text file with one word per line'''
         start = time.time()
-        dictionary = cls(fast=fast)
+        dictionary = cls(fast=fast, index=index, cache_size=cache_size)
 
         for line in istream:
             dictionary.add(line)
@@ -49,6 +89,84 @@ class Dictionary(object):
 
         return dictionary
 
+    @classmethod
+    def open(cls, path, fast=False, cache_size=None):
+        '''Memory-map a Dictionary file written by Dictionary.save
+
+        The file is not read up front: queries run against the mapped pages,
+        which the operating system shares between all of the processes that
+        open the same file.  Each length bin is a CompactTrie, and words can
+        still be added, in which case that bin is copied into memory.
+
+        Raises ValueError if the file is not in the expected format.
+        '''
+        start = time.time()
+        dictionary = cls(fast=fast, index='compact', cache_size=cache_size)
+
+        buf = map_file(path)
+        if buf[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('%s is not a Dictionary file' % path)
+        offset = len(_MAGIC) + _HEADER.size
+        if len(buf) < offset:
+            raise ValueError('Truncated Dictionary file %s' % path)
+        version, n_bins = _HEADER.unpack_from(buf, len(_MAGIC))
+        if version != _VERSION:
+            raise ValueError('Unsupported Dictionary file version %d in %s'
+                             % (version, path))
+        if len(buf) < offset + n_bins * _BIN.size:
+            raise ValueError('Truncated Dictionary file %s' % path)
+
+        for _ in range(n_bins):
+            length, size, n_nodes, bin_offset = _BIN.unpack_from(buf, offset)
+            if bin_offset + CompactTrie.buffer_size(n_nodes) > len(buf):
+                raise ValueError('Truncated Dictionary file %s' % path)
+            dictionary.binned_tries[length] = CompactTrie.from_buffer(
+                buf, bin_offset, n_nodes, size, path=path)
+            offset += _BIN.size
+
+        dictionary.logger.debug('Mapped %d words into %d nodes in %0.3f seconds',
+                                dictionary.size, dictionary.nodes, time.time() - start)
+
+        return dictionary
+
+    def save(self, file_object):
+        '''Write the Dictionary in the binary format read by Dictionary.open
+
+        The file starts with a magic string, a version and a table with the
+        word length, word count, node count and data offset of every bin.
+        The data for each bin are the arrays of a CompactTrie: first_child
+        and counts as little-endian 32-bit integers, then letters and
+        is_terminal as bytes, each padded to a multiple of four bytes.
+
+        Arguments:
+            file_object: a binary file-like object supporting .write(bytes)
+        '''
+        tries = []
+        for length in sorted(self.binned_tries):
+            trie = self.binned_tries[length]
+            if not isinstance(trie, CompactTrie):
+                words = trie
+                trie = CompactTrie()
+                for word in words:
+                    trie.add(word)
+            trie._build()
+            tries.append((length, trie))
+
+        file_object.write(_MAGIC)
+        file_object.write(_HEADER.pack(_VERSION, len(tries)))
+
+        offset = len(_MAGIC) + _HEADER.size + _BIN.size * len(tries)
+        blocks = []
+        for length, trie in tries:
+            block = trie.to_bytes()
+            file_object.write(_BIN.pack(length, trie.size, len(trie.letters),
+                                        offset))
+            blocks.append(block)
+            offset += len(block)
+
+        for block in blocks:
+            file_object.write(block)
+
     @property
     def nodes(self):
         return sum(t.node_count for t in self.binned_tries.values())
@@ -69,10 +187,14 @@ class Dictionary(object):
         word = Dictionary._normalize_word(word)
 
         try:
-            self.binned_tries[len(word)].add(word)
+            trie = self.binned_tries[len(word)]
         except KeyError:
-            self.binned_tries[len(word)] = Trie(fast=self.fast)
-            self.binned_tries[len(word)].add(Dictionary._normalize_word(word))
+            trie = self.binned_tries[len(word)] = INDEXES[self.index](fast=self.fast)
+
+        size = trie.size
+        trie.add(word)
+        if self._cache and trie.size != size:
+            self._invalidate(len(word))
 
     def get_words(self, **kwargs):
         '''Returns all words in the dictionary matching pattern and length
@@ -84,34 +206,178 @@ class Dictionary(object):
                 specified, any length is allowed
             pattern: a dict mapping integers to letters, where the integer is
                 the location of the letter in the string.  If not given, returns 
-                all words of length
+                all words of length.  The frozen form from freeze_pattern is
+                also accepted.
             e.g. 
                 pattern={0:'c', 3:'q', 4:'u'} would match 'cumquat' 
                 and any other words following c__qu*
         Outputs:
-            A generator that iterates over all strings by length and then in
-            lexical order
+            A list of all matching strings by length and then in lexical
+            order.  See iter_words for a generator.  If the Dictionary has a
+            cache, the list may be shared and should not be modified.
         '''
         p = kwargs.get('pattern', {})
         length = kwargs.get('length', 0)
-        result = []
 
-        # lets us skip short words if pattern specifies that they be long
-        if p:
-            min_length = max(p)
+        if self.cache_size is None:
+            return self._get_words(thaw_pattern(p), length)
+
+        key = (length, freeze_pattern(p))
+        try:
+            result = self._cache[key]
+        except KeyError:
+            self._misses += 1
         else:
-            min_length = 0
+            self._hits += 1
+            self._cache.move_to_end(key)
+            return result
+
+        result = self._refine_cached(key)
+        if result is None:
+            result = self._get_words(thaw_pattern(p), length)
+        else:
+            self._refinements += 1
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self._evictions += 1
+
+        return result
+
+    @staticmethod
+    def refine(candidates, position, letter):
+        '''Narrows down the results of a query to those that also have letter
+        at position, in time proportional to the number of candidates
 
-        if length is not 0 and length in self.binned_tries:
-            result.extend(self.binned_tries[length].get_words(pattern=p))
+        e.g. refine(get_words(pattern={0: 'C'}), 2, 'T') returns the same
+        words as get_words(pattern={0: 'C', 2: 'T'}).
+        '''
+        return [word for word in candidates
+                if word[position:position + 1] == letter]
+
+    def cache_info(self):
+        '''Returns the hit, miss and eviction counts of the get_words cache,
+        and how many of the misses were answered by refining a cached query
+        '''
+        return CacheInfo(self._hits, self._misses, self._evictions,
+                         self._refinements, self.cache_size, len(self._cache))
+
+    def _refine_cached(self, key):
+        '''Answers a query from a cached query for the same length with one
+        letter fewer, or returns None if there is none'''
+        length, pattern = key
+        for i, (position, letter) in enumerate(pattern):
+            broader = (length, pattern[:i] + pattern[i + 1:])
+            try:
+                candidates = self._cache[broader]
+            except KeyError:
+                continue
+            self._cache.move_to_end(broader)
+            return self.refine(candidates, position, letter)
+
+        return None
+
+    def _get_words(self, pattern, length):
+        '''Looks up the words matching pattern and length in the tries'''
+        result = []
 
-        elif length is 0:
-            for l, trie in self.binned_tries.items():
-                if l >= min_length:
-                    result.extend(trie.get_words(pattern=p))
+        for trie in self._bins(pattern, length):
+            result.extend(trie.get_words(pattern=pattern))
 
         return result
 
+    def _invalidate(self, length):
+        '''Drops the cached results that could include words of length'''
+        for key in [key for key in self._cache if key[0] in (0, length)]:
+            del self._cache[key]
+
+    def iter_words(self, pattern={}, length=0):
+        '''Yields the words that get_words would return, one at a time
+
+        Nothing is materialized, so this is cheaper than get_words for callers
+        that only need the first few matches, unless the query is already in
+        the cache.
+        '''
+        if self.cache_size is not None:
+            cached = self._cache.get((length, freeze_pattern(pattern)))
+            if cached is not None:
+                for word in cached:
+                    yield word
+                return
+
+        pattern = thaw_pattern(pattern)
+        for trie in self._bins(pattern, length):
+            for word in trie.iter_words(pattern):
+                yield word
+
+    def count_words(self, pattern={}, length=0):
+        '''Returns the number of words that get_words would return
+
+        With a cache, this is the length of the cached get_words result;
+        otherwise the indexes count the words without listing them.
+        '''
+        if self.cache_size is not None:
+            return len(self.get_words(pattern=pattern, length=length))
+
+        pattern = thaw_pattern(pattern)
+        return sum(trie.count_words(pattern)
+                   for trie in self._bins(pattern, length))
+
+    def sample_word(self, pattern={}, length=0):
+        '''Returns a word chosen uniformly at random from those that get_words
+        would return, or None if there are none
+
+        With a cache, the word is chosen from the cached get_words result.
+        '''
+        if self.cache_size is not None:
+            words = self.get_words(pattern=pattern, length=length)
+            return random.choice(words) if words else None
+
+        pattern = thaw_pattern(pattern)
+        counts = [(trie, trie.count_words(pattern))
+                  for trie in self._bins(pattern, length)]
+        k = random.randrange(sum(n for _, n in counts) or 1)
+        for trie, n in counts:
+            if k < n:
+                return trie.sample_word(pattern)
+            k -= n
+
+        return None
+
+    def letter_counts(self, position, pattern={}, length=0):
+        '''Returns a dict of how many of the words that get_words would return
+        have each letter at position
+
+        A LetterMatrix answers this with a single vectorized count; the other
+        indexes count the letters of each matching word.
+        '''
+        pattern = thaw_pattern(pattern)
+        counts = collections.Counter()
+        for trie in self._bins(pattern, length):
+            if isinstance(trie, LetterMatrix):
+                counts.update(trie.letter_counts(position, pattern))
+            else:
+                counts.update(word[position] for word in trie.iter_words(pattern)
+                              if len(word) > position)
+
+        return dict(counts)
+
+    def _bins(self, pattern, length):
+        '''Returns the tries that can hold words matching pattern and length'''
+        if length:
+            if length in self.binned_tries:
+                return [self.binned_tries[length]]
+            return []
+
+        # lets us skip short words if pattern specifies that they be long
+        if pattern:
+            min_length = max(pattern)
+        else:
+            min_length = 0
+
+        return [trie for l, trie in self.binned_tries.items() if l >= min_length]
+
     def is_word(self, word):
         '''Checks the dictionary to see if it contains a word'''
         word = Dictionary._normalize_word(word)
@@ -190,12 +456,6 @@ class Trie(object):
         Outputs:
             A list of words in the Trie in lexical order
         '''
-        stack = collections.deque()
-        node = self.root
-        depth = -1
-
-        result = []
-
         # special case for high-memory speedup by storing a list of all words
         if self.fast and not pattern:
             if self.list_is_sorted:
@@ -205,6 +465,16 @@ class Trie(object):
                 self.list_is_sorted = True
                 return self.wordslist
 
+        return list(self.iter_words(pattern))
+
+    def iter_words(self, pattern={}):
+        '''Yields all words matching pattern in lexical order, traversing the
+        Trie as it goes rather than building a list
+        '''
+        stack = collections.deque()
+        node = self.root
+        depth = -1
+
         try:
             min_depth = max(pattern)
         except ValueError:
@@ -215,8 +485,7 @@ class Trie(object):
                 depth, node = stack.popleft()
 
             if node.word and depth >= min_depth:
-                self.logger.debug('%s matches ' + str(pattern), str(node))
-                result.append(node.word)
+                yield node.word
 
             if depth + 1 in pattern:
                 try:
@@ -238,11 +507,62 @@ class Trie(object):
                 except IndexError:  # no children
                     node = None
 
-        return result
+    def count_words(self, pattern={}):
+        '''Returns the number of words matching pattern
+
+        Only the levels of the Trie down to the last position in pattern are
+        visited; below that, every word in a subtree matches, and each node
+        stores how many words its subtree holds.
+        '''
+        return sum(node.count for node in self._matching_subtrees(pattern))
+
+    def sample_word(self, pattern={}):
+        '''Returns a word matching pattern chosen uniformly at random, or None
+        if there are none
+        '''
+        subtrees = list(self._matching_subtrees(pattern))
+        k = random.randrange(sum(node.count for node in subtrees) or 1)
+        for node in subtrees:
+            if k >= node.count:
+                k -= node.count
+                continue
+
+            # Descend to the k-th word of the subtree, in lexical order.
+            while True:
+                if node.word:
+                    if not k:
+                        return node.word
+                    k -= 1
+                for c in sorted(node.children):
+                    child = node.children[c]
+                    if k < child.count:
+                        node = child
+                        break
+                    k -= child.count
+
+        return None
+
+    def _matching_subtrees(self, pattern):
+        '''Yields the nodes at depth max(pattern) whose paths match pattern,
+        so that every word in their subtrees matches it'''
+        last = max(pattern) if pattern else -1
+        stack = [(-1, self.root)]
+        while stack:
+            depth, node = stack.pop()
+            if depth >= last:
+                yield node
+            elif depth + 1 in pattern:
+                child = node.children.get(pattern[depth + 1])
+                if child is not None:
+                    stack.append((depth + 1, child))
+            else:
+                for child in node.children.values():
+                    stack.append((depth + 1, child))
 
     def add(self, word):
         '''Adds a word (string only) to the Trie'''
         currentnode = self.root
+        path = [currentnode]
 
         for char in word:
             if char not in currentnode.children:
@@ -250,9 +570,12 @@ class Trie(object):
                 self.node_count += 1
 
             currentnode = currentnode.children[char]
+            path.append(currentnode)
 
         if not currentnode.word:
             currentnode.word = word
+            for node in path:
+                node.count += 1
             self.size += 1
             self.logger.debug('Adding %s to the Trie', word)
             if self.fast:
@@ -268,11 +591,14 @@ class Trie(object):
 
 class Node(object):
     '''Small Node class for use in Trie'''
+    __slots__ = ('children', 'word', 'count')
 
     def __init__(self):
         '''Creates an empty node and empty dictionary of children'''
         self.children = {}
         self.word = None
+        # The number of words in the subtree rooted at this node.
+        self.count = 0
 
     def __str__(self):
         if self.word:
@@ -284,55 +610,1097 @@ class Node(object):
         return self.__str__()
 
 
-def partitions(n):
-    '''Yield all partitions of non-negative integer n.'''
-    if n == 0:
-        yield []
-        return
-    for p in partitions(n-1):
-        yield [1] + p
-        if p and (len(p) < 2 or p[1] > p[0]):
-            yield [p[0] + 1] + p[1:]
+class BitsetIndex(object):
+    '''
+    Stores words of a single length as positional letter bitsets.
+
+    Words are kept in a sorted list, and for every (position, letter) pair the
+    index keeps an integer whose bit i is set if word i has that letter at
+    that position.  A pattern query is then the AND of one bitset per
+    constrained position, decoded back into words in lexical order, so its
+    cost does not depend on how deep the first constrained position is.
+
+    Unlike the Trie, all words in a BitsetIndex should have the same length,
+    which is how the Dictionary bins them.  Bitsets are rebuilt lazily on the
+    first query after words have been added.
+    '''
+
+    def __init__(self, fast=True):
+        '''Creates an empty index and initializes logging.  The boolean fast
+        has the same meaning as for the Trie: unpatterned queries return the
+        master list of words itself rather than a copy.
+        '''
+        self.fast = fast
+        self.wordslist = []
+        self.size = 0
+        self._words = set()
+        self._bitsets = {}
+        self._is_built = True
+        self.logger = logging.getLogger('BitsetIndex.logger')
+
+    @property
+    def node_count(self):
+        '''The number of (position, letter) bitsets in the index'''
+        self._build()
+        return len(self._bitsets)
+
+    def is_word(self, word):
+        '''Checks for the existence of word in the index'''
+        return word in self._words
+
+    def __iter__(self):
+        return self.get_words().__iter__()
+
+    def get_words(self, pattern={}):
+        '''Returns all words matching pattern in lexical order
+
+        See Trie.get_words for the pattern format.
+        '''
+        self._build()
+
+        if not pattern:
+            if self.fast:
+                return self.wordslist
+            return list(self.wordslist)
+
+        return list(self.iter_words(pattern))
+
+    def iter_words(self, pattern={}):
+        '''Yields all words matching pattern in lexical order'''
+        self._build()
+        if not pattern:
+            for word in self.wordslist:
+                yield word
+            return
+
+        words = self.wordslist
+        bits = self._mask(pattern).to_bytes((len(words) + 7) // 8, 'little')
+        for match in _NONZERO_BYTE.finditer(bits):
+            offset = match.start()
+            for bit in _BIT_POSITIONS[bits[offset]]:
+                yield words[(offset << 3) + bit]
+
+    def count_words(self, pattern={}):
+        '''Returns the number of words matching pattern, as the population
+        count of the bitset for pattern'''
+        if not pattern:
+            return self.size
+
+        self._build()
+        return bin(self._mask(pattern)).count('1')
+
+    def sample_word(self, pattern={}):
+        '''Returns a word matching pattern chosen uniformly at random, or None
+        if there are none
+        '''
+        self._build()
+        if not pattern:
+            if not self.wordslist:
+                return None
+            return random.choice(self.wordslist)
+
+        mask = self._mask(pattern)
+        k = random.randrange(bin(mask).count('1') or 1)
+        bits = mask.to_bytes((len(self.wordslist) + 7) // 8, 'little')
+        for match in _NONZERO_BYTE.finditer(bits):
+            offset = match.start()
+            positions = _BIT_POSITIONS[bits[offset]]
+            if k < len(positions):
+                return self.wordslist[(offset << 3) + positions[k]]
+            k -= len(positions)
+
+        return None
+
+    def _mask(self, pattern):
+        '''Returns the bitset of the words matching a non-empty pattern'''
+        mask = -1
+        for position, letter in pattern.items():
+            mask &= self._bitsets.get((position, letter), 0)
+            if not mask:
+                break
+
+        return mask
+
+    def add(self, word):
+        '''Adds a word (string only) to the index'''
+        if word in self._words:
+            self.logger.debug('%s was already in the index', word)
+            return
+
+        self._words.add(word)
+        self.wordslist.append(word)
+        self.size += 1
+        self._is_built = False
+
+    def _build(self):
+        '''Sorts the word list and recomputes every positional bitset'''
+        if self._is_built:
+            return
+
+        self.wordslist.sort()
+        ids = {}
+        for i, word in enumerate(self.wordslist):
+            for position, letter in enumerate(word):
+                try:
+                    ids[position, letter].append(i)
+                except KeyError:
+                    ids[position, letter] = [i]
+
+        nbytes = (len(self.wordslist) + 7) // 8
+        self._bitsets = {}
+        for key, word_ids in ids.items():
+            bits = bytearray(nbytes)
+            for i in word_ids:
+                bits[i >> 3] |= 1 << (i & 7)
+            self._bitsets[key] = int.from_bytes(bits, 'little')
+
+        self._is_built = True
+        self.logger.debug('Built %d bitsets over %d words',
+                          len(self._bitsets), self.size)
+
+
+class LetterMatrix(object):
+    '''
+    Stores words as the rows of a NumPy matrix of letter codes.
+
+    Words are kept in a sorted list, and row i of the (words x letters)
+    uint8 matrix holds the Latin-1 codes of word i, padded with zeros if it
+    is shorter than the longest word.  A pattern query compares one column
+    per constrained position and combines them into a boolean mask over the
+    rows, so it is a few vectorized operations whatever the pattern, and
+    statistics such as letter_counts over the matching words are a
+    numpy.bincount.
+
+    Requires NumPy.  The matrix is rebuilt lazily on the first query after
+    words have been added.
+    '''
+
+    def __init__(self, fast=True):
+        '''Creates an empty index and initializes logging.  The boolean fast
+        has the same meaning as for the Trie: unpatterned queries return the
+        master list of words itself rather than a copy.
+        '''
+        if numpy is None:
+            raise ImportError('LetterMatrix requires NumPy')
+
+        self.fast = fast
+        self.wordslist = []
+        self.size = 0
+        self.matrix = numpy.zeros((0, 0), dtype=numpy.uint8)
+        self._words = set()
+        self._is_built = True
+        self.logger = logging.getLogger('LetterMatrix.logger')
+
+    @property
+    def node_count(self):
+        '''The number of letter cells in the matrix'''
+        self._build()
+        return self.matrix.size
+
+    def is_word(self, word):
+        '''Checks for the existence of word in the index'''
+        return word in self._words
+
+    def __iter__(self):
+        return self.get_words().__iter__()
+
+    def get_words(self, pattern={}):
+        '''Returns all words matching pattern in lexical order
+
+        See Trie.get_words for the pattern format.
+        '''
+        self._build()
+
+        if not pattern:
+            if self.fast:
+                return self.wordslist
+            return list(self.wordslist)
+
+        words = self.wordslist
+        return [words[i] for i in numpy.flatnonzero(self._mask(pattern))]
+
+    def iter_words(self, pattern={}):
+        '''Yields all words matching pattern in lexical order'''
+        for word in self.get_words(pattern):
+            yield word
+
+    def count_words(self, pattern={}):
+        '''Returns the number of words matching pattern'''
+        if not pattern:
+            return self.size
+
+        self._build()
+        return int(numpy.count_nonzero(self._mask(pattern)))
+
+    def sample_word(self, pattern={}):
+        '''Returns a word matching pattern chosen uniformly at random, or None
+        if there are none
+        '''
+        self._build()
+        if not pattern:
+            if not self.wordslist:
+                return None
+            return random.choice(self.wordslist)
+
+        rows = numpy.flatnonzero(self._mask(pattern))
+        if not len(rows):
+            return None
+        return self.wordslist[rows[random.randrange(len(rows))]]
+
+    def letter_counts(self, position, pattern={}):
+        '''Returns a dict of how many words matching pattern have each letter
+        at position'''
+        self._build()
+        if position >= self.matrix.shape[1]:
+            return {}
+
+        column = self.matrix[:, position]
+        if pattern:
+            column = column[self._mask(pattern)]
+        counts = numpy.bincount(column, minlength=256)
+        return dict((chr(code), int(counts[code]))
+                    for code in numpy.flatnonzero(counts[1:]) + 1)
+
+    def add(self, word):
+        '''Adds a word (string only) to the index'''
+        if word in self._words:
+            self.logger.debug('%s was already in the index', word)
+            return
+
+        word.encode('latin-1')  # Raises if the word cannot be stored.
+        self._words.add(word)
+        self.wordslist.append(word)
+        self.size += 1
+        self._is_built = False
+
+    def _mask(self, pattern):
+        '''Returns the boolean mask of the rows matching a non-empty pattern'''
+        width = self.matrix.shape[1]
+        if max(pattern) >= width or any(ord(letter) > 255
+                                        for letter in pattern.values()):
+            # No stored word has a letter there, or a letter outside Latin-1.
+            return numpy.zeros(len(self.wordslist), dtype=bool)
+
+        positions = list(pattern)
+        codes = numpy.array([ord(pattern[p]) for p in positions],
+                            dtype=numpy.uint8)
+        if len(positions) == 1:
+            return self.matrix[:, positions[0]] == codes[0]
+        return (self.matrix[:, positions] == codes).all(axis=1)
+
+    def _build(self):
+        '''Sorts the word list and lays the words out as a matrix'''
+        if self._is_built:
+            return
+
+        self.wordslist.sort()
+        width = max(len(word) for word in self.wordslist)
+        padded = ''.join(word.ljust(width, '\x00') for word in self.wordslist)
+        self.matrix = numpy.frombuffer(padded.encode('latin-1'),
+                                       dtype=numpy.uint8).reshape(-1, width)
+
+        self._is_built = True
+        self.logger.debug('Built a %d x %d letter matrix', *self.matrix.shape)
+
+
+class CompactTrie(object):
+    '''
+    Stores a Trie in flat arrays instead of Node objects.
+
+    Nodes are numbered in breadth-first order, so the children of each node
+    are contiguous and in lexical order: the children of node n are the nodes
+    first_child[n] up to first_child[n + 1].  Each node costs ten bytes (its
+    letter, the offset of its children, whether it ends a word and the
+    number of words below it) rather than a Python object and a dict, and
+    words are not stored at all; they are spelled out along the path to
+    their last node.
+
+    The arrays are rebuilt lazily, from all of the words, on the first query
+    after words have been added, so words should be added in bulk.  Letters
+    must be Latin-1 characters.
+    '''
+
+    def __init__(self, fast=True):
+        '''Creates an empty trie and initializes logging.  The boolean fast is
+        accepted for compatibility with the Trie, but a CompactTrie never
+        keeps a master list of words.
+        '''
+        self.fast = fast
+        self.letters = array('B', [0])
+        self.first_child = array('I', [1, 1])
+        self.is_terminal = bytearray(1)
+        self.counts = array('I', [0])
+        self.size = 0
+        self._pending = set()
+        self._mapping = None
+        self.logger = logging.getLogger('CompactTrie.logger')
+
+    @classmethod
+    def from_buffer(cls, buf, offset, n_nodes, size, path=None):
+        '''Creates a trie whose arrays are views of a buffer, without copying
+
+        Arguments:
+            buf: a buffer (e.g. an mmap) laid out as by CompactTrie.to_bytes
+            offset: the position of the trie's arrays in buf
+            n_nodes: the number of nodes in the trie
+            size: the number of words in the trie
+            path: the file that buf maps, if any.  A trie with a path is
+                pickled as a reference to the file rather than its arrays.
+        '''
+        trie = cls()
+        view = memoryview(buf)
+        start = offset
+        trie.first_child = uint32_view(buf, start, n_nodes + 1)
+        start += 4 * (n_nodes + 1)
+        trie.counts = uint32_view(buf, start, n_nodes)
+        start += 4 * n_nodes
+        trie.letters = view[start:start + n_nodes]
+        start += padded(n_nodes)
+        trie.is_terminal = view[start:start + n_nodes]
+        trie.size = size
+        if path is not None:
+            trie._mapping = (path, offset, n_nodes)
+        return trie
+
+    @staticmethod
+    def buffer_size(n_nodes):
+        '''The number of bytes that from_buffer reads for n_nodes nodes'''
+        return 4 * (n_nodes + 1) + 4 * n_nodes + padded(n_nodes) + n_nodes
+
+    def to_bytes(self):
+        '''Returns the trie's arrays in the layout read by from_buffer'''
+        self._build()
+        n_nodes = len(self.letters)
+        padding = bytes(padded(n_nodes) - n_nodes)
+        return b''.join([uint32_bytes(self.first_child),
+                         uint32_bytes(self.counts),
+                         bytes(self.letters), padding,
+                         bytes(self.is_terminal), padding])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._mapping is not None:
+            # Unpickling maps the file again rather than copying the arrays.
+            for name in ('letters', 'first_child', 'is_terminal', 'counts'):
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._mapping is not None:
+            path, offset, n_nodes = self._mapping
+            mapped = CompactTrie.from_buffer(map_file(path), offset, n_nodes,
+                                             self.size)
+            self.letters = mapped.letters
+            self.first_child = mapped.first_child
+            self.is_terminal = mapped.is_terminal
+            self.counts = mapped.counts
+
+    @property
+    def node_count(self):
+        self._build()
+        return len(self.letters)
+
+    def is_word(self, word):
+        '''Checks for the existence of word in the trie'''
+        if word in self._pending:
+            return True
+
+        node = self._find(word)
+        return node is not None and bool(self.is_terminal[node])
+
+    def __iter__(self):
+        return self.get_words().__iter__()
+
+    def get_words(self, pattern={}):
+        '''Returns all words matching pattern in lexical order
+
+        See Trie.get_words for the pattern format.
+        '''
+        self._build()
+        return list(self._iter_words(pattern))
+
+    def add(self, word):
+        '''Adds a word (string only) to the trie'''
+        if self.is_word(word):
+            self.logger.debug('%s was already in the trie', word)
+            return
+
+        word.encode('latin-1')  # Raises if the word cannot be stored.
+        self._pending.add(word)
+        self.size += 1
+
+    def _find(self, word):
+        '''Returns the node at the end of the path spelling word, or None'''
+        letters = self.letters
+        first_child = self.first_child
+        node = 0
+        for char in word:
+            code = ord(char)
+            lo, hi = first_child[node], first_child[node + 1]
+            node = bisect.bisect_left(letters, code, lo, hi)
+            if node == hi or letters[node] != code:
+                return None
+
+        return node
+
+    def iter_words(self, pattern={}):
+        '''Yields all words matching pattern in lexical order'''
+        self._build()
+        for word in self._iter_words(pattern):
+            yield word
+
+    def count_words(self, pattern={}):
+        '''Returns the number of words matching pattern
+
+        Only the levels of the trie down to the last position in pattern are
+        visited; below that, every word under a node matches, and counts
+        holds how many words there are under each node.
+        '''
+        if not pattern:
+            return self.size
+
+        self._build()
+        counts = self.counts
+        return sum(counts[node] for node, _ in self._matching_subtrees(pattern))
+
+    def sample_word(self, pattern={}):
+        '''Returns a word matching pattern chosen uniformly at random, or None
+        if there are none
+        '''
+        self._build()
+        letters = self.letters
+        first_child = self.first_child
+        is_terminal = self.is_terminal
+        counts = self.counts
+
+        subtrees = list(self._matching_subtrees(pattern))
+        k = random.randrange(sum(counts[node] for node, _ in subtrees) or 1)
+        for node, prefix in subtrees:
+            if k >= counts[node]:
+                k -= counts[node]
+                continue
+
+            # Descend to the k-th word under node, in lexical order.
+            while True:
+                if is_terminal[node]:
+                    if not k:
+                        return prefix
+                    k -= 1
+                for child in range(first_child[node], first_child[node + 1]):
+                    if k < counts[child]:
+                        node = child
+                        prefix += chr(letters[child])
+                        break
+                    k -= counts[child]
+
+        return None
+
+    def _matching_subtrees(self, pattern):
+        '''Yields (node, prefix) for the nodes at depth max(pattern) + 1 whose
+        paths match pattern, so that every word under them matches it'''
+        letters = self.letters
+        first_child = self.first_child
+        last = max(pattern) + 1 if pattern else 0
+
+        stack = [(0, '')]
+        while stack:
+            node, prefix = stack.pop()
+            depth = len(prefix)
+            if depth >= last:
+                yield node, prefix
+                continue
+
+            lo, hi = first_child[node], first_child[node + 1]
+            if depth in pattern:
+                code = ord(pattern[depth])
+                child = bisect.bisect_left(letters, code, lo, hi)
+                if child < hi and letters[child] == code:
+                    stack.append((child, prefix + pattern[depth]))
+            else:
+                for child in range(lo, hi):
+                    stack.append((child, prefix + chr(letters[child])))
+
+    def _iter_words(self, pattern):
+        '''Yields all words matching pattern with a depth-first traversal'''
+        letters = self.letters
+        first_child = self.first_child
+        is_terminal = self.is_terminal
+        min_length = max(pattern) + 1 if pattern else 0
+
+        # Stack of (node, prefix), where prefix spells the path to node.
+        stack = [(0, '')]
+        while stack:
+            node, prefix = stack.pop()
+            depth = len(prefix)
+            if is_terminal[node] and depth >= min_length:
+                yield prefix
+
+            lo, hi = first_child[node], first_child[node + 1]
+            if depth in pattern:
+                code = ord(pattern[depth])
+                child = bisect.bisect_left(letters, code, lo, hi)
+                if child < hi and letters[child] == code:
+                    stack.append((child, prefix + pattern[depth]))
+            else:
+                for child in range(hi - 1, lo - 1, -1):
+                    stack.append((child, prefix + chr(letters[child])))
+
+    def _build(self):
+        '''Lays out the trie for every word, including the pending ones'''
+        if not self._pending:
+            return
+
+        words = sorted(itertools.chain(self._iter_words({}), self._pending))
+        self._pending = set()
+
+        letters = array('B', [0])
+        first_child = array('I')
+        is_terminal = bytearray()
+        counts = array('I')
+
+        # The nodes at each depth, as ranges of the words that pass through
+        # them, in the order they are numbered.
+        level = [(0, len(words))]
+        depth = 0
+        while level:
+            next_level = []
+            for lo, hi in level:
+                first_child.append(len(letters))
+                counts.append(hi - lo)
+                if len(words[lo]) == depth:
+                    is_terminal.append(1)
+                    lo += 1
+                else:
+                    is_terminal.append(0)
+
+                while lo < hi:
+                    char = words[lo][depth]
+                    end = lo + 1
+                    while end < hi and words[end][depth] == char:
+                        end += 1
+                    letters.append(ord(char))
+                    next_level.append((lo, end))
+                    lo = end
+
+            level = next_level
+            depth += 1
+
+        first_child.append(len(letters))
+        self.letters = letters
+        self.first_child = first_child
+        self.is_terminal = is_terminal
+        self.counts = counts
+        self._mapping = None
+        self.logger.debug('Built %d nodes for %d words', len(letters), self.size)
+
+
+class Dawg(object):
+    '''
+    Stores words as a minimized directed acyclic word graph.
+
+    A DAWG is a Trie in which equivalent states - those that end the same
+    set of suffixes - are merged, so common endings like -ING, -ED and -ERS
+    are stored once per bin rather than once per word.  It is built with the
+    incremental algorithm of Daciuk et al. for sorted input: each new word
+    only adds states after its common prefix with the previous word, and the
+    states of the previous word past that prefix are replaced by an
+    equivalent state from the register, if one exists.
+
+    Words added in lexical order, as from a sorted word list, are inserted
+    directly.  A query closes the graph, and words added after that or out
+    of order are buffered and the graph is rebuilt lazily on the next query.
+    '''
+
+    def __init__(self, fast=True):
+        '''Creates an empty graph and initializes logging.  The boolean fast
+        is accepted for compatibility with the Trie, but a Dawg never keeps a
+        master list of words.
+        '''
+        self.fast = fast
+        self.size = 0
+        self._pending = set()
+        self._reset()
+        self.logger = logging.getLogger('Dawg.logger')
+
+    @property
+    def node_count(self):
+        self._build()
+        return self._node_count
+
+    def is_word(self, word):
+        '''Checks for the existence of word in the graph'''
+        if word in self._pending:
+            return True
+
+        node = self.root
+        for char in word:
+            try:
+                node = node.children[char]
+            except KeyError:
+                return False
+
+        return node.final
+
+    def __iter__(self):
+        return self.get_words().__iter__()
+
+    def get_words(self, pattern={}):
+        '''Returns all words matching pattern in lexical order
+
+        See Trie.get_words for the pattern format.
+        '''
+        self._build()
+        return list(self._iter_words(pattern))
+
+    def add(self, word):
+        '''Adds a word (string only) to the graph'''
+        if self.is_word(word):
+            self.logger.debug('%s was already in the graph', word)
+            return
+
+        if self._is_open and not self._pending and word > self._previous:
+            self._insert(word)
+        else:
+            self._pending.add(word)
+        self.size += 1
+
+    def iter_words(self, pattern={}):
+        '''Yields all words matching pattern in lexical order'''
+        self._build()
+        for word in self._iter_words(pattern):
+            yield word
+
+    def count_words(self, pattern={}):
+        '''Returns the number of words matching pattern
+
+        Only the states down to the last position in pattern are visited;
+        below that, every suffix of a state matches, and each state stores
+        how many suffixes it has.
+        '''
+        if not pattern:
+            return self.size
+
+        self._build()
+        return sum(node.count for node, _ in self._matching_subtrees(pattern))
+
+    def sample_word(self, pattern={}):
+        '''Returns a word matching pattern chosen uniformly at random, or None
+        if there are none
+        '''
+        self._build()
+        subtrees = list(self._matching_subtrees(pattern))
+        k = random.randrange(sum(node.count for node, _ in subtrees) or 1)
+        for node, prefix in subtrees:
+            if k >= node.count:
+                k -= node.count
+                continue
+
+            # Follow the k-th suffix of node, in lexical order.
+            while True:
+                if node.final:
+                    if not k:
+                        return prefix
+                    k -= 1
+                for char, child in node.children.items():
+                    if k < child.count:
+                        node = child
+                        prefix += char
+                        break
+                    k -= child.count
+
+        return None
+
+    def _matching_subtrees(self, pattern):
+        '''Yields (state, prefix) for the states at depth max(pattern) + 1
+        reached by paths that match pattern'''
+        last = max(pattern) + 1 if pattern else 0
+
+        stack = [(self.root, '')]
+        while stack:
+            node, prefix = stack.pop()
+            depth = len(prefix)
+            if depth >= last:
+                yield node, prefix
+            elif depth in pattern:
+                char = pattern[depth]
+                child = node.children.get(char)
+                if child is not None:
+                    stack.append((child, prefix + char))
+            else:
+                for char, child in node.children.items():
+                    stack.append((child, prefix + char))
+
+    def _reset(self):
+        '''Starts an empty graph, open for sorted insertion'''
+        self.root = DawgState()
+        self._node_count = 1
+        self._register = {}
+        self._unchecked = []
+        self._previous = ''
+        self._is_open = True
+
+    def _insert(self, word):
+        '''Adds a word that sorts after every word already in the graph'''
+        common = 0
+        for char, previous_char in zip(word, self._previous):
+            if char != previous_char:
+                break
+            common += 1
+
+        self._minimize(common)
+        if self._unchecked:
+            node = self._unchecked[-1][2]
+        else:
+            node = self.root
+
+        for char in word[common:]:
+            child = DawgState()
+            node.children[char] = child
+            self._unchecked.append((node, char, child))
+            self._node_count += 1
+            node = child
+
+        node.final = True
+        self._previous = word
+
+    def _minimize(self, depth):
+        '''Merges the unchecked states below depth into the register'''
+        while len(self._unchecked) > depth:
+            parent, char, child = self._unchecked.pop()
+            child.count = child.final + sum(
+                grandchild.count for grandchild in child.children.values())
+            key = (child.final, tuple(child.children.items()))
+            try:
+                parent.children[char] = self._register[key]
+                self._node_count -= 1
+            except KeyError:
+                self._register[key] = child
+
+    def _iter_words(self, pattern):
+        '''Yields all words matching pattern with a depth-first traversal'''
+        min_length = max(pattern) + 1 if pattern else 0
+
+        # Stack of (state, prefix), where prefix spells the path to state.
+        stack = [(self.root, '')]
+        while stack:
+            node, prefix = stack.pop()
+            depth = len(prefix)
+            if node.final and depth >= min_length:
+                yield prefix
+
+            if depth in pattern:
+                char = pattern[depth]
+                child = node.children.get(char)
+                if child is not None:
+                    stack.append((child, prefix + char))
+            else:
+                for char, child in reversed(node.children.items()):
+                    stack.append((child, prefix + char))
+
+    def _build(self):
+        '''Closes the graph, first rebuilding it if words are pending'''
+        if self._pending:
+            words = sorted(itertools.chain(self._iter_words({}), self._pending))
+            self._pending = set()
+            self._reset()
+            for word in words:
+                self._insert(word)
+
+        if self._is_open:
+            self._minimize(0)
+            self.root.count = self.size
+            self._register = {}
+            self._is_open = False
+            self.logger.debug('Built %d states for %d words',
+                              self._node_count, self.size)
+
+
+class DawgState(object):
+    '''Small state class for use in Dawg'''
+    __slots__ = ('children', 'final', 'count')
+
+    def __init__(self):
+        '''Creates a non-final state with no transitions'''
+        self.children = {}
+        self.final = False
+        # The number of suffixes accepted from this state.
+        self.count = 0
+
+
+# Helpers for decoding BitsetIndex bitsets: skips over empty bytes of a bitset, and
+# lists the bits that are set in each possible byte value.
+_NONZERO_BYTE = re.compile(b'[^\\x00]')
+_BIT_POSITIONS = tuple(tuple(bit for bit in range(8) if value >> bit & 1)
+                       for value in range(256))
+
+# Layout of the binary format written by Dictionary.save: a magic string,
+# then the version and number of bins, then for each bin its word length,
+# number of words, number of nodes and the offset of its CompactTrie arrays.
+_MAGIC = b'LBDICT\x00\x00'
+_VERSION = 2
+_HEADER = struct.Struct('<II')
+_BIN = struct.Struct('<IIII')
+
+# Counters for the Dictionary.get_words cache, as from Dictionary.cache_info.
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'refinements',
+                  'maxsize', 'currsize'])
+
+
+def freeze_pattern(pattern):
+    '''Returns a hashable form of a pattern: a tuple of (position, letter)
+    pairs in order of position.  Frozen patterns are returned unchanged.
+    '''
+    if isinstance(pattern, tuple):
+        return pattern
+    return tuple(sorted(pattern.items()))
+
+
+def thaw_pattern(pattern):
+    '''Returns the dict form of a pattern, which may be frozen'''
+    if isinstance(pattern, tuple):
+        return dict(pattern)
+    return pattern
+
+
+# The structures a Dictionary can use for each of its length bins.
+INDEXES = {
+    'trie': Trie,
+    'bitset': BitsetIndex,
+    'compact': CompactTrie,
+    'dawg': Dawg,
+    'numpy': LetterMatrix,
+}
 
 
-def unique_permutations(elements):
-    if len(elements) == 1:
-        yield (elements[0],)
-    else:
-        unique_elements = set(elements)
-        for first_element in unique_elements:
-            remaining_elements = list(elements)
-            remaining_elements.remove(first_element)
-            for sub_permutation in unique_permutations(remaining_elements):
-                yield (first_element,) + sub_permutation
+def load_weights(istream):
+    '''Load word frequencies for a PhraseDictionary from a text file with one
+    word and its count per line, separated by whitespace
+
+    Returns:
+        dict(str: float) of counts, keyed by normalized word
+
+    Raises ValueError, with the line number, for a line without a valid count.
+    '''
+    weights = {}
+    for line_number, line in enumerate(istream, 1):
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            count = float(fields[1])
+        except (IndexError, ValueError):
+            raise ValueError('Expected a word and its count on line %d: %r'
+                             % (line_number, line.rstrip('\n')))
+        word = Dictionary._normalize_word(fields[0])
+        weights[word] = weights.get(word, 0) + count
+
+    return weights
 
 
 class PhraseDictionary(object):
     '''Find phrases matching certain pattern in a Dictionary.'''
-    def __init__(self, dictionary):
+    def __init__(self, dictionary, weights=None):
+        '''Arguments:
+            dictionary: the Dictionary to build phrases from
+            weights: optional dict(str: float) of word frequencies, e.g. from
+                load_weights, used to score phrases for get_best.  Each word
+                scores its log-probability, with add-one smoothing so that
+                words without a weight can still be used.
+        '''
         self._dictionary = dictionary
+        self._weights = weights or {}
+        self._log_total = math.log(sum(self._weights.values()) +
+                                   max(dictionary.size, 1))
+
+    def score(self, word):
+        '''The log-probability of word, from the weights'''
+        return math.log(self._weights.get(word, 0) + 1) - self._log_total
 
-    def get(self, pattern, length):
+    def get(self, pattern, length, max_words=None, limit=None):
         '''Get words and phrases matching the given pattern, and having
         the given total length.
 
         See `Dictionary.get_words()` for the pattern format.
 
+        Phrases are built from left to right, one word at a time.  The words
+        that fit each window of the pattern are looked up once, and a word is
+        only tried if the rest of the pattern after it can be completed, so
+        no time is spent on compositions of the length that cannot match.
+
+        Arguments:
+            max_words: the largest number of words in a phrase, or None for
+                no limit
+            limit: the largest number of phrases to yield, or None for all
+
         Yields tuples of words.
         '''
-        # For all partitions of word lengths that add up to the desired total.
-        for p in partitions(length):
-            # For all permutations of those word lengths.
-            for perm in unique_permutations(p):
-                words = []
-                cur_idx = 0
-                for word_length in perm:
-                    # Find elements of the pattern that correspond to
-                    # this window.
-                    pn = {k-cur_idx: v for k, v in pattern.items()
-                          if k >= cur_idx and k < cur_idx + word_length}
-                    words.append(self._dictionary.get_words(
-                        pattern=pn, length=word_length))
-                    cur_idx += word_length
-                for phrase in itertools.product(*words):
-                    yield phrase
+        search = _PhraseSearch(self, pattern, length, max_words)
+
+        def phrases(offset, words_left):
+            if offset == length:
+                yield ()
+                return
+            for word_length in range(1, length - offset + 1):
+                end = offset + word_length
+                words = search.window(offset, word_length)
+                if not words or not search.can_complete(end, words_left - 1):
+                    continue
+                for word in words:
+                    for rest in phrases(end, words_left - 1):
+                        yield (word,) + rest
+
+        if length < 1 or not search.can_complete(0, search.max_words):
+            return
+        for phrase in itertools.islice(phrases(0, search.max_words), limit):
+            yield phrase
+
+    def get_best(self, pattern, length, k=None, max_words=None):
+        '''Get the phrases that get() would, best first
+
+        A phrase scores the sum of the scores of its words, so it is ranked
+        by its probability as a sequence of independent words.  This is a
+        best-first search over the compositions of the length: a partial
+        phrase is ranked by its score plus the best score that could complete
+        it, so phrases come off the queue in descending order of score.  Each
+        window's words are tried in order of score, and the next word of a
+        window is only queued once the one before it is taken, so only about
+        k phrases are ever expanded.
+
+        Arguments:
+            k: the number of phrases to yield, or None for all
+            max_words: the largest number of words in a phrase, or None for
+                no limit
+
+        Yields:
+            tuples (score, tuple(str)) in descending order of score
+        '''
+        search = _PhraseSearch(self, pattern, length, max_words)
+        if length < 1 or search.best_completion(0, search.max_words) is None:
+            return
+
+        # Queue entries are (-bound, tiebreak, score, phrase, offset,
+        # word_length, i): the phrase extended by the i-th best word of the
+        # window of word_length at offset.
+        queue = []
+        tiebreak = itertools.count()
+
+        def push_children(score, phrase, offset):
+            words_left = search.max_words - len(phrase)
+            for word_length in range(1, length - offset + 1):
+                push(score, phrase, offset, word_length, 0, words_left)
+
+        def push(score, phrase, offset, word_length, i, words_left):
+            words = search.scored_window(offset, word_length)
+            if i >= len(words):
+                return
+            rest = search.best_completion(offset + word_length, words_left - 1)
+            if rest is None:
+                return
+            bound = score + words[i][0] + rest
+            heapq.heappush(queue, (-bound, next(tiebreak), score, phrase,
+                                   offset, word_length, i))
+
+        push_children(0, (), 0)
+        n_yielded = 0
+        while queue and (k is None or n_yielded < k):
+            _, _, score, phrase, offset, word_length, i = heapq.heappop(queue)
+            push(score, phrase, offset, word_length, i + 1,
+                 search.max_words - len(phrase))
+
+            word_score, word = search.scored_window(offset, word_length)[i]
+            score += word_score
+            phrase += (word,)
+            offset += word_length
+            if offset == length:
+                yield score, phrase
+                n_yielded += 1
+            else:
+                push_children(score, phrase, offset)
+
+
+class _PhraseSearch(object):
+    '''Memoized lookups shared by the searches of a PhraseDictionary for
+    phrases of one pattern and length'''
+
+    def __init__(self, phrase_dictionary, pattern, length, max_words):
+        self.phrase_dictionary = phrase_dictionary
+        self.pattern = pattern
+        self.length = length
+        self.max_words = length if max_words is None else max_words
+        # Map of (offset, word length) -> words that fit that window.
+        self._windows = {}
+        # Map of (offset, word length) -> (score, word) for the words that
+        # fit that window, best first.
+        self._scored_windows = {}
+        # Map of (offset, words left) -> whether a phrase can finish there.
+        self._completable = {}
+        # Map of (offset, words left) -> the best score of the words that
+        # can finish a phrase from there, or None if none can.
+        self._completions = {}
+
+    def window(self, offset, word_length):
+        '''The words that fit the pattern at offset'''
+        try:
+            return self._windows[offset, word_length]
+        except KeyError:
+            pn = {k - offset: v for k, v in self.pattern.items()
+                  if offset <= k < offset + word_length}
+            words = self._windows[offset, word_length] = \
+                self.phrase_dictionary._dictionary.get_words(pattern=pn, length=word_length)
+            return words
+
+    def scored_window(self, offset, word_length):
+        '''The words that fit the pattern at offset, with their scores, best
+        first'''
+        try:
+            return self._scored_windows[offset, word_length]
+        except KeyError:
+            score = self.phrase_dictionary.score
+            words = self._scored_windows[offset, word_length] = sorted(
+                ((score(word), word) for word in self.window(offset, word_length)),
+                key=lambda scored: -scored[0])
+            return words
+
+    def can_complete(self, offset, words_left):
+        '''Whether a phrase of at most words_left words can fill the pattern
+        from offset to the end'''
+        if offset == self.length:
+            return True
+        if not words_left:
+            return False
+        try:
+            return self._completable[offset, words_left]
+        except KeyError:
+            result = self._completable[offset, words_left] = any(
+                self.window(offset, word_length) and
+                self.can_complete(offset + word_length, words_left - 1)
+                for word_length in range(1, self.length - offset + 1))
+            return result
+
+    def best_completion(self, offset, words_left):
+        '''The best score of at most words_left words that fill the pattern
+        from offset to the end, or None if there are none'''
+        if offset == self.length:
+            return 0
+        if not words_left:
+            return None
+        try:
+            return self._completions[offset, words_left]
+        except KeyError:
+            pass
+
+        best = None
+        for word_length in range(1, self.length - offset + 1):
+            if not self.window(offset, word_length):
+                continue
+            rest = self.best_completion(offset + word_length, words_left - 1)
+            if rest is None:
+                continue
+            score = self.scored_window(offset, word_length)[0][0] + rest
+            if best is None or score > best:
+                best = score
+
+        self._completions[offset, words_left] = best
+        return best
@@ -0,0 +1,297 @@
+'''
+Fuzzy string search with an inverted index of character N-grams.
+'''
+from array import array
+import bisect
+import collections
+import itertools
+import logging
+import math
+
+
+class NGramIndex(object):
+    '''Finds the indexed strings that share most of their N-grams with a query
+
+    Strings are padded with N - 1 pad characters at each end and split into
+    overlapping N-grams, and the similarity of two strings is
+
+        same / (all_query + all_item - same)
+
+    where all_query and all_item count their N-grams with repetition, and same
+    is the size of the intersection of those multisets.  This is the
+    similarity of ngram.NGram with its default settings, which this class
+    replaces.
+
+    Each N-gram maps to an array of the ids of the strings that contain it,
+    in increasing order and repeated once per occurrence.  A search only
+    reads the postings of the rarest N-grams of the query: any string that
+    is similar enough must share one of them (the prefix filter of AllPairs
+    and PPJoin).  Candidates are then dropped if their number of N-grams
+    rules them out (the length filter), or if they could not share enough
+    N-grams even with all of the remaining ones.  The overlap of the rest
+    with the remaining N-grams is counted by bisecting their postings for
+    each candidate, or by intersecting them with the candidates when that
+    is cheaper.
+    '''
+    logger = logging.getLogger('littleboxes.fuzzy.NGramIndex')
+
+    def __init__(self, N=3, pad_char='$'):
+        self.N = N
+        self._padding = pad_char * (N - 1)
+        # The indexed strings, by id.
+        self.items = []
+        self._ids = {}
+        # Number of N-grams in each string, by id.
+        self._gram_counts = array('I')
+        # Map of N-gram -> array of ids of the strings containing it.
+        self._postings = {}
+        self.read_only = False
+
+    @classmethod
+    def from_arrays(cls, items, gram_counts, grams, starts, ids, N=3,
+                    pad_char='$'):
+        '''Creates a read-only index over arrays as from to_arrays
+
+        The arrays are used as they are, so they can be views of a memory
+        mapped file.
+
+        Arguments:
+            items: the indexed strings, sorted by their UTF-8 encoding, as a
+                sequence that supports `in` (e.g. a mapped.MappedStrings)
+            gram_counts: the number of N-grams of each string
+            grams: the N-grams, as a mapped.MappedStrings or anything else
+                with the same find() method
+            starts, ids: the postings of N-gram i are ids[starts[i]:starts[i + 1]]
+        '''
+        index = cls(N=N, pad_char=pad_char)
+        index.items = items
+        index._ids = items
+        index._gram_counts = gram_counts
+        index._postings = _MappedPostings(grams, starts, ids)
+        index.read_only = True
+        return index
+
+    def to_arrays(self):
+        '''The N-gram counts, N-grams and postings as flat arrays, for
+        from_arrays
+
+        Returns:
+            tuple(array, list(str), array, array): the number of N-grams of
+                each string by id, the N-grams in order of their UTF-8
+                encoding, the start of the postings of each in the last array
+                and the end of the last one, and the postings one after another
+        '''
+        grams = sorted(self._postings, key=lambda gram: gram.encode('utf-8'))
+        starts = array('I', [0])
+        ids = array('I')
+        for gram in grams:
+            ids.extend(self._postings[gram])
+            starts.append(len(ids))
+        return self._gram_counts, grams, starts, ids
+
+    def grams(self, string):
+        '''The N-grams of string, after padding'''
+        padded = self._padding + string + self._padding
+        return [padded[i:i + self.N] for i in range(len(padded) - self.N + 1)]
+
+    def add(self, item):
+        '''Adds a string to the index, if it is not already there
+
+        Returns:
+            int: the id of the string, its position in self.items
+        '''
+        if self.read_only:
+            raise TypeError('Cannot add to a read-only NGramIndex')
+        if item in self._ids:
+            return self._ids[item]
+
+        item_id = self._ids[item] = len(self.items)
+        self.items.append(item)
+        grams = self.grams(item)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            try:
+                self._postings[gram].append(item_id)
+            except KeyError:
+                self._postings[gram] = array('I', [item_id])
+
+        return item_id
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query, threshold=0.0):
+        '''Finds the strings with at least threshold similarity to query
+
+        Returns:
+            list(tuple(str, float)): Matching strings and their similarity,
+                in descending order from most similar.  Only strings that
+                share at least one N-gram with the query can match.
+        '''
+        return self.search_many([query], threshold)[0]
+
+    def search_many(self, queries, threshold=0.0, allowed=None):
+        '''Finds the strings similar to each of several queries at once
+
+        All of the queries are split into N-grams up front, and the postings
+        of each N-gram are read once for all of the queries that need them.
+
+        Arguments:
+            allowed: optional list with a set of ids for each query, or
+                anything else that supports `in`.  Only the strings with
+                those ids are considered for that query.
+
+        Returns:
+            list(list(tuple(str, float))): The results of search() for each
+                query, in the same order as queries.
+        '''
+        postings = self._postings
+        if allowed is None:
+            allowed = itertools.repeat(None)
+        plans = [_SearchPlan(self, query, threshold, ids)
+                 for query, ids in zip(queries, allowed)]
+
+        by_gram = collections.defaultdict(list)
+        for plan in plans:
+            for gram in plan.prefix:
+                by_gram[gram].append(plan)
+
+        for gram, gram_plans in by_gram.items():
+            ids = postings.get(gram)
+            if ids is None:
+                continue
+            distinct = counts = None
+            for plan in gram_plans:
+                limit = plan.query_counts[gram]
+                if limit == 1:
+                    if distinct is None:
+                        distinct = set(ids)
+                    plan.overlaps.update(distinct)
+                else:
+                    if counts is None:
+                        counts = collections.Counter(ids)
+                    for item_id, count in counts.items():
+                        plan.overlaps[item_id] += min(count, limit)
+
+        return [self._verify(plan, threshold) for plan in plans]
+
+    def _verify(self, plan, threshold):
+        '''Counts the overlap of the candidates of a search with the rest of
+        the query, and returns those that are similar enough'''
+        postings = self._postings
+        gram_counts = self._gram_counts
+        n_query = plan.n_query
+        overlaps = plan.overlaps
+
+        # Keep the candidates that have the right number of N-grams, and that
+        # could still share enough with the query if they have all of the
+        # remaining N-grams, and then those that are allowed.
+        n_suffix = sum(plan.query_counts[gram] for gram in plan.suffix)
+        ratio = threshold / (1.0 + threshold)
+        candidates = set(
+            item_id for item_id, same in overlaps.items()
+            if plan.min_grams <= gram_counts[item_id] <= plan.max_grams and
+            same + n_suffix >= ratio * (n_query + gram_counts[item_id]) - _EPS)
+        if plan.allowed is not None:
+            candidates = set(item_id for item_id in candidates
+                             if item_id in plan.allowed)
+
+        for gram in plan.suffix:
+            ids = postings.get(gram)
+            if ids is None:
+                continue
+            limit = plan.query_counts[gram]
+            if len(candidates) * _BISECT_COST < len(ids):
+                for item_id in candidates:
+                    count = (bisect.bisect_right(ids, item_id) -
+                             bisect.bisect_left(ids, item_id))
+                    overlaps[item_id] += min(count, limit)
+            else:
+                self._count_overlaps(overlaps, ids, limit, candidates)
+
+        results = []
+        for item_id in candidates:
+            same = overlaps[item_id]
+            similarity = float(same) / (n_query + gram_counts[item_id] - same)
+            if similarity >= threshold:
+                results.append((item_id, similarity))
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return [(self.items[item_id], similarity)
+                for item_id, similarity in results]
+
+    @staticmethod
+    def _count_overlaps(overlaps, ids, limit, candidates):
+        '''Adds the occurrences of an N-gram in each of the candidates to
+        overlaps, up to limit'''
+        if limit == 1:
+            overlaps.update(candidates.intersection(ids))
+            return
+
+        counts = collections.Counter(ids)
+        for item_id in candidates.intersection(counts):
+            overlaps[item_id] += min(counts[item_id], limit)
+
+
+class _SearchPlan(object):
+    '''The N-grams of one query of NGramIndex.search_many, split into those
+    whose postings generate candidates and those that are only checked, and
+    the overlap of each candidate so far'''
+
+    def __init__(self, index, query, threshold, allowed=None):
+        self.allowed = allowed
+        self.query_counts = collections.Counter(index.grams(query))
+        self.n_query = sum(self.query_counts.values())
+
+        # Any match has at least min_grams N-grams, at most max_grams, and
+        # shares at least min_grams of them with the query.
+        self.min_grams = max(
+            int(math.ceil(threshold * self.n_query - _EPS)), 1)
+        if threshold > 0:
+            self.max_grams = int(math.floor(self.n_query / threshold + _EPS))
+        else:
+            self.max_grams = float('inf')
+
+        # The rarest N-grams of the query, enough that a match must share
+        # at least one of them; the overlap with the others is checked later.
+        postings = index._postings
+        by_rarity = sorted(self.query_counts,
+                           key=lambda gram: len(postings.get(gram, ())))
+        self.prefix = []
+        n_prefix = self.n_query - self.min_grams + 1
+        for gram in by_rarity:
+            if n_prefix <= 0:
+                break
+            self.prefix.append(gram)
+            n_prefix -= self.query_counts[gram]
+        self.suffix = by_rarity[len(self.prefix):]
+
+        # Map of id -> number of N-grams shared with the query so far.
+        self.overlaps = collections.Counter()
+
+
+class _MappedPostings(object):
+    '''The postings of a read-only NGramIndex, as a read-only mapping of
+    N-gram -> array of ids'''
+
+    def __init__(self, grams, starts, ids):
+        self._grams = grams
+        self._starts = starts
+        self._ids = ids
+
+    def get(self, gram, default=None):
+        i = self._grams.find(gram)
+        if i is None:
+            return default
+        return self._ids[self._starts[i]:self._starts[i + 1]]
+
+
+# Tolerance for rounding in the bounds on the number of N-grams.
+_EPS = 1e-9
+
+# Bisecting the postings of an N-gram for each candidate costs about this
+# many times as much per candidate as scanning them costs per posting.
+_BISECT_COST = 20
@@ -0,0 +1,209 @@
+'''
+Helpers for binary files of flat little-endian arrays that are read through
+mmap without copying.
+'''
+from array import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+
+# Typecode for 32-bit unsigned integers, and whether a little-endian array of
+# them can be viewed directly without swapping bytes.
+UINT32 = 'I' if array('I').itemsize == 4 else 'L'
+NATIVE_UINT32 = sys.byteorder == 'little'
+
+
+def padded(n):
+    '''Rounds n up to a multiple of four bytes'''
+    return (n + 3) & ~3
+
+
+def map_file(path):
+    '''Maps a whole file read-only'''
+    return map_file_with_id(path)[0]
+
+
+def map_file_with_id(path):
+    '''Maps a whole file read-only, and identifies the file that was mapped
+
+    Returns:
+        tuple(mmap, tuple(int, int)): the map, and the device and inode of
+            the file, which change if another file replaces it at path
+    '''
+    with open(path, 'rb') as istream:
+        stat = os.fstat(istream.fileno())
+        buf = mmap.mmap(istream.fileno(), 0, access=mmap.ACCESS_READ)
+    return buf, (stat.st_dev, stat.st_ino)
+
+
+def uint32_view(buf, start, count):
+    '''An array of count little-endian uint32s at start in buf
+
+    The result is a memoryview of buf where the byte order allows it, and an
+    array otherwise.  Either can be indexed, sliced and bisected.
+    '''
+    view = memoryview(buf)[start:start + 4 * count]
+    if NATIVE_UINT32:
+        return view.cast(UINT32)
+    values = array(UINT32, view.tobytes())
+    values.byteswap()
+    return values
+
+
+def uint32_bytes(values):
+    '''The bytes of values as little-endian uint32s'''
+    values = array(UINT32, values)
+    if not NATIVE_UINT32:
+        values.byteswap()
+    return values.tobytes()
+
+
+def string_table_bytes(strings):
+    '''The offsets and UTF-8 blob of a MappedStrings table of strings
+
+    Returns:
+        tuple(bytes, bytes): n + 1 uint32 offsets into the blob, and the blob
+    '''
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = [0]
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    return uint32_bytes(offsets), b''.join(encoded)
+
+
+class MappedStrings(object):
+    '''A read-only sequence of strings stored as UTF-8 in a buffer
+
+    Each string is only decoded when it is read.  If the strings were
+    written in order of their UTF-8 encoding, find() bisects them.
+    '''
+
+    def __init__(self, offsets, blob):
+        '''Arguments:
+            offsets: n + 1 positions in blob of the start of each string
+                and the end of the last one, as from uint32_view
+            blob: a memoryview of the encoded strings
+        '''
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError('MappedStrings index out of range')
+        return self._encoded(i).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __contains__(self, string):
+        return self.find(string) is not None
+
+    def _encoded(self, i):
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]])
+
+    def iter_encoded(self):
+        '''Yields the strings as UTF-8 bytes, without decoding them'''
+        for i in range(len(self)):
+            yield self._encoded(i)
+
+    def find(self, string):
+        '''The position of string in the sorted table, or None'''
+        return self.find_encoded(string.encode('utf-8'))
+
+    def find_encoded(self, key):
+        '''The position of a string given as UTF-8 bytes, or None'''
+        i = bisect.bisect_left(_EncodedKeys(self), key)
+        if i < len(self) and self._encoded(i) == key:
+            return i
+        return None
+
+
+class _EncodedKeys(object):
+    '''The encoded strings of a MappedStrings table, for bisect'''
+
+    def __init__(self, strings):
+        self._strings = strings
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, i):
+        return self._strings._encoded(i)
+
+
+class Sections(object):
+    '''A block of a file made of several arrays, each aligned to four bytes
+
+    The block starts with a four-byte tag, the number of arrays, the total
+    size of the block, and the offset and size in bytes of each array
+    relative to the start of the block.
+    '''
+    _HEADER = struct.Struct('<4sIQ')
+    _ENTRY = struct.Struct('<QQ')
+
+    def __init__(self, buf, offset):
+        '''Reads the table of a block at offset in buf
+
+        Raises ValueError if there is no complete block there.
+        '''
+        if offset + self._HEADER.size > len(buf):
+            raise ValueError('Truncated block at offset %d' % offset)
+        self.tag, n_sections, self.size = self._HEADER.unpack_from(buf, offset)
+        table_size = self._HEADER.size + n_sections * self._ENTRY.size
+        if not table_size <= self.size <= len(buf) - offset:
+            raise ValueError('Truncated block at offset %d' % offset)
+        self.buf = buf
+        self.offset = offset
+        self._entries = [
+            self._ENTRY.unpack_from(buf, offset + self._HEADER.size +
+                                    i * self._ENTRY.size)
+            for i in range(n_sections)]
+        if any(start + size > self.size for start, size in self._entries):
+            raise ValueError('Invalid block at offset %d' % offset)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def uint32s(self, i):
+        '''Array i, as uint32s'''
+        start, size = self._entries[i]
+        return uint32_view(self.buf, self.offset + start, size // 4)
+
+    def raw(self, i):
+        '''Array i, as a memoryview of bytes'''
+        start, size = self._entries[i]
+        start += self.offset
+        return memoryview(self.buf)[start:start + size]
+
+    @classmethod
+    def write(cls, file_object, tag, sections):
+        '''Writes a block of arrays
+
+        Arguments:
+            file_object: a binary file open for writing
+            tag: four bytes identifying the kind of block
+            sections: list(bytes) of the arrays
+
+        Returns:
+            int: the number of bytes written
+        '''
+        offset = cls._HEADER.size + len(sections) * cls._ENTRY.size
+        entries = []
+        for section in sections:
+            entries.append((offset, len(section)))
+            offset += padded(len(section))
+
+        file_object.write(cls._HEADER.pack(tag, len(sections), offset))
+        for entry in entries:
+            file_object.write(cls._ENTRY.pack(*entry))
+        for section in sections:
+            file_object.write(section)
+            file_object.write(bytes(padded(len(section)) - len(section)))
+        return offset
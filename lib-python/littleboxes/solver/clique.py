@@ -1,6 +1,10 @@
+import collections
+import heapq
+import itertools
+
 from networkx import Graph
 
-from littleboxes.xword import XWFill
+from littleboxes.xword import XWDirection, XWFill
 
 def build_conflict_graph(xword, possible_answers):
     '''Build a network describing non-conflicting answer choices
@@ -12,27 +16,302 @@ def build_conflict_graph(xword, possible_answers):
 
     Returns:
         NetworkX Graph where nodes are (XWClue, str) pairs with the string
-        being a possible solution to the clue.  Edges connect nodes which
-        could be played simultaneously without conflict (no self-edges).
+        being a possible solution to the clue.  Edges connect nodes for
+        crossing clues which could be played simultaneously without
+        conflict (no self-edges).  Nodes for different clues which do not
+        cross never conflict, so those edges are implied rather than stored:
+        use find_cliques() from this module, which accounts for them.  The
+        clues crossing each clue are kept in g.graph['crossings'].
     '''
-    g = Graph()
+    g = Graph(crossings={})
 
+    candidates = {}
     for xwclue, wordset in possible_answers.items():
-        for word in wordset:
-            if not xword.would_conflict(xwclue, word):
-                g.add_node(XWFill(clue=xwclue, word=word))
+        fills = [XWFill(clue=xwclue, word=word) for word in wordset
+                 if not xword.would_conflict(xwclue, word)]
+        if fills:
+            candidates[xwclue] = fills
+            g.add_nodes_from(fills)
 
-    for n in g:
-        testcopy = xword.copy()
-        testcopy.set_fill(n.clue, n.word)
+    across = [clue for clue in candidates
+              if clue.coord.direction == XWDirection.ACROSS]
 
-        for other_n in g:
-            if n.clue.coord == other_n.clue.coord:
-                continue
+    # Candidates bucketed by the letter they put in each of their boxes.
+    buckets = {}
+    for clue, fills in candidates.items():
+        for offset in range(len(clue.box_indices)):
+            bucket = buckets[clue, offset] = {}
+            for fill in fills:
+                bucket.setdefault(fill.word[offset], []).append(fill)
 
-            if n.clue.coord.direction == other_n.clue.coord.direction:
-                g.add_edge(n, other_n)
-            elif not testcopy.would_conflict(other_n.clue, other_n.word):
-                g.add_edge(n, other_n)
+    for a in across:
+        shared = {}
+        for other, offset, other_offset in xword.crossings[a]:
+            if other in candidates:
+                shared.setdefault(other, []).append((offset, other_offset))
+
+        g.graph['crossings'].setdefault(a, set()).update(shared)
+        for d, offsets in shared.items():
+            g.graph['crossings'].setdefault(d, set()).add(a)
+            (offset, other_offset), rest = offsets[0], offsets[1:]
+            for letter, fills in buckets[a, offset].items():
+                for n, other_n in itertools.product(
+                        fills, buckets[d, other_offset].get(letter, ())):
+                    if all(n.word[i] == other_n.word[j] for i, j in rest):
+                        g.add_edge(n, other_n)
 
     return g
+
+
+def find_cliques(g):
+    '''Find the maximal cliques of a graph from build_conflict_graph
+
+    This is the Bron-Kerbosch algorithm with pivoting, as in
+    networkx.find_cliques, except that nodes for different clues which do
+    not cross are treated as adjacent without the edges being stored.
+
+    Arguments:
+        g - a NetworkX Graph as returned from build_conflict_graph
+
+    Yields:
+        list(XWFill) for each maximal clique
+    '''
+    if len(g) == 0:
+        return
+
+    adj = {u: set(g[u]) for u in g}
+    by_clue = collections.defaultdict(set)
+    for u in g:
+        by_clue[u.clue].add(u)
+
+    # For each clue, the clues whose nodes are only adjacent to its nodes
+    # through stored edges: itself and the clues crossing it.
+    crossings = g.graph.get('crossings', {})
+    explicit = {clue: {clue} | crossings.get(clue, set()) for clue in by_clue}
+    explicit_nodes = {clue: set().union(*(by_clue[c] for c in clues))
+                      for clue, clues in explicit.items()}
+
+    def neighbors_in(nodes, u):
+        '''The members of nodes that are adjacent to u'''
+        return (nodes & adj[u]) | (nodes - explicit_nodes[u.clue])
+
+    def non_neighbors_in(nodes, u):
+        '''The members of nodes that are not adjacent to u'''
+        return (nodes & explicit_nodes[u.clue]) - adj[u]
+
+    def pivot(subg, cand):
+        '''The node of subg with the most neighbors in cand'''
+        n_clue = collections.Counter(u.clue for u in cand)
+        return max(subg, key=lambda u: (
+            len(cand & adj[u]) + len(cand) -
+            sum(n_clue[clue] for clue in explicit[u.clue])))
+
+    Q = [None]
+    subg = set(g)
+    cand = set(g)
+    ext_u = non_neighbors_in(cand, pivot(subg, cand))
+    stack = []
+
+    try:
+        while True:
+            if ext_u:
+                q = ext_u.pop()
+                cand.remove(q)
+                Q[-1] = q
+                subg_q = neighbors_in(subg, q)
+                if not subg_q:
+                    yield Q[:]
+                else:
+                    cand_q = neighbors_in(cand, q)
+                    if cand_q:
+                        stack.append((subg, cand, ext_u))
+                        Q.append(None)
+                        subg = subg_q
+                        cand = cand_q
+                        ext_u = non_neighbors_in(cand, pivot(subg, cand))
+            else:
+                Q.pop()
+                subg, cand, ext_u = stack.pop()
+    except IndexError:
+        pass
+
+
+class ConflictGraph(object):
+    '''Sparse graph of the conflicts between candidate answers
+
+    This is the complement of the graph from build_conflict_graph, which is
+    nearly complete.  Two candidates conflict if they answer the same clue,
+    or if their clues cross and they disagree on the shared box.  Only the
+    second kind of conflict is stored; the first is implied by grouping the
+    candidates by clue.  A consistent partial fill is an independent set.
+    '''
+
+    def __init__(self, xword, possible_answers):
+        '''Arguments:
+            xword - a Crossword object
+            possible_answers - a dictionary as returned from self.query_answers
+                e.g. {XWClue: set(str)}
+        '''
+        # Map of clue -> list of XWFills that do not conflict with xword.
+        self.candidates = {}
+        for xwclue, wordset in possible_answers.items():
+            fills = [XWFill(clue=xwclue, word=word) for word in sorted(wordset)
+                     if not xword.would_conflict(xwclue, word)]
+            if fills:
+                self.candidates[xwclue] = fills
+
+        # Map of XWFill -> set of XWFills for crossing clues that disagree.
+        self.conflicts = {fill: set() for fills in self.candidates.values()
+                          for fill in fills}
+        for clue in self.candidates:
+            if clue.coord.direction != XWDirection.ACROSS:
+                continue
+            for other, offset, other_offset in xword.crossings[clue]:
+                if other not in self.candidates:
+                    continue
+                by_letter = {}
+                for fill in self.candidates[other]:
+                    by_letter.setdefault(fill.word[other_offset], set()).add(fill)
+                for fill in self.candidates[clue]:
+                    letter = fill.word[offset]
+                    for other_letter, other_fills in by_letter.items():
+                        if other_letter != letter:
+                            self.conflicts[fill] |= other_fills
+                            for other_fill in other_fills:
+                                self.conflicts[other_fill].add(fill)
+
+    def __len__(self):
+        return len(self.conflicts)
+
+
+def find_independent_sets(graph, xword, weights=None):
+    '''Find maximal independent sets of a ConflictGraph, best first
+
+    This is a best-first branch and bound over the clues, deciding for each
+    clue which of its candidates to play, if any.  Every partial decision is
+    ranked by an upper bound on the score of any fill that extends it, so
+    complete fills come off the queue in descending order of score, and the
+    largest consistent partial fill is found first without enumerating the
+    others.
+
+    Arguments:
+        graph - a ConflictGraph
+        xword - the Crossword that graph was built for
+        weights - optional dict(XWFill: float) of additive scores for each
+            candidate. If not given, a fill is scored by the number of empty
+            boxes of xword that it fills in.
+
+    Yields:
+        tuples (score, list(XWFill)) in descending order of score
+    '''
+    # Most constrained clues first, so that conflicts prune early.
+    clues = sorted(graph.candidates, key=lambda clue: len(graph.candidates[clue]))
+    if not clues:
+        return
+    empty = {clue: frozenset(idx for idx, letter in
+                             zip(clue.box_indices, xword.get_fill(clue))
+                             if letter is None)
+             for clue in clues}
+
+    def bound(depth, blocked, covered):
+        '''Upper bound on the score still available from clues[depth:]'''
+        total = 0
+        for clue in clues[depth:]:
+            available = [fill for fill in graph.candidates[clue]
+                         if fill not in blocked]
+            if not available:
+                continue
+            if weights is None:
+                total += len(empty[clue] - covered)
+            else:
+                total += max(weights[fill] for fill in available)
+        return total
+
+    def is_maximal(chosen, blocked):
+        '''Whether no candidate could be added to chosen'''
+        filled = set(fill.clue for fill in chosen)
+        return all(fill in blocked for clue in clues if clue not in filled
+                   for fill in graph.candidates[clue])
+
+    # Queue entries are (-bound, -depth, tiebreak, score, chosen, blocked,
+    # covered): among equal bounds, the deepest decisions are extended first.
+    tiebreak = itertools.count()
+    empty_set = frozenset()
+    queue = [(-bound(0, empty_set, empty_set), 0, next(tiebreak),
+              0, (), empty_set, empty_set)]
+    while queue:
+        _, neg_depth, _, score, chosen, blocked, covered = heapq.heappop(queue)
+        depth = -neg_depth
+        if depth == len(clues):
+            if is_maximal(chosen, blocked):
+                yield score, list(chosen)
+            continue
+
+        clue = clues[depth]
+        children = [(score, chosen, blocked, covered)]
+        for fill in graph.candidates[clue]:
+            if fill in blocked:
+                continue
+            if weights is None:
+                gain = len(empty[clue] - covered)
+            else:
+                gain = weights[fill]
+            children.append((score + gain, chosen + (fill,),
+                             blocked | graph.conflicts[fill],
+                             covered | empty[clue]))
+
+        for child_score, child_chosen, child_blocked, child_covered in children:
+            child_bound = child_score + bound(depth + 1, child_blocked,
+                                              child_covered)
+            heapq.heappush(queue, (-child_bound, -(depth + 1), next(tiebreak),
+                                   child_score, child_chosen, child_blocked,
+                                   child_covered))
+
+
+# Ways to search for partial fills among the candidate answers.
+ENGINES = ('clique', 'independent_set')
+
+
+def check_engine(engine):
+    '''Raises ValueError unless engine is one of ENGINES'''
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine %r (expected one of %s)" % (
+            engine, ', '.join(ENGINES)))
+
+
+def find_partial_fills(xword, possible_answers, engine='clique', logger=None,
+                       weights=None):
+    '''Find sets of candidate answers that can be played together
+
+    Arguments:
+        xword - a Crossword object
+        possible_answers - a dictionary as returned from self.query_answers
+            e.g. {XWClue: set(str)}
+        engine - 'clique' to enumerate every maximal clique of the graph from
+            build_conflict_graph, or 'independent_set' to search the sparse
+            ConflictGraph for the largest consistent partial fills first
+        logger - optional logging.Logger for progress messages
+        weights - optional dict(XWFill: float) used to rank partial fills
+            with the 'independent_set' engine; see find_independent_sets
+
+    Yields:
+        list(XWFill) for each partial fill
+    '''
+    check_engine(engine)
+
+    if engine == 'independent_set':
+        if logger:
+            logger.info('Generating sparse conflict graph')
+        graph = ConflictGraph(xword, possible_answers)
+        if logger:
+            logger.info('Finding independent sets in conflict graph')
+        for _, fills in find_independent_sets(graph, xword, weights):
+            yield fills
+    else:
+        if logger:
+            logger.info('Generating conflict graph')
+        conflict_graph = build_conflict_graph(xword, possible_answers)
+        if logger:
+            logger.info('Finding cliques in conflict graph')
+        for fills in find_cliques(conflict_graph):
+            yield fills
@@ -1,8 +1,14 @@
+import itertools
 import logging
-from networkx import find_cliques
 
-from littleboxes.solver.clique import build_conflict_graph
+from littleboxes.solver.clique import check_engine, find_partial_fills
 from littleboxes.solver.solver import Solver
+from littleboxes.xword import XWFill
+
+# Ways to score the partial fills from a ClueDBCliqueSolver:
+#   'n_set': the number of boxes that are filled in.
+#   'similarity': the total similarity of the clues the answers came from.
+SCORES = ('n_set', 'similarity')
 
 
 class ClueDBCliqueSolver(Solver):
@@ -10,14 +16,31 @@ class ClueDBCliqueSolver(Solver):
 
     logger = logging.getLogger('littleboxes.solver.ClueDBCliqueSolver')
 
-    def __init__(self, db, clue_threshold=1.0):
+    def __init__(self, db, clue_threshold=1.0, engine='clique', top_k=None,
+                 score='n_set'):
         """Args:
             db (ClueDB): The database of clues to search for answers.
             clue_threshold (float, 0.0-1.0): Clues will be considered a match if
                 they have this much N-gram similarity.
+            engine (str): How to search for answers that can be played
+                together; see littleboxes.solver.clique.find_partial_fills.
+            top_k (int or None): If given, only the k best partial fills are
+                yielded, best first. They are found with a best-first search,
+                so the rest are never enumerated (engine is ignored).
+            score (str): How partial fills are scored and ranked, one of
+                'n_set' or 'similarity'.
         """
+        check_engine(engine)
+        if score not in SCORES:
+            raise ValueError("Unknown score %r (expected one of %s)" % (
+                score, ', '.join(SCORES)))
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be at least 1")
         self._db = db
         self._clue_threshold = clue_threshold
+        self._engine = engine
+        self._top_k = top_k
+        self._score = score
 
     def solve(self, xword):
         '''Graph-based search for partial solutions to a crossword
@@ -25,27 +48,41 @@ class ClueDBCliqueSolver(Solver):
         This implementation creates a graph describing possible words to play
         on the puzzle, nodes being words and the place to play them, and edges
         connecting words that can be played together without conflicts.
+        With engine='independent_set' or top_k the graph stores conflicts
+        instead, and the best partial solutions are yielded first.
 
         Arguments:
             xword - a Crossword to be solved
 
         Yields:
-            sorted list of tuples (prob, Crossword) of partially solved
-            Crosswords in order from most- to least-solved with prob=1.0 for
-            each Crossword for now
+            tuples (score, Crossword) of partially solved Crosswords, where
+            score is the number of filled boxes or the total clue similarity
+            of the answers, according to self._score
         '''
         self.logger.info('Looking up answers in ClueDB')
-        possible_answers = self.query_answers(xword)
-        self.logger.info('Generating conflict graph')
-        conflict_graph = build_conflict_graph(xword, possible_answers)
-
-        self.logger.info('Finding cliques in conflict graph')
-        for xwsolution in find_cliques(conflict_graph):
+        scored_answers = self.query_scored_answers(xword)
+        possible_answers = {xwclue: set(answers)
+                            for xwclue, answers in scored_answers.items()}
+        weights = {XWFill(clue=xwclue, word=word): similarity
+                   for xwclue, answers in scored_answers.items()
+                   for word, similarity in answers.items()}
+
+        engine = self._engine if self._top_k is None else 'independent_set'
+        xwsolutions = find_partial_fills(
+            xword, possible_answers, engine, self.logger,
+            weights=None if self._score == 'n_set' else weights)
+        if self._top_k is not None:
+            xwsolutions = itertools.islice(xwsolutions, self._top_k)
+
+        for xwsolution in xwsolutions:
             solved = xword.copy()
             for fill in xwsolution:
                 solved.set_fill(fill.clue, fill.word)
             self.logger.info('Found solution')
-            yield solved.n_set, solved
+            if self._score == 'n_set':
+                yield solved.n_set, solved
+            else:
+                yield sum(weights[fill] for fill in xwsolution), solved
 
     def query_answers(self, xword):
         '''From the self._db fetch all possible answers to all clues in xword
@@ -56,16 +93,36 @@ class ClueDBCliqueSolver(Solver):
         Returns:
             dict(littleboxes.xword.XWClue: set(str))
 
+        '''
+        return {xwclue: set(answers)
+                for xwclue, answers in self.query_scored_answers(xword).items()}
+
+    def query_scored_answers(self, xword):
+        '''From the self._db fetch all possible answers to all clues in xword,
+        along with the similarity of the most similar clue each answer was
+        given for.
+
+        Arguments:
+            xword - a Crossword
+
+        Returns:
+            dict(littleboxes.xword.XWClue: dict(str: float))
+
         '''
         answers = {}
 
-        for xwclue in xword.clues:
-            all_answers = set()
-            self.logger.debug('Finding clues within %f of %r', self._clue_threshold, xwclue.text)
-            for clue, similarity in self._db.search(xwclue.text, self._clue_threshold):
-                db_answers = self._db.answers(clue, len(xwclue.box_indices))
+        self.logger.debug('Finding clues within %f of %d clues',
+                          self._clue_threshold, len(xword.clues))
+        hits = self._db.search_many(
+            [(xwclue.text, len(xwclue.box_indices)) for xwclue in xword.clues],
+            self._clue_threshold)
+        for xwclue, clue_hits in zip(xword.clues, hits):
+            all_answers = {}
+            for clue, similarity, db_answers in clue_hits:
                 self.logger.debug('%d possible answers for %r', len(db_answers), clue)
-                all_answers.update(db_answers)
+                for answer in db_answers:
+                    all_answers[answer] = max(similarity,
+                                              all_answers.get(answer, 0.0))
             if all_answers:
                 answers[xwclue] = all_answers
 
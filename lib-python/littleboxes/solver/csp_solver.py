@@ -0,0 +1,155 @@
+import collections
+import logging
+
+from littleboxes.solver.dictionary_solver import DictionarySolverBase
+
+
+class DictionaryCSPSolver(DictionarySolverBase):
+    """Solver that fills the grid from the provided dictionary by treating it
+    as a constraint satisfaction problem: every unfilled clue is a variable
+    whose domain is the set of dictionary words matching its current pattern,
+    and every crossing requires the two words to agree on the shared box.
+
+    The search backtracks, maintaining arc consistency (AC-3) after every
+    assignment. It fills the clue with the minimum remaining values first,
+    and tries its least constraining words first.
+    """
+    logger = logging.getLogger('littleboxes.solver.DictionaryCSPSolver')
+
+    def __init__(self, dictionary, max_solutions=None):
+        """Args:
+            dictionary (Dictionary): Dictionary of words to use as potential fills.
+            max_solutions (int or None): Stop after this many complete fills
+                have been found. If None, enumerate all of them.
+        """
+        self._dictionary = dictionary
+        self._max_solutions = max_solutions
+
+    def solve(self, xword):
+        '''Backtracking search for complete fills of a crossword
+
+        Arguments:
+            xword - a Crossword to be solved
+
+        Yields:
+            tuples (n_set, Crossword) of completely filled Crosswords. Nothing
+            is yielded if the puzzle cannot be filled from the dictionary.
+        '''
+        self.logger.info('Looking up answers in Dictionary')
+        domains = self.query_answers(xword)
+        for clue in xword.clues:
+            if clue not in domains and None in xword.get_fill(clue):
+                self.logger.info('No potential answers for %r', clue.text)
+                return
+
+        # Letters that are already filled in are part of each clue's pattern,
+        # so only crossings between unfilled clues are constraints.
+        neighbors = {clue: [crossing for crossing in crossings
+                            if crossing[0] in domains]
+                     for clue, crossings in xword.crossings.items()
+                     if clue in domains}
+
+        self.logger.info('Enforcing arc consistency')
+        arcs = [(clue, other, offset, other_offset)
+                for clue, crossings in neighbors.items()
+                for other, offset, other_offset in crossings]
+        if not self._propagate(domains, neighbors, arcs):
+            self.logger.info('Puzzle is not arc consistent')
+            return
+
+        self.logger.info('Searching for complete fills')
+        n_solutions = 0
+        for assignment in self._search(domains, neighbors):
+            solved = xword.copy()
+            for clue, words in assignment.items():
+                solved.set_fill(clue, words[0])
+            self.logger.info('Found solution')
+            yield solved.n_set, solved
+
+            n_solutions += 1
+            if self._max_solutions is not None and n_solutions >= self._max_solutions:
+                return
+
+    def _search(self, domains, neighbors):
+        '''Recursively assign words to clues, yielding the domains of each
+        complete, consistent assignment (every domain has exactly one word).
+        '''
+        unassigned = [clue for clue, words in domains.items() if len(words) > 1]
+        if not unassigned:
+            yield domains
+            return
+
+        # Minimum remaining values, breaking ties by the most crossings.
+        clue = min(unassigned,
+                   key=lambda clue: (len(domains[clue]), -len(neighbors[clue])))
+        self.logger.debug('Filling in %r with one of %d potential answers',
+                          clue.text, len(domains[clue]))
+
+        for word in self._order_words(clue, domains, neighbors):
+            trial = dict(domains)
+            trial[clue] = [word]
+            arcs = [(other, clue, other_offset, offset)
+                    for other, offset, other_offset in neighbors[clue]]
+            if self._propagate(trial, neighbors, arcs):
+                for assignment in self._search(trial, neighbors):
+                    yield assignment
+
+    def _order_words(self, clue, domains, neighbors):
+        '''Order the potential answers for clue so that the least constraining
+        words come first: those that leave the most words in the domains of
+        the crossing clues. Words that would empty a crossing domain are
+        dropped.
+        '''
+        letter_counts = [(offset, collections.Counter(
+                              word[other_offset] for word in domains[other]))
+                         for other, offset, other_offset in neighbors[clue]]
+
+        scored = []
+        for word in domains[clue]:
+            remaining = 0
+            for offset, counts in letter_counts:
+                n = counts[word[offset]]
+                if not n:
+                    break
+                remaining += n
+            else:
+                scored.append((remaining, word))
+
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return [word for _, word in scored]
+
+    def _propagate(self, domains, neighbors, arcs):
+        '''Apply AC-3 to the domains, starting from the given arcs.
+
+        Arguments:
+            domains - dict(XWClue: list(str)), modified in place.
+            neighbors - dict(XWClue: list(tuple(XWClue, int, int))), the
+                crossings between unfilled clues.
+            arcs - iterable of (clue, other, offset, other_offset) tuples:
+                the domain of clue is revised so that every word has a
+                supporting word in the domain of other.
+
+        Returns:
+            False if any domain was emptied, True otherwise.
+        '''
+        queue = collections.deque(arcs)
+        queued = set((clue, other) for clue, other, _, _ in queue)
+        while queue:
+            clue, other, offset, other_offset = queue.popleft()
+            queued.discard((clue, other))
+
+            letters = set(word[other_offset] for word in domains[other])
+            words = domains[clue]
+            revised = [word for word in words if word[offset] in letters]
+            if len(revised) == len(words):
+                continue
+            if not revised:
+                return False
+
+            domains[clue] = revised
+            for third, clue_offset, third_offset in neighbors[clue]:
+                if third != other and (third, clue) not in queued:
+                    queue.append((third, clue, third_offset, clue_offset))
+                    queued.add((third, clue))
+
+        return True
@@ -1,8 +1,7 @@
+import collections
 import logging
-from networkx import find_cliques
-import random
 
-from littleboxes.solver.clique import build_conflict_graph
+from littleboxes.solver.clique import check_engine, find_partial_fills
 from littleboxes.solver.solver import Solver
 
 
@@ -11,16 +10,44 @@ class DictionarySolverBase(Solver):
         answers = {}
 
         for xwclue in xword.clues:
-            current = xword.get_fill(xwclue)
-            if any(letter is None for letter in current):
-                pattern = {i: letter for i, letter in enumerate(current)
-                           if letter is not None}
-                words = list(self._dictionary.get_words(pattern=pattern, length=len(current)))
+            pattern = self._pattern(xword, xwclue)
+            if pattern is not None:
+                words = list(self._dictionary.get_words(
+                    pattern=pattern, length=len(xwclue.box_indices)))
                 if words:
                     answers[xwclue] = words
 
         return answers
 
+    def count_answers(self, xword):
+        """Count the dictionary words that could fill each unfilled clue,
+        without listing them.
+
+        Returns:
+            dict(XWClue: int) of the clues with at least one potential answer.
+        """
+        counts = {}
+
+        for xwclue in xword.clues:
+            pattern = self._pattern(xword, xwclue)
+            if pattern is not None:
+                n = self._dictionary.count_words(
+                    pattern=pattern, length=len(xwclue.box_indices))
+                if n:
+                    counts[xwclue] = n
+
+        return counts
+
+    @staticmethod
+    def _pattern(xword, xwclue):
+        """The dictionary pattern for the letters already filled in a clue,
+        or None if the clue is completely filled."""
+        current = xword.get_fill(xwclue)
+        if all(letter is not None for letter in current):
+            return None
+        return {i: letter for i, letter in enumerate(current)
+                if letter is not None}
+
 
 class DictionaryCliqueSolver(DictionarySolverBase):
     """Solver that looks for words in the provided dictionary that
@@ -28,20 +55,21 @@ class DictionaryCliqueSolver(DictionarySolverBase):
     """
     logger = logging.getLogger('littleboxes.solver.DictionaryCliqueSolver')
 
-    def __init__(self, dictionary):
+    def __init__(self, dictionary, engine='clique'):
         """Args:
             dictionary (Dictionary): Dictionary of words to use as potential fills.
+            engine (str): How to search for answers that can be played
+                together; see littleboxes.solver.clique.find_partial_fills.
         """
+        check_engine(engine)
         self._dictionary = dictionary
+        self._engine = engine
 
     def solve(self, xword):
         self.logger.info('Looking up answers in Dictionary')
         possible_answers = self.query_answers(xword)
-        self.logger.info('Generating conflict graph')
-        conflict_graph = build_conflict_graph(xword, possible_answers)
-
-        self.logger.info('Finding cliques in conflict graph')
-        for xwsolution in find_cliques(conflict_graph):
+        for xwsolution in find_partial_fills(xword, possible_answers,
+                                             self._engine, self.logger):
             solved = xword.copy()
             for fill in xwsolution:
                 solved.set_fill(fill.clue, fill.word)
@@ -49,6 +77,48 @@ class DictionaryCliqueSolver(DictionarySolverBase):
             yield solved.n_set, solved
 
 
+class PhraseCliqueSolver(DictionaryCliqueSolver):
+    """Solver that fills clues with the most plausible words and phrases of
+    a PhraseDictionary that satisfy the current constraints in the puzzle.
+
+    Only the k best phrases are tried for each clue, so clique-solving stays
+    tractable where every phrase of a long answer would not.
+    """
+    logger = logging.getLogger('littleboxes.solver.PhraseCliqueSolver')
+
+    def __init__(self, phrase_dictionary, k=100, max_words=None,
+                 engine='clique'):
+        """Args:
+            phrase_dictionary (PhraseDictionary): Words and phrases to use as
+                potential fills, ranked by its weights.
+            k (int): Number of phrases to try for each clue.
+            max_words (int or None): Largest number of words in a phrase.
+            engine (str): How to search for answers that can be played
+                together; see littleboxes.solver.clique.find_partial_fills.
+        """
+        check_engine(engine)
+        self._phrase_dictionary = phrase_dictionary
+        self._k = k
+        self._max_words = max_words
+        self._engine = engine
+
+    def query_answers(self, xword):
+        answers = {}
+
+        for xwclue in xword.clues:
+            pattern = self._pattern(xword, xwclue)
+            if pattern is not None:
+                phrases = self._phrase_dictionary.get_best(
+                    pattern, len(xwclue.box_indices), self._k, self._max_words)
+                # Different phrases can spell the same answer.
+                words = list(collections.OrderedDict.fromkeys(
+                    ''.join(phrase) for _, phrase in phrases))
+                if words:
+                    answers[xwclue] = words
+
+        return answers
+
+
 class DictionaryGuessSolver(DictionarySolverBase):
     logger = logging.getLogger('littleboxes.solver.DictionaryGuessSolver')
 
@@ -60,20 +130,48 @@ class DictionaryGuessSolver(DictionarySolverBase):
 
     def solve(self, xword):
         xword = xword.copy()
-        self.logger.info('Looking up answers in Dictionary')
-        potential_answers = self.query_answers(xword)
+        self.logger.info('Counting answers in Dictionary')
+        counts = self.count_answers(xword)
         self.logger.info('Filling in answers in order of minimum entropy')
-        while potential_answers:
-            self.logger.debug('%d clues with potential answers', len(potential_answers))
+        while counts:
+            self.logger.debug('%d clues with potential answers', len(counts))
             # Find the clue with the fewest potential answers.
-            clue = min(potential_answers, key=lambda clue: len(potential_answers[clue]))
+            clue = min(counts, key=counts.get)
+            n_answers = counts.pop(clue)
             self.logger.debug('Filling in %r with one of %d potential answers',
-                             clue.text, len(potential_answers[clue]))
+                              clue.text, n_answers)
             # Choose one answer randomly.
-            answer = random.choice(potential_answers[clue])
+            answer = self._dictionary.sample_word(
+                pattern=self._pattern(xword, clue), length=len(clue.box_indices))
             xword.set_fill(clue, answer)
-            self.logger.debug('Looking up answers in Dictionary')
-            potential_answers = self.query_answers(xword)
+            self._recount_crossings(xword, xword.crossings[clue], counts)
 
         self.logger.info('Found solution')
         yield xword.n_set, xword
+
+    def _recount_crossings(self, xword, crossings, counts):
+        """Update the number of potential answers of the clues crossing a
+        newly filled answer. Only the crossing clues can be affected by a fill,
+        so the rest of the grid is not re-counted.
+
+        Clues that are left with no potential answers, or that have been
+        completely filled in, are dropped from counts.
+
+        Args:
+            xword (Crossword): The crossword after the answer was filled in.
+            crossings (list(tuple(XWClue, int, int))): The crossings of the
+                clue that was just filled, from Crossword.crossings.
+            counts (dict(XWClue: int)): Modified in place.
+        """
+        for other, _, _ in crossings:
+            if other not in counts:
+                continue
+            pattern = self._pattern(xword, other)
+            n = 0
+            if pattern is not None:
+                n = self._dictionary.count_words(
+                    pattern=pattern, length=len(other.box_indices))
+            if n:
+                counts[other] = n
+            else:
+                del counts[other]
@@ -1,5 +1,8 @@
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import copy
+import heapq
+import logging
 
 
 class Solver(object, metaclass=ABCMeta):
@@ -22,19 +25,57 @@ class Solver(object, metaclass=ABCMeta):
 class MultiStageSolver(Solver):
     """Solver that strings a sequence of Solvers together."""
 
-    def __init__(self, solvers):
+    logger = logging.getLogger('littleboxes.solver.MultiStageSolver')
+
+    def __init__(self, solvers, beam_width=None, dedupe=False, processes=None):
+        """Args:
+            solvers (list(Solver)): A sequence of solvers to apply to the puzzle.
+            beam_width (int or None): If given, only the beam_width best
+                solutions from each stage are carried to the next one.
+                Otherwise every solution is, depth first.
+            dedupe (bool): In beam mode, keep only the best of any solutions
+                with identical grids.
+            processes (int or None): If given, the solutions from each stage
+                are passed on to the next one in this many worker processes.
+                The solvers (and their Dictionary or ClueDB) are sent to each
+                worker once when it starts, not with every puzzle.
+        """
         if not solvers:
             raise ValueError("You must provide at least 1 solver")
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        if processes is not None and processes < 1:
+            raise ValueError("processes must be at least 1")
         self.solvers = solvers
+        self.beam_width = beam_width
+        self.dedupe = dedupe
+        self.processes = processes
 
     def solve(self, xword):
         """Apply each of the solvers to the given puzzle.
-        All of the solutions returned at each stage are carried to the next round.
+        All of the solutions returned at each stage are carried to the next round,
+        unless beam_width is set, in which case only the best of them are.
         The likelihood for the returned solutions is the product of the likelihood
         that was assigned by each solver.
         """
-        for p, sol in self._solve_recursive(self.solvers, xword):
-            yield p, sol
+        if self.processes is None:
+            if self.beam_width is not None:
+                solutions = self._solve_beam(self.solvers, xword)
+            else:
+                solutions = self._solve_recursive(self.solvers, xword)
+            for p, sol in solutions:
+                yield p, sol
+            return
+
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 initializer=_init_worker,
+                                 initargs=(self,)) as pool:
+            if self.beam_width is not None:
+                solutions = self._solve_beam_parallel(pool, xword)
+            else:
+                solutions = self._solve_parallel(pool, xword)
+            for p, sol in solutions:
+                yield p, sol
 
     def _solve_recursive(self, solvers, xword):
         """Applies the first solver to the puzzle. Takes all of its proposed solutions
@@ -55,3 +96,143 @@ class MultiStageSolver(Solver):
                     yield p1*p2, s2
             else:
                 yield p1, s1
+
+    def _solve_parallel(self, pool, xword):
+        """Applies the first solver to the puzzle, and passes each of its
+        solutions to a worker process that applies the remaining solvers.
+        Solutions are yielded as the workers finish, so they are not in any
+        particular order.
+
+        Args:
+            pool (ProcessPoolExecutor): Workers initialized with _init_worker.
+            xword (Crossword): The crossword puzzle to solve.
+
+        Yields:
+            (float, Crossword): A possible Crossword solution and confidence/value.
+        """
+        if len(self.solvers) == 1:
+            for p, sol in self.solvers[0].solve(xword):
+                yield p, sol
+            return
+
+        # Bound the number of outstanding tasks, so that the first stage
+        # does not run arbitrarily far ahead of the workers.
+        max_pending = 2 * self.processes
+        pending = set()
+        for p1, s1 in self.solvers[0].solve(xword):
+            pending.add(pool.submit(_solve_remaining_stages, 1, p1, s1))
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for p, sol in future.result():
+                        yield p, sol
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for p, sol in future.result():
+                    yield p, sol
+
+    def _solve_beam_parallel(self, pool, xword):
+        """Like _solve_beam, but each solution kept from a stage is passed to
+        the next solver in a worker process, which returns only its
+        self.beam_width most likely solutions.
+
+        Args:
+            pool (ProcessPoolExecutor): Workers initialized with _init_worker.
+            xword (Crossword): The crossword puzzle to solve.
+
+        Returns:
+            list((float, Crossword)): The solutions kept from the last stage,
+                from most to least likely.
+        """
+        beam = [(1.0, xword)]
+        for stage in range(len(self.solvers)):
+            futures = [pool.submit(_solve_stage, stage, p1, s1) for p1, s1 in beam]
+            beam = self._prune(solution for future in futures
+                               for solution in future.result())
+            self.logger.info('Kept %d solutions from stage %d', len(beam), stage)
+        return beam
+
+    def _solve_beam(self, solvers, xword):
+        """Applies each solver in turn to the solutions kept from the previous
+        stage, keeping only the self.beam_width most likely of its solutions.
+
+        Args:
+            solvers (list(Solver)): A sequence of solvers to apply to the puzzle.
+            xword (Crossword): The crossword puzzle to solve.
+
+        Returns:
+            list((float, Crossword)): The solutions kept from the last stage,
+                from most to least likely.
+        """
+        beam = [(1.0, xword)]
+        for stage, solver in enumerate(solvers):
+            beam = self._prune(
+                (p1*p2, s2) for p1, s1 in beam for p2, s2 in solver.solve(s1))
+            self.logger.info('Kept %d solutions from stage %d', len(beam), stage)
+        return beam
+
+    def _prune(self, solutions):
+        """Select the self.beam_width most likely solutions, without holding
+        more than that many at once. Ties are broken in favor of the solution
+        that came first.
+
+        Args:
+            solutions (iterable((float, Crossword))): The solutions to select from.
+
+        Returns:
+            list((float, Crossword)): The selected solutions, from most to
+                least likely.
+        """
+        # Map of key -> (p, order, solution) for the solutions kept so far, and
+        # a min-heap of (p, -order, key) over them that may hold stale entries.
+        kept = {}
+        heap = []
+        for order, (p, sol) in enumerate(solutions):
+            key = sol.boxes if self.dedupe else order
+            if key in kept and kept[key][0] >= p:
+                continue
+            kept[key] = (p, order, sol)
+            heapq.heappush(heap, (p, -order, key))
+
+            while len(kept) > self.beam_width:
+                _, neg_order, key = heapq.heappop(heap)
+                if key in kept and kept[key][1] == -neg_order:
+                    del kept[key]
+
+        ranked = sorted(kept.values(), key=lambda k: (-k[0], k[1]))
+        return [(p, sol) for p, _, sol in ranked]
+
+
+# The MultiStageSolver that a worker process is running for. This is set once
+# when each worker starts, so that the solvers and their data are not sent
+# along with every task.
+_worker_solver = None
+
+
+def _init_worker(solver):
+    global _worker_solver
+    _worker_solver = solver
+
+
+def _solve_remaining_stages(start, p, xword):
+    """Apply the worker's solvers from stage start onwards to xword, depth first.
+
+    Returns:
+        list((float, Crossword)): Every solution, with its likelihood
+            multiplied by p.
+    """
+    solvers = _worker_solver.solvers[start:]
+    return [(p*p2, s2) for p2, s2 in _worker_solver._solve_recursive(solvers, xword)]
+
+
+def _solve_stage(stage, p, xword):
+    """Apply one of the worker's solvers to xword, in beam mode.
+
+    Returns:
+        list((float, Crossword)): The beam_width most likely solutions, with
+            their likelihoods multiplied by p.
+    """
+    solver = _worker_solver.solvers[stage]
+    return _worker_solver._prune((p*p2, s2) for p2, s2 in solver.solve(xword))
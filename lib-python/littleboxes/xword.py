@@ -1,4 +1,5 @@
 from collections import namedtuple
+from collections.abc import Sequence
 import enum
 import logging
 import puz
@@ -26,9 +27,44 @@ XWClue = namedtuple('XWClue', ['coord', 'text', 'box_indices'])
 XWFill = namedtuple('XWFill', ['clue', 'word'])
 
 
+def build_crossings(clues):
+    '''Find the clues that cross each clue.
+
+    Args:
+        clues (iterable(XWClue)): The clues of a Crossword.
+
+    Returns:
+        dict(XWClue: list(tuple(XWClue, int, int))): For each clue, the
+            clues that share a box with it, as (other clue, offset of the
+            box in this clue, offset of the box in the other clue).
+    '''
+    cell_clues = {}
+    for clue in clues:
+        for offset, idx in enumerate(clue.box_indices):
+            cell_clues.setdefault(idx, []).append((clue, offset))
+
+    crossings = {clue: [] for clue in clues}
+    for shared in cell_clues.values():
+        for clue, offset in shared:
+            for other, other_offset in shared:
+                if other != clue:
+                    crossings[clue].append((other, offset, other_offset))
+    return crossings
+
+
+# Codes for the boxes of a Crossword's grid. Letters are stored as their
+# character codes, which are all greater than these.
+_EMPTY = 0
+_BLACK = 1
+
+
 class Crossword(object):
     '''A Crossword puzzle is a set of XWClues arranged on an WxH grid,
     and an associated fill of letters in that grid.
+
+    The grid is stored compactly as a bytearray with one code per box, and
+    every change made to it is recorded on a trail, so that solvers can make
+    assignments and roll them back in place instead of copying the puzzle.
     '''
     black_square = object()
     logger = logging.getLogger('littleboxes.xword.Crossword')
@@ -38,43 +74,134 @@ class Crossword(object):
         self.height = height
         self.clues = clues
         if solution is not None:
-            self.solution = solution
+            self._boxes = bytearray(self._encode(box) for box in solution)
         else:
-            self.solution = [None for _ in range(width * height)]
+            self._boxes = bytearray(width * height)
             self._fill_black_squares()
+        # List of (index, previous code) for every change made to the grid.
+        self._trail = []
+        self._n_set = len(self._boxes) - self._boxes.count(_EMPTY)
         self._validate()
+        self._build_topology()
+
+    def _build_topology(self):
+        '''Precompute how the clues of the puzzle cross each other. Since the
+        clues never change, this is shared by every copy of the Crossword.
+
+            cell_clues: list, for each box, of the (XWClue, offset) pairs of
+                the clues that pass through it.
+            crossings: dict(XWClue: list(tuple(XWClue, int, int))), the clues
+                crossing each clue, as from build_crossings().
+        '''
+        self.cell_clues = [() for _ in self._boxes]
+        for clue in self.clues:
+            for offset, idx in enumerate(clue.box_indices):
+                self.cell_clues[idx] += ((clue, offset),)
+        self.crossings = build_crossings(self.clues)
+
+        # Map of XWClue -> slice of the grid, for clues whose boxes are
+        # evenly spaced (all of them, for a puzzle from load()).
+        self._spans = {}
+        for clue in self.clues:
+            indices = clue.box_indices
+            if not indices:
+                continue
+            step = indices[1] - indices[0] if len(indices) > 1 else 1
+            if step > 0 and all(b - a == step for a, b in zip(indices, indices[1:])):
+                self._spans[clue] = slice(indices[0], indices[-1] + 1, step)
+
+    @property
+    def solution(self):
+        '''The fill of the grid, as a sequence of letters in row-major order.
+        Unfilled squares are None and black squares are black_square. Boxes
+        can be assigned through it, e.g. xword.solution[idx] = 'A'.
+        '''
+        return _Solution(self)
+
+    @property
+    def boxes(self):
+        '''The fill of the grid as bytes, which are cheap to hash and compare'''
+        return bytes(self._boxes)
 
     @property
     def n_set(self):
-        return sum(1 for box in self.solution if box is not None)
+        return self._n_set
+
+    @classmethod
+    def _encode(cls, box):
+        if box is None:
+            return _EMPTY
+        if box is cls.black_square:
+            return _BLACK
+        code = ord(box)
+        if not _BLACK < code < 256:
+            raise ValueError("Cannot store %r in a Crossword" % (box,))
+        return code
+
+    @classmethod
+    def _decode(cls, code):
+        if code == _EMPTY:
+            return None
+        if code == _BLACK:
+            return cls.black_square
+        return chr(code)
+
+    def _set_box(self, idx, code):
+        previous = self._boxes[idx]
+        if previous != code:
+            self._trail.append((idx, previous))
+            self._boxes[idx] = code
+            self._n_set += (previous == _EMPTY) - (code == _EMPTY)
 
     def _fill_black_squares(self):
         '''Goes through the set of clues, and marks squares which are not
         involved in any clue (black squares in the puzzle). These squares
         should be considered "filled" and never touched.
         '''
-        touched = [False for _ in self.solution]
+        touched = [False for _ in self._boxes]
         for clue in self.clues:
             for idx in clue.box_indices:
                 touched[idx] = True
         for idx, t in enumerate(touched):
             if not t:
-                self.solution[idx] = self.black_square
+                self._boxes[idx] = _BLACK
 
     def _validate(self):
         for clue in self.clues:
             for idx in clue.box_indices:
-                if idx < 0 or idx >= len(self.solution):
+                if idx < 0 or idx >= len(self._boxes):
                     raise InvalidCrosswordException("Invalid clue indices")
-                if self.solution[idx] == self.black_square:
+                if self._boxes[idx] == _BLACK:
                     raise InvalidCrosswordException("Clue with black square?!")
 
     def copy(self):
         '''Return a copy of this Crossword. The clues are not copied since they
-        are immutable, but the solution is.
+        are immutable, but the grid is. The copy is not revalidated, and starts
+        with an empty trail: changes made before the copy cannot be rolled back
+        on it.
+        '''
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other._boxes = bytearray(self._boxes)
+        other._trail = []
+        return other
+
+    def checkpoint(self):
+        '''Return a marker for the current state of the grid, which can be
+        passed to rollback() to undo every change made after this call.
+        '''
+        return len(self._trail)
+
+    def rollback(self, checkpoint):
+        '''Undo every change made to the grid since checkpoint() returned
+        the given marker.
         '''
-        sol_copy = list(self.solution)
-        return self.__class__(self.width, self.height, self.clues, sol_copy)
+        trail = self._trail
+        boxes = self._boxes
+        while len(trail) > checkpoint:
+            idx, code = trail.pop()
+            self._n_set += (code != _EMPTY) - (boxes[idx] != _EMPTY)
+            boxes[idx] = code
 
     @classmethod
     def load(cls, istream, include_solution=False):
@@ -106,7 +233,13 @@ class Crossword(object):
         Returns:
             list(char or None): The current fill for this clue.
         '''
-        return [self.solution[idx] for idx in clue.box_indices]
+        span = self._spans.get(clue)
+        if span is not None:
+            return [chr(code) if code != _EMPTY else None
+                    for code in self._boxes[span]]
+        boxes = self._boxes
+        return [chr(boxes[idx]) if boxes[idx] != _EMPTY else None
+                for idx in clue.box_indices]
 
     def set_fill(self, clue, answer):
         '''Fill in the letters for the given clue with the provided answer.
@@ -129,8 +262,18 @@ class Crossword(object):
             raise InvalidCrosswordException(
                 "Cannot set %s to %s (currently %s)" % (
                     clue, answer, self.get_fill(clue)))
+
+        # Fast path: write an answer into a completely empty span at once.
+        span = self._spans.get(clue)
+        if span is not None and isinstance(answer, str):
+            if self._boxes[span].count(_EMPTY) == len(answer):
+                self._boxes[span] = bytes(self._encode(letter) for letter in answer)
+                self._trail.extend((idx, _EMPTY) for idx in clue.box_indices)
+                self._n_set += len(answer)
+                return
+
         for idx, letter in zip(clue.box_indices, answer):
-            self.solution[idx] = letter
+            self._set_box(idx, self._encode(letter))
 
     def would_conflict(self, clue, answer):
         '''Return whether or not the proposed answer for this clue conflicts
@@ -141,7 +284,43 @@ class Crossword(object):
                              "for %s (%d != %d)" % (
                                  answer, clue,
                                  len(answer), len(clue.box_indices)))
+        boxes = self._boxes
+        span = self._spans.get(clue)
+        if span is not None and boxes[span].count(_EMPTY) == len(answer):
+            return False
         for idx, letter in zip(clue.box_indices, answer):
-            if self.solution[idx] is not None and self.solution[idx] != letter:
+            if boxes[idx] != _EMPTY and boxes[idx] != ord(letter):
                 return True
         return False
+
+
+class _Solution(Sequence):
+    '''A view of the grid of a Crossword as a sequence of letters, None for
+    unfilled squares and Crossword.black_square for black squares.
+    '''
+
+    def __init__(self, xword):
+        self._xword = xword
+
+    def __len__(self):
+        return len(self._xword._boxes)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._xword._decode(code) for code in self._xword._boxes[idx]]
+        return self._xword._decode(self._xword._boxes[idx])
+
+    def __setitem__(self, idx, box):
+        if idx < 0:
+            idx += len(self)
+        self._xword._set_box(idx, self._xword._encode(box))
+
+    def __iter__(self):
+        decode = self._xword._decode
+        return (decode(code) for code in self._xword._boxes)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
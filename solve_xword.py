@@ -3,12 +3,13 @@ import logging
 import os
 
 from littleboxes.cluedb import ClueDB
-from littleboxes.dictionary import Dictionary, PhraseDictionary
+from littleboxes.dictionary import Dictionary, PhraseDictionary, load_weights
 from littleboxes.solver.solver import MultiStageSolver
 from littleboxes.solver.cluedb_solver import ClueDBCliqueSolver
 from littleboxes.solver.dictionary_solver import (
     DictionaryCliqueSolver,
     DictionaryGuessSolver,
+    PhraseCliqueSolver,
 )
 from littleboxes.xword import Crossword
 
@@ -31,18 +32,51 @@ def pretty_print(x):
         print(''.join(row))
 
 
+def load_dictionary(path, cache_size=None):
+    '''Memory-map a compiled dictionary, or else load a word list'''
+    try:
+        return Dictionary.open(path, cache_size=cache_size)
+    except ValueError:
+        with open(path) as istream:
+            return Dictionary.load(istream, cache_size=cache_size)
+
+
+def load_cluedb(path):
+    '''Memory-map a ClueDB file, or else load a MessagePack ClueDB'''
+    try:
+        return ClueDB.open(path)
+    except ValueError:
+        with open(path, 'rb') as istream:
+            return ClueDB.deserialize(istream)
+
+
 def opts():
     parser = argparse.ArgumentParser(description='Solve a crossword puzzle.')
     parser.add_argument('puzzle', type=argparse.FileType('r'),
                         help='The crossword puzzle to solve, in *.puz format')
-    parser.add_argument('--dictionary', type=argparse.FileType('r'),
+    parser.add_argument('--dictionary',
                         default=os.path.join(DICTIONARIES_DIR, 'en.txt'),
-                        help='Dictionary of words to use (default: %(default)s)')
-    parser.add_argument('--cluedb', type=argparse.FileType('r'),
+                        help='Dictionary of words to use, either a text file '
+                        'with one word per line or a file written by '
+                        'compile_dictionary.py (default: %(default)s)')
+    parser.add_argument('--dictionary-cache', type=int, default=None,
+                        help='Number of dictionary queries to cache '
+                        '(default: no cache)')
+    parser.add_argument('--weights', type=argparse.FileType('r'),
+                        help='Word frequencies to rank phrases by, with one '
+                        'word and its count per line (default: none)')
+    parser.add_argument('--phrases', type=int, default=100,
+                        help='Number of the best phrases to try for each '
+                        'clue, or 0 to skip phrases (default: %(default)s)')
+    parser.add_argument('--cluedb',
                         default=os.path.join(CLUES_DIR, 'clues.mpk'),
-                        help='Clue database to use (default: %(default)s)')
+                        help='Clue database to use, either in *.mpk format or '
+                        'a file written by ClueDB.save (default: %(default)s)')
     parser.add_argument('--nsolutions', type=int, default=1,
                         help='Number of solutions to show (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes to solve with '
+                        '(default: solve in this process)')
     parser.add_argument('--logging',
                         choices=('debug', 'info', 'warning',
                                  'error', 'critical'),
@@ -58,20 +92,21 @@ def main():
     x = Crossword.load(args.puzzle)
 
     logging.info("Loading clue DB")
-    db = ClueDB.deserialize(args.cluedb)
+    db = load_cluedb(args.cluedb)
 
     logging.info("Loading dictionary")
-    dictionary = Dictionary.load(args.dictionary)
-    # TODO: Too many possibilities for clique-solving!
-    pd = PhraseDictionary(dictionary)
+    dictionary = load_dictionary(args.dictionary, args.dictionary_cache)
+    solvers = [ClueDBCliqueSolver(db)]
+    if args.phrases > 0:
+        # Every phrase is too many possibilities for clique-solving, so only
+        # the best ones are tried.
+        weights = load_weights(args.weights) if args.weights else None
+        pd = PhraseDictionary(dictionary, weights)
+        solvers.append(PhraseCliqueSolver(pd, k=args.phrases))
+    solvers.append(DictionaryGuessSolver(dictionary))
 
     logging.info("Solving puzzle")
-    solver = MultiStageSolver(
-        solvers=[
-            ClueDBCliqueSolver(db),
-            DictionaryGuessSolver(dictionary),
-        ],
-    )
+    solver = MultiStageSolver(solvers=solvers, processes=args.processes)
 
     solutions = solver.solve(x)
     for i, (p, solution) in enumerate(solutions):
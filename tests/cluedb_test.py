@@ -5,10 +5,20 @@ Created on Feb 24, 2016
 '''
 import unittest
 import os
-from io import StringIO
+import pickle
+import shutil
+import tempfile
+from io import BytesIO
 import time
 
-from littleboxes.cluedb import ClueDB
+from littleboxes.cluedb import (
+    ClueDB,
+    ClueDBRecord,
+    merge_shards,
+    parse_puzzle,
+    write_shard,
+)
+from littleboxes.xword import Crossword
 
 
 PERFORMANCE = bool(int(os.getenv('PERFORMANCE', False)))
@@ -42,7 +52,7 @@ class TestSerialization(unittest.TestCase):
     def test_speed_msgpack(self):
         self.testname = 'MessagePack'
         for _ in range(self.repeat):
-            with open(self.TEST_MPACK, 'r') as dbdump:
+            with open(self.TEST_MPACK, 'rb') as dbdump:
                 start = time.time()
                 test_db = ClueDB.deserialize(dbdump)
                 self.times.append(time.time() - start)
@@ -54,15 +64,370 @@ class TestSerialization(unittest.TestCase):
         with open(self.TEST_DB, 'r') as db:
             self.db = ClueDB.load(db)
 
-        ostream = StringIO()
+        ostream = BytesIO()
         self.db.serialize(ostream)
-        istream = StringIO(ostream.getvalue())
+        istream = BytesIO(ostream.getvalue())
         test_db = ClueDB.deserialize(istream)
 
         self.times.append(time.time() - start)
 
         self.assertEqual(self.db, test_db)
 
+
+class TestRecords(unittest.TestCase):
+    TEST_DB = TestSerialization.TEST_DB
+
+    def test_format(self):
+        with open(self.TEST_DB, 'r') as istream:
+            for line in istream:
+                self.assertEqual(ClueDBRecord.parse(line).format(),
+                                 line.rstrip('\n'))
+
+        record = ClueDBRecord('Feline\npet', 'cat', year=-1, num=12)
+        parsed = ClueDBRecord.parse(record.format())
+        self.assertEqual((parsed.text, parsed.answer, parsed.source,
+                          parsed.year, parsed.num),
+                         ('Feline pet', 'cat', 'unk', -1, 9))
+        self.assertEqual(parsed.sort_key(), ('feline pet', 'CAT'))
+        self.assertRaises(ValueError, ClueDBRecord('Long', 'A' * 27).format)
+
+        record = ClueDBRecord('Feline pet', 'CAT', source='NY', year=2001)
+        parsed = ClueDBRecord.parse(record.format())
+        self.assertEqual((parsed.text, parsed.source, parsed.year),
+                         ('Feline pet', 'NY', 2001))
+        self.assertRaises(ValueError,
+                          ClueDBRecord('Feline pet', 'CAT', source='NYTX').format)
+
+    def test_write_answers(self):
+        with open(self.TEST_DB, 'r') as istream:
+            db = ClueDB.load(istream)
+        clue_answers = dict((clue, db.answers(clue))
+                            for clue in db._clue_to_answers)
+
+        ostream = BytesIO()
+        ClueDB.serialize_answers(ostream, sorted(clue_answers.items()))
+        self.assertEqual(ClueDB.deserialize(BytesIO(ostream.getvalue())), db)
+
+        fd, path = tempfile.mkstemp(suffix='.cdb')
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                ClueDB.save_answers(ostream, clue_answers)
+            self.assertEqual(ClueDB.open(path), db)
+        finally:
+            os.remove(path)
+
+
+class TestShards(unittest.TestCase):
+    TEST_PUZ = os.path.join(os.path.dirname(__file__), 'fixtures', 'test.puz')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_puzzle(self):
+        records = parse_puzzle(self.TEST_PUZ, 'NYT')
+        with open(self.TEST_PUZ, 'rb') as istream:
+            xword = Crossword.load(istream, include_solution=True)
+        self.assertEqual(len(records), len(xword.clues))
+        self.assertListEqual(
+            sorted((record.text, record.answer) for record in records),
+            sorted((clue.text, ''.join(xword.get_fill(clue)))
+                   for clue in xword.clues))
+        self.assertTrue(all((record.source, record.year) == ('NYT', 2015)
+                            for record in records))
+
+    def test_merge_shards(self):
+        records = parse_puzzle(self.TEST_PUZ)
+        # Split the clues across shards, with some in more than one, so
+        # that the merge has to group them.
+        shards = [os.path.join(self.tmpdir, 'shard-%d.txt' % i)
+                  for i in range(3)]
+        write_shard(records[::2], shards[0])
+        write_shard(records[1::2], shards[1])
+        write_shard(records[:20], shards[2])
+        for shard in shards:
+            with open(shard) as istream:
+                keys = [ClueDBRecord.parse(line).sort_key()
+                        for line in istream]
+            self.assertListEqual(keys, sorted(keys))
+
+        merged = list(merge_shards(shards))
+        clues = [clue for clue, _ in merged]
+        self.assertListEqual(clues, sorted(set(clues)))
+
+        with open(self.TEST_PUZ, 'rb') as istream:
+            xword = Crossword.load(istream, include_solution=True)
+        expected = ClueDB()
+        for clue in xword.clues:
+            expected.add(clue.text, ''.join(xword.get_fill(clue)))
+        self.assertDictEqual(dict(merged), expected._all_answers())
+
+    def test_save_merged_shards(self):
+        shard = os.path.join(self.tmpdir, 'shard.txt')
+        write_shard(parse_puzzle(self.TEST_PUZ), shard)
+        streamed, from_dict = BytesIO(), BytesIO()
+        ClueDB.save_answers(streamed, merge_shards([shard]))
+        ClueDB.save_answers(from_dict, dict(merge_shards([shard])))
+        self.assertEqual(streamed.getvalue(), from_dict.getvalue())
+
+        backwards = reversed(list(merge_shards([shard])))
+        self.assertRaises(ValueError, ClueDB.save_answers, BytesIO(), backwards)
+
+
+class TestSegments(unittest.TestCase):
+    ENTRIES = [('feline pet', 'CAT'), ('feline pets', 'TOM'),
+               ('feline pets', 'CATS'), ('baby bed', 'COT'),
+               ('baby bed', 'CRIB'), ('number of toes', 'TEN')]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'clues.cdb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def clue_answers(entries):
+        clue_answers = {}
+        for clue, answer in entries:
+            clue_answers.setdefault(clue, set()).add(answer)
+        return clue_answers
+
+    def expected(self, entries):
+        db = ClueDB()
+        for clue, answer in entries:
+            db.add(clue, answer)
+        return db
+
+    def test_append(self):
+        self.assertEqual(
+            ClueDB.append(self.path, self.clue_answers(self.ENTRIES[:3])), 1)
+        self.assertEqual(
+            ClueDB.append(self.path, self.clue_answers(self.ENTRIES[2:])), 2)
+
+        db = ClueDB.open(self.path)
+        expected = self.expected(self.ENTRIES)
+        self.assertEqual(db.n_segments, 2)
+        # 'feline pets' is in both segments, but is only counted once.
+        self.assertEqual(len(db), len(expected))
+        db.add('feline pets', 'LIONS')
+        db.add('a new clue', 'NEW')
+        self.assertEqual(len(db), len(expected) + 1)
+        db = ClueDB.open(self.path)
+        self.assertEqual(db, expected)
+        self.assertSetEqual(db.answers('feline pets', 4), {'CATS'})
+        queries = [('Feline pet', 3), ('Feline pets', 4), ('Baby beds', 4),
+                   ('Number of toes', 3)]
+        for threshold in (1.0, 0.5, 0.1):
+            self.assertListEqual(db.search_many(queries, threshold),
+                                 expected.search_many(queries, threshold))
+            self.assertListEqual(sorted(db.search('feline pets', threshold)),
+                                 sorted(expected.search('feline pets', threshold)))
+
+    def test_incomplete_segment(self):
+        ClueDB.append(self.path, self.clue_answers(self.ENTRIES[:3]))
+        size = os.path.getsize(self.path)
+        ClueDB.append(self.path, self.clue_answers(self.ENTRIES[3:5]))
+        # Cut the second segment short, as if the append had not finished.
+        with open(self.path, 'r+b') as ostream:
+            ostream.truncate(os.path.getsize(self.path) - 5)
+        self.assertEqual(ClueDB.open(self.path),
+                         self.expected(self.ENTRIES[:3]))
+
+        self.assertEqual(
+            ClueDB.append(self.path, self.clue_answers(self.ENTRIES[5:])), 2)
+        self.assertGreater(os.path.getsize(self.path), size)
+        self.assertEqual(ClueDB.open(self.path),
+                         self.expected(self.ENTRIES[:3] + self.ENTRIES[5:]))
+
+    def test_merge(self):
+        other = os.path.join(self.tmpdir, 'other.cdb')
+        with open(self.path, 'wb') as ostream:
+            self.expected(self.ENTRIES[:2]).save(ostream)
+        ClueDB.append(other, self.clue_answers(self.ENTRIES[2:4]))
+        ClueDB.append(other, self.clue_answers(self.ENTRIES[4:]))
+
+        self.assertEqual(ClueDB.merge(self.path, other), 3)
+        self.assertEqual(ClueDB.open(self.path), self.expected(self.ENTRIES))
+        # Merging into a new file copies the other file.
+        new = os.path.join(self.tmpdir, 'new.cdb')
+        self.assertEqual(ClueDB.merge(new, other), 2)
+        self.assertEqual(ClueDB.open(new), ClueDB.open(other))
+
+        with open(other, 'wb') as ostream:
+            ClueDB(N=4).save(ostream)
+        self.assertRaises(ValueError, ClueDB.merge, self.path, other)
+
+    def test_compact(self):
+        for entry in self.ENTRIES:
+            ClueDB.append(self.path, self.clue_answers([entry]))
+        before = ClueDB.open(self.path)
+        self.assertEqual(before.n_segments, len(self.ENTRIES))
+
+        ClueDB.compact(self.path)
+        after = ClueDB.open(self.path)
+        self.assertEqual(after.n_segments, 1)
+        self.assertEqual(after, self.expected(self.ENTRIES))
+        # The DB opened before still reads the old file, but it can no
+        # longer be pickled by reference to the path.
+        self.assertEqual(before, after)
+        self.assertRaises(ValueError, pickle.loads, pickle.dumps(before))
+
+        ClueDB.append(self.path, self.clue_answers([('new clue', 'NEW')]))
+        future = ClueDB.compact(self.path, background=True)
+        future.result()
+        db = ClueDB.open(self.path)
+        self.assertEqual(db.n_segments, 1)
+        self.assertSetEqual(db.answers('new clue'), {'NEW'})
+
+
+class TestSearch(unittest.TestCase):
+    ENTRIES = [('Feline pet', 'CAT'), ('Feline pets', 'TOM'),
+               ('Feline pets', 'CATS'), ('Baby bed', 'COT'),
+               ('Baby bed', 'CRIB'), ('Number of toes', 'TEN')]
+
+    def setUp(self):
+        self.db = ClueDB()
+        for text, answer in self.ENTRIES:
+            self.db.add(text, answer)
+
+    def test_answers_by_length(self):
+        self.assertSetEqual(self.db.answers('Feline pets'), {'TOM', 'CATS'})
+        self.assertSetEqual(self.db.answers('Feline pets', 4), {'CATS'})
+        self.assertSetEqual(self.db.answers('Feline pets', 5), set())
+        # The sets returned are copies.
+        self.db.answers('Feline pets', 3).add('PUS')
+        self.assertSetEqual(self.db.answers('Feline pets', 3), {'TOM'})
+
+    def test_search_many_skips_lengths(self):
+        # Only 'feline pets' has a four-letter answer.
+        results = self.db.search_many([('Feline pet', 4)], 0.1)
+        self.assertListEqual([clue for clue, _, _ in results[0]],
+                             ['feline pets'])
+
+    def test_search_many_exact(self):
+        results = self.db.search_many([('Feline pet', 3), ('BABY BED', 4),
+                                       ('Baby bed', 5), ('Unknown', 3)])
+        self.assertListEqual(results, [
+            [('feline pet', 1.0, {'CAT'})],
+            [('baby bed', 1.0, {'CRIB'})],
+            [],
+            [],
+        ])
+
+    def test_search_many_matches_search(self):
+        queries = [('Feline pet', 3), ('Feline pet', 4), ('Baby beds', 3),
+                   ('Number of toes', 3), ('Feline pet', 3)]
+        for threshold in (0.0, 0.3, 0.5, 0.9):
+            results = self.db.search_many(queries, threshold)
+            self.assertEqual(len(results), len(queries))
+            for (text, length), hits in zip(queries, results):
+                expected = []
+                for clue, similarity in self.db.search(text, threshold):
+                    answers = self.db.answers(clue, length)
+                    if answers:
+                        expected.append((clue, similarity, answers))
+                self.assertListEqual(hits, expected)
+
+
+class TestBinaryFormat(unittest.TestCase):
+    TEST_DB = TestSerialization.TEST_DB
+
+    @classmethod
+    def setUpClass(cls):
+        with open(cls.TEST_DB, 'r') as istream:
+            cls.db = ClueDB.load(istream)
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.cdb')
+        with os.fdopen(fd, 'wb') as ostream:
+            self.db.save(ostream)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        db = ClueDB.open(self.path)
+        self.assertEqual(len(db), len(self.db))
+        self.assertEqual(db, self.db)
+        for clue in ['overseas', 'auto club letters']:
+            self.assertSetEqual(db.answers(clue), self.db.answers(clue))
+        self.assertRaises(KeyError, db.answers, 'no such clue')
+
+    def test_search(self):
+        db = ClueDB.open(self.path)
+        self.assertEqual(db.search('Overseas', 1.0), {('overseas', 1.0)})
+        self.assertEqual(db.search('Oversees', 1.0), {})
+        for query in ['Overseas!', 'Auto club', 'Strike out']:
+            for threshold in (0.3, 0.6):
+                self.assertListEqual(
+                    sorted(db.search(query, threshold)),
+                    sorted(self.db.search(query, threshold)))
+
+        queries = [('Overseas', 2), ('Overseas!', 2), ('Auto club', 3),
+                   ('Auto club letters', 3), ('Overseas', 5)]
+        for threshold in (1.0, 0.5):
+            results = db.search_many(queries, threshold)
+            expected = self.db.search_many(queries, threshold)
+            for hits, expected_hits in zip(results, expected):
+                self.assertListEqual(sorted(hits), sorted(expected_hits))
+
+    def test_add_after_open(self):
+        db = ClueDB.open(self.path)
+        db.add('Overseas', 'AFAR')
+        db.add('A brand new clue', 'NEW')
+        self.assertEqual(len(db), len(self.db) + 1)
+        self.assertSetEqual(db.answers('overseas'), {'AA', 'AFAR'})
+        self.assertEqual(db.search('a brand new clue', 1.0),
+                         {('a brand new clue', 1.0)})
+        results = db.search_many([('A brand new clues', 3)], 0.5)
+        self.assertTupleEqual(results[0][0][::2], ('a brand new clue', {'NEW'}))
+
+        # Saving writes the mapped and the added clues together.
+        fd, path = tempfile.mkstemp(suffix='.cdb')
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                db.save(ostream)
+            self.assertEqual(ClueDB.open(path), db)
+        finally:
+            os.remove(path)
+
+    def test_pickle(self):
+        db = pickle.loads(pickle.dumps(ClueDB.open(self.path)))
+        self.assertEqual(db, self.db)
+
+    def test_bad_file(self):
+        fd, path = tempfile.mkstemp(suffix='.mpk')
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                self.db.serialize(ostream)
+            self.assertRaises(ValueError, ClueDB.open, path)
+        finally:
+            os.remove(path)
+
+    def test_truncated_header(self):
+        for length in (12, 10):
+            os.truncate(self.path, length)
+            self.assertRaises(ValueError, ClueDB.open, self.path)
+
+    @unittest.skipIf(not PERFORMANCE, 'Not running performance tests')
+    def test_speed_open(self):
+        for name, load in [('open', lambda: ClueDB.open(self.path)),
+                           ('deserialize', self.deserialize)]:
+            start = time.time()
+            db = load()
+            db.search_many([('Overseas', 2), ('Auto club', 3)], 0.5)
+            print('ClueDB loading test: %s, %0.4f seconds' % (
+                name, time.time() - start))
+
+    def deserialize(self):
+        ostream = BytesIO()
+        self.db.serialize(ostream)
+        return ClueDB.deserialize(BytesIO(ostream.getvalue()))
+
+
 if __name__ == "__main__":
     logging.getLogger('root').disabled = True
     unittest.main()
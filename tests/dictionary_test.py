@@ -3,20 +3,64 @@ Created on Dec 31, 2015
 
 @author: justinpalpant
 '''
+import io
 import unittest
 import logging
 import os
+import pickle
+import random
+import subprocess
+import tempfile
 import time
 import sys
+import tracemalloc
 
 from littleboxes.dictionary import (
+    INDEXES,
+    CompactTrie,
+    Dawg,
     Dictionary,
     PhraseDictionary,
+    LetterMatrix,
     Trie,
+    freeze_pattern,
+    load_weights,
 )
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 performance_test = bool(int(os.getenv('PERFORMANCE', False)))
 
+STATM = '/proc/self/statm'
+
+# Prints the growth of the resident set from loading a dictionary file with
+# an index, and the mean time of a pattern query on it.
+RSS_SCRIPT = '''
+import os, sys, time
+from littleboxes.dictionary import Dictionary
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+path, index = sys.argv[1:]
+before = rss()
+with open(path) as istream:
+    d = Dictionary.load(istream, index=index)
+after = rss()
+start = time.time()
+for _ in range(100):
+    d.get_words(pattern={0: 'A', 2: 'E'}, length=5)
+print(after - before, (time.time() - start) / 100)
+'''
+
+# The indexes that can be used here; the numpy index needs NumPy.
+AVAILABLE_INDEXES = dict((name, index) for name, index in INDEXES.items()
+                         if numpy is not None or index is not LetterMatrix)
+
 
 class TestDictionary(unittest.TestCase):
 
@@ -187,6 +231,471 @@ class TestDictionary(unittest.TestCase):
         return wordslist
 
 
+class TestIndexes(unittest.TestCase):
+    PATTERNS = [{}, {0: 'A'}, {4: 'E', 1: 'C'}, {4: 'Q'}, {2: 'A', 3: 'R'},
+                {0: 'Z', 1: 'Z'}, {9: 'S'}]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dictionary_file = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'fixtures', 'test.dict')
+        cls.dictionaries = {}
+        for index in AVAILABLE_INDEXES:
+            with open(cls.dictionary_file) as istream:
+                cls.dictionaries[index] = Dictionary.load(istream, index=index)
+        cls.trie_dictionary = cls.dictionaries['trie']
+
+    def test_unknown_index(self):
+        with self.assertRaises(ValueError):
+            Dictionary(index='nope')
+
+    def test_size(self):
+        for index, d in self.dictionaries.items():
+            self.assertEqual(d.size, self.trie_dictionary.size, index)
+
+    def test_is_word(self):
+        for index, d in self.dictionaries.items():
+            for w in self.trie_dictionary:
+                self.assertTrue(d.is_word(w), index)
+            self.assertFalse(d.is_word('noexisto'), index)
+            self.assertFalse(d.is_word('A'), index)
+
+    def test_matches_trie(self):
+        lengths = [0] + sorted(self.trie_dictionary.binned_tries) + [99]
+        for index, d in self.dictionaries.items():
+            for length in lengths:
+                for p in self.PATTERNS:
+                    self.assertListEqual(
+                        d.get_words(pattern=p, length=length),
+                        self.trie_dictionary.get_words(pattern=p, length=length),
+                        index)
+
+    def test_iter_words(self):
+        for index, d in self.dictionaries.items():
+            for p in self.PATTERNS:
+                self.assertListEqual(list(d.iter_words(pattern=p)),
+                                     d.get_words(pattern=p), index)
+                self.assertListEqual(list(d.iter_words(pattern=p, length=5)),
+                                     d.get_words(pattern=p, length=5), index)
+
+    def test_count_words(self):
+        lengths = [0] + sorted(self.trie_dictionary.binned_tries) + [99]
+        for index, d in self.dictionaries.items():
+            for length in lengths:
+                for p in self.PATTERNS:
+                    self.assertEqual(
+                        d.count_words(pattern=p, length=length),
+                        len(d.get_words(pattern=p, length=length)), index)
+
+    def test_sample_word(self):
+        random.seed(0)
+        for index, d in self.dictionaries.items():
+            for p in self.PATTERNS:
+                words = d.get_words(pattern=p, length=5)
+                if not words:
+                    self.assertIsNone(d.sample_word(pattern=p, length=5))
+                    continue
+                for _ in range(10):
+                    self.assertIn(d.sample_word(pattern=p, length=5), words)
+            self.assertIn(d.sample_word(), self.trie_dictionary.get_words())
+
+    def test_sample_word_covers_matches(self):
+        random.seed(0)
+        words = ['BAKE', 'BAKED', 'BAKES', 'CAKE', 'CAKED', 'FAKE', 'MAKES']
+        for index_class in AVAILABLE_INDEXES.values():
+            index = index_class()
+            for w in words:
+                index.add(w)
+            seen = set(index.sample_word() for _ in range(300))
+            self.assertSetEqual(seen, set(words), index_class)
+            seen = set(index.sample_word({1: 'A', 4: 'D'}) for _ in range(100))
+            self.assertSetEqual(seen, {'BAKED', 'CAKED'}, index_class)
+            self.assertIsNone(index.sample_word({0: 'Q'}))
+
+    def test_letters_outside_latin1(self):
+        for index_class in AVAILABLE_INDEXES.values():
+            index = index_class()
+            for w in ['CAT', 'BAT']:
+                index.add(w)
+            for p in [{0: '\u0141'}, {0: 'C', 1: '\u20ac'}]:
+                self.assertListEqual(index.get_words(p), [], index_class)
+                self.assertEqual(index.count_words(p), 0, index_class)
+                self.assertIsNone(index.sample_word(p), index_class)
+
+    def test_letter_counts(self):
+        for index, d in self.dictionaries.items():
+            for p in self.PATTERNS:
+                for position in (0, 4, 9):
+                    expected = {}
+                    for w in d.get_words(pattern=p, length=5):
+                        if len(w) > position:
+                            expected[w[position]] = expected.get(w[position], 0) + 1
+                    self.assertDictEqual(
+                        d.letter_counts(position, pattern=p, length=5),
+                        expected, index)
+
+    @unittest.skipIf(not performance_test, 'Not running performance tests')
+    def test_performance_versus_trie(self):
+        t = dict((index, 0) for index in self.dictionaries)
+        for _ in range(1000):
+            for index, d in self.dictionaries.items():
+                start = time.time()
+                for p in self.PATTERNS:
+                    d.get_words(pattern=p, length=7)
+                t[index] += time.time() - start
+
+        for index in sorted(t):
+            logging.getLogger('TestDictionary.logger').info(
+                'Pattern matching test: %s, %0.4f seconds', index, t[index])
+
+    @unittest.skipIf(not performance_test, 'Not running performance tests')
+    def test_performance_memory(self):
+        for index in sorted(AVAILABLE_INDEXES):
+            tracemalloc.start()
+            with open(self.dictionary_file) as istream:
+                d = Dictionary.load(istream, index=index)
+            d.get_words(pattern={0: 'A'}, length=5)
+            size, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logging.getLogger('TestDictionary.logger').info(
+                'Memory test: %s uses %d bytes (peak %d bytes) for %d words',
+                index, size, peak, d.size)
+
+    @unittest.skipIf(not performance_test or not os.path.exists(STATM),
+                     'Not running performance tests')
+    def test_performance_rss(self):
+        # Each index is loaded in a fresh process, so that the growth of its
+        # resident set includes allocator overhead and is not shared with
+        # the other indexes.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        for index in sorted(AVAILABLE_INDEXES):
+            output = subprocess.check_output(
+                [sys.executable, '-c', RSS_SCRIPT, self.dictionary_file, index],
+                env=env, universal_newlines=True)
+            rss, latency = output.split()
+            logging.getLogger('TestDictionary.logger').info(
+                'RSS test: %s adds %d KiB of RSS, %0.3f ms per query',
+                index, int(rss) // 1024, float(latency) * 1000)
+
+    def test_add_after_query(self):
+        for index_class in AVAILABLE_INDEXES.values():
+            index = index_class()
+            for w in ['CAT', 'BAT']:
+                index.add(w)
+            self.assertListEqual(index.get_words({1: 'A'}), ['BAT', 'CAT'])
+            index.add('AAT')
+            index.add('CAT')
+            self.assertEqual(index.size, 3)
+            self.assertTrue(index.is_word('AAT'))
+            self.assertListEqual(index.get_words({1: 'A'}),
+                                 ['AAT', 'BAT', 'CAT'])
+            self.assertListEqual(index.get_words({0: 'C', 2: 'T'}), ['CAT'])
+            self.assertListEqual(index.get_words({0: 'D'}), [])
+
+    def test_compact_trie_mixed_lengths(self):
+        trie = Trie()
+        compact = CompactTrie()
+        for w in ['A', 'AB', 'ABC', 'ABD', 'B', 'BCD', 'BC']:
+            trie.add(w)
+            compact.add(w)
+        self.assertEqual(compact.size, trie.size)
+        for p in [{}, {0: 'A'}, {1: 'B'}, {2: 'D'}, {1: 'C'}]:
+            self.assertListEqual(compact.get_words(p), trie.get_words(p))
+        self.assertFalse(compact.is_word('ABCD'))
+        self.assertFalse(compact.is_word('C'))
+
+    def test_dawg_shares_suffixes(self):
+        dawg = Dawg()
+        for w in ['BAKED', 'BAKES', 'FAKED', 'FAKES', 'MAKED', 'MAKES']:
+            dawg.add(w)
+        # The root, one state per remaining letter, and a shared final state.
+        self.assertEqual(dawg.node_count, 6)
+        self.assertListEqual(dawg.get_words({4: 'S'}),
+                             ['BAKES', 'FAKES', 'MAKES'])
+        self.assertListEqual(dawg.get_words({0: 'F', 4: 'D'}), ['FAKED'])
+
+    def test_dawg_unsorted_input(self):
+        trie = Trie()
+        dawg = Dawg()
+        words = ['TAKING', 'BAKING', 'BAKED', 'TAKEN', 'A', 'BAKE', 'TAKE']
+        for w in words:
+            trie.add(w)
+            dawg.add(w)
+        self.assertEqual(dawg.size, len(words))
+        for w in words:
+            self.assertTrue(dawg.is_word(w))
+        self.assertFalse(dawg.is_word('TAK'))
+        for p in [{}, {0: 'T'}, {3: 'E'}, {4: 'N'}, {5: 'G'}]:
+            self.assertListEqual(dawg.get_words(p), trie.get_words(p))
+        self.assertLess(dawg.node_count, trie.node_count)
+
+    def test_dawg_fewer_nodes(self):
+        self.assertLess(self.dictionaries['dawg'].nodes,
+                        self.dictionaries['compact'].nodes)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestLetterMatrix(unittest.TestCase):
+
+    def test_mixed_lengths(self):
+        trie = Trie()
+        matrix = LetterMatrix()
+        for w in ['A', 'AB', 'ABC', 'ABD', 'B', 'BCD', 'BC']:
+            trie.add(w)
+            matrix.add(w)
+        self.assertEqual(matrix.size, trie.size)
+        for p in [{}, {0: 'A'}, {1: 'B'}, {2: 'D'}, {1: 'C'}, {5: 'A'}]:
+            self.assertListEqual(matrix.get_words(p), trie.get_words(p))
+            self.assertEqual(matrix.count_words(p), trie.count_words(p))
+        self.assertFalse(matrix.is_word('ABCD'))
+        self.assertEqual(matrix.node_count, 21)
+
+    def test_letter_counts(self):
+        matrix = LetterMatrix()
+        for w in ['CAT', 'BAT', 'COT', 'CAB']:
+            matrix.add(w)
+        self.assertDictEqual(matrix.letter_counts(1), {'A': 3, 'O': 1})
+        self.assertDictEqual(matrix.letter_counts(2, {0: 'C'}), {'T': 2, 'B': 1})
+        self.assertDictEqual(matrix.letter_counts(2, {0: 'Z'}), {})
+        self.assertDictEqual(matrix.letter_counts(3), {})
+
+
+class TestDictionaryCache(unittest.TestCase):
+    WORDS = ['CAT', 'BAT', 'CATS', 'DOGS', 'COT']
+
+    def make_dictionary(self, cache_size):
+        d = Dictionary(cache_size=cache_size)
+        for w in self.WORDS:
+            d.add(w)
+        return d
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            Dictionary(cache_size=0)
+
+    def test_freeze_pattern(self):
+        self.assertEqual(freeze_pattern({2: 'T', 0: 'C'}), ((0, 'C'), (2, 'T')))
+        self.assertEqual(freeze_pattern(((0, 'C'),)), ((0, 'C'),))
+        self.assertEqual(freeze_pattern({}), ())
+
+    def test_hits_and_misses(self):
+        d = self.make_dictionary(10)
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=3),
+                             ['CAT', 'COT'])
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=3),
+                             ['CAT', 'COT'])
+        # The frozen form of the pattern is the same query.
+        self.assertListEqual(d.get_words(pattern=((0, 'C'),), length=3),
+                             ['CAT', 'COT'])
+        self.assertListEqual(d.get_words(pattern={0: 'C'}), ['CAT', 'COT', 'CATS'])
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions), (2, 2, 0))
+        self.assertEqual((info.maxsize, info.currsize), (10, 2))
+
+    def test_eviction(self):
+        d = self.make_dictionary(2)
+        d.get_words(pattern={0: 'C'}, length=3)
+        d.get_words(pattern={0: 'B'}, length=3)
+        d.get_words(pattern={0: 'C'}, length=3)
+        # Evicts the least recently used query, for words starting with B.
+        d.get_words(pattern={0: 'D'}, length=4)
+        d.get_words(pattern={0: 'C'}, length=3)
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions), (2, 3, 1))
+        d.get_words(pattern={0: 'B'}, length=3)
+        self.assertEqual(d.cache_info().misses, 4)
+
+    def test_add_invalidates(self):
+        d = self.make_dictionary(10)
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=3), ['CAT', 'COT'])
+        self.assertListEqual(d.get_words(pattern={0: 'C'}), ['CAT', 'COT', 'CATS'])
+        self.assertListEqual(d.get_words(pattern={0: 'D'}, length=4), ['DOGS'])
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=5), [])
+
+        d.add('CUT')
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=3),
+                             ['CAT', 'COT', 'CUT'])
+        self.assertListEqual(d.get_words(pattern={0: 'C'}),
+                             ['CAT', 'COT', 'CUT', 'CATS'])
+        self.assertEqual(d.cache_info().currsize, 4)
+
+        d.add('CHAIR')
+        self.assertListEqual(d.get_words(pattern={0: 'C'}, length=5), ['CHAIR'])
+        # Adding a word that is already there keeps the cache.
+        d.add('CAT')
+        d.get_words(pattern={0: 'D'}, length=4)
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 7))
+
+    def test_count_and_sample_use_cache(self):
+        d = self.make_dictionary(10)
+        self.assertEqual(d.count_words(pattern={0: 'C'}, length=3), 2)
+        self.assertEqual(d.count_words(pattern=((0, 'C'),), length=3), 2)
+        for _ in range(5):
+            self.assertIn(d.sample_word(pattern={0: 'C'}, length=3),
+                          ['CAT', 'COT'])
+        self.assertIsNone(d.sample_word(pattern=((0, 'Q'),), length=3))
+        self.assertListEqual(list(d.iter_words(pattern=((0, 'C'),), length=3)),
+                             ['CAT', 'COT'])
+        # Narrower counts are refined from the cached words.
+        self.assertEqual(d.count_words(pattern={0: 'C', 1: 'O'}, length=3), 1)
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses, info.refinements), (6, 3, 1))
+
+        d.add('CUT')
+        self.assertEqual(d.count_words(pattern={0: 'C'}, length=3), 3)
+
+    def test_frozen_patterns_without_cache(self):
+        d = self.make_dictionary(None)
+        frozen = freeze_pattern({0: 'C', 2: 'T'})
+        self.assertListEqual(list(d.iter_words(pattern=frozen)),
+                             ['CAT', 'COT', 'CATS'])
+        self.assertEqual(d.count_words(pattern=frozen, length=3), 2)
+        self.assertIn(d.sample_word(pattern=frozen, length=3), ['CAT', 'COT'])
+        self.assertDictEqual(d.letter_counts(1, pattern=frozen, length=3),
+                             {'A': 1, 'O': 1})
+
+    def test_refine(self):
+        d = self.make_dictionary(None)
+        words = d.get_words(pattern={0: 'C'})
+        self.assertListEqual(Dictionary.refine(words, 1, 'A'), ['CAT', 'CATS'])
+        self.assertListEqual(Dictionary.refine(words, 3, 'S'), ['CATS'])
+        self.assertListEqual(Dictionary.refine(words, 4, 'S'), [])
+
+    def test_refine_cached(self):
+        d = self.make_dictionary(10)
+        d.get_words(pattern={0: 'C'}, length=3)
+        self.assertListEqual(d.get_words(pattern={0: 'C', 1: 'O'}, length=3),
+                             ['COT'])
+        self.assertListEqual(d.get_words(pattern={0: 'C', 1: 'O', 2: 'T'},
+                                         length=3), ['COT'])
+        # Not refined, as no query with one letter fewer is cached.
+        self.assertListEqual(d.get_words(pattern={0: 'B', 2: 'T'}, length=3),
+                             ['BAT'])
+        d.get_words(pattern={})
+        self.assertListEqual(d.get_words(pattern={3: 'S'}), ['CATS', 'DOGS'])
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses, info.refinements), (0, 6, 3))
+
+    def test_refine_matches_trie(self):
+        dictionary_file = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'fixtures', 'test.dict')
+        with open(dictionary_file) as istream:
+            d = Dictionary.load(istream, cache_size=1000)
+        with open(dictionary_file) as istream:
+            trie_dictionary = Dictionary.load(istream)
+        for length in (0, 5, 7):
+            for p in TestIndexes.PATTERNS:
+                d.get_words(pattern=p, length=length)
+                for position in range(8):
+                    for letter in 'AES':
+                        narrower = dict(p)
+                        narrower.setdefault(position, letter)
+                        self.assertListEqual(
+                            d.get_words(pattern=narrower, length=length),
+                            trie_dictionary.get_words(
+                                pattern=narrower, length=length))
+        self.assertGreater(d.cache_info().refinements, 0)
+
+    def test_uncached(self):
+        d = self.make_dictionary(None)
+        self.assertListEqual(d.get_words(pattern=((0, 'C'),), length=3),
+                             ['CAT', 'COT'])
+        info = d.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 0, 0))
+
+
+class TestBinaryFormat(unittest.TestCase):
+    PATTERNS = TestIndexes.PATTERNS
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dictionary_file = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'fixtures', 'test.dict')
+        with open(cls.dictionary_file) as istream:
+            cls.dictionary = Dictionary.load(istream)
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.dict')
+        with os.fdopen(fd, 'wb') as ostream:
+            self.dictionary.save(ostream)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def assertSameWords(self, d):
+        self.assertEqual(d.size, self.dictionary.size)
+        self.assertListEqual(list(d), list(self.dictionary))
+        for length in self.dictionary.binned_tries:
+            for p in self.PATTERNS:
+                self.assertListEqual(
+                    d.get_words(pattern=p, length=length),
+                    self.dictionary.get_words(pattern=p, length=length))
+
+    def test_round_trip(self):
+        d = Dictionary.open(self.path)
+        self.assertSameWords(d)
+        for w in self.dictionary:
+            self.assertTrue(d.is_word(w))
+        self.assertFalse(d.is_word('noexisto'))
+
+    def test_save_mapped(self):
+        d = Dictionary.open(self.path)
+        fd, path = tempfile.mkstemp(suffix='.dict')
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                d.save(ostream)
+            with open(path, 'rb') as a, open(self.path, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        finally:
+            os.remove(path)
+
+    def test_add_after_open(self):
+        with open(self.path, 'rb') as istream:
+            contents = istream.read()
+
+        d = Dictionary.open(self.path)
+        d.add('ZZZZZ')
+        self.assertTrue(d.is_word('ZZZZZ'))
+        self.assertIn('ZZZZZ', d.get_words(pattern={0: 'Z'}, length=5))
+        self.assertEqual(d.size, self.dictionary.size + 1)
+        with open(self.path, 'rb') as istream:
+            self.assertEqual(istream.read(), contents)
+
+    def test_pickle(self):
+        d = pickle.loads(pickle.dumps(Dictionary.open(self.path)))
+        self.assertSameWords(d)
+
+    def test_not_a_dictionary(self):
+        with self.assertRaises(ValueError):
+            Dictionary.open(self.dictionary_file)
+
+    def test_truncated(self):
+        size = os.path.getsize(self.path)
+        for length in (size - 1, 40, 20, 12):
+            os.truncate(self.path, length)
+            with self.assertRaises(ValueError):
+                Dictionary.open(self.path)
+
+    @unittest.skipIf(not performance_test, 'Not running performance tests')
+    def test_performance_open(self):
+        start = time.time()
+        with open(self.dictionary_file) as istream:
+            Dictionary.load(istream)
+        loaded = time.time() - start
+
+        start = time.time()
+        Dictionary.open(self.path)
+        opened = time.time() - start
+
+        logging.getLogger('TestDictionary.logger').info(
+            'Startup test: load %0.4f seconds, open %0.4f seconds',
+            loaded, opened)
+
+
 class TestPhraseDictionary(unittest.TestCase):
     WORDS = ['the', 'cat', 'in', 'the', 'hat',
              'green', 'eggs', 'and', 'ham']
@@ -234,6 +743,80 @@ class TestPhraseDictionary(unittest.TestCase):
             words = sorted(self.pd.get(pattern, length))
             self.assertListEqual(words, expected)
 
+    def test_max_words(self):
+        self.assertListEqual(sorted(self.pd.get({}, 5, max_words=1)),
+                             [('GREEN',)])
+        self.assertListEqual(sorted(self.pd.get({0: 'I'}, 6, max_words=2)),
+                             [('IN', 'EGGS')])
+        self.assertListEqual(sorted(self.pd.get({0: 'I'}, 6, max_words=3)),
+                             [('IN', 'EGGS'), ('IN', 'IN', 'IN')])
+
+    def test_limit(self):
+        all_phrases = list(self.pd.get({}, 9))
+        self.assertGreater(len(all_phrases), 10)
+        self.assertListEqual(list(self.pd.get({}, 9, limit=10)),
+                             all_phrases[:10])
+        self.assertListEqual(list(self.pd.get({}, 9, limit=0)), [])
+
+    def test_windows_are_looked_up_once(self):
+        queries = []
+
+        class Recording(Dictionary):
+            def get_words(self, **kwargs):
+                queries.append(kwargs)
+                return super(Recording, self).get_words(**kwargs)
+
+        d = Recording()
+        for word in self.WORDS:
+            d.add(word)
+        pattern = {0: 'T', 3: 'C', 6: 'I', 8: 'T', 11: 'H', 13: 'T'}
+        self.assertListEqual(list(PhraseDictionary(d).get(pattern, 14)),
+                             [('THE', 'CAT', 'IN', 'THE', 'HAT')])
+        # At most one query for each window of the 14 boxes.
+        self.assertLessEqual(len(queries), 14 * 15 // 2)
+
+    def test_load_weights(self):
+        weights = load_weights(io.StringIO('the 10\ncat\t2.5\n\nThe 1\n'))
+        self.assertDictEqual(weights, {'THE': 11.0, 'CAT': 2.5})
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            load_weights(io.StringIO('CAT 3\nDOG\n'))
+        with self.assertRaisesRegex(ValueError, 'line 1'):
+            load_weights(io.StringIO('CAT many\n'))
+
+    def test_get_best(self):
+        weights = {'THE': 50, 'CAT': 20, 'HAT': 10, 'IN': 40, 'GREEN': 1}
+        pd = PhraseDictionary(self.pd._dictionary, weights)
+        for pattern, length in [({}, 5), ({2: 'E'}, 5), ({}, 8), ({0: 'Q'}, 4)]:
+            best = list(pd.get_best(pattern, length))
+            self.assertListEqual(sorted(phrase for _, phrase in best),
+                                 sorted(pd.get(pattern, length)))
+            scores = [score for score, _ in best]
+            self.assertListEqual(scores, sorted(scores, reverse=True))
+            for score, phrase in best:
+                self.assertAlmostEqual(score, sum(pd.score(w) for w in phrase))
+
+        # Phrases with the same words in a different order tie.
+        best = [phrase for _, phrase in pd.get_best({}, 5, k=3)]
+        self.assertSetEqual(set(best[:2]), {('THE', 'IN'), ('IN', 'THE')})
+        self.assertIn(best[2], [('CAT', 'IN'), ('IN', 'CAT')])
+        best = [phrase for _, phrase in pd.get_best({}, 6, k=2, max_words=2)]
+        self.assertEqual(best[0], ('THE', 'THE'))
+        self.assertIn(best[1], [('THE', 'CAT'), ('CAT', 'THE')])
+        self.assertListEqual(list(pd.get_best({}, 0)), [])
+
+    def test_get_best_is_lazy(self):
+        (score, phrase), = self.pd.get_best({}, 40, k=1)
+        self.assertEqual(len(''.join(phrase)), 40)
+        # Without weights, the fewest words score best.
+        self.assertEqual(len(phrase), 8)
+
+    def test_long_entry_is_lazy(self):
+        # Nothing fits the pattern, which a full enumeration of the
+        # compositions of 40 letters would take far too long to discover.
+        self.assertListEqual(list(self.pd.get({39: 'Q'}, 40)), [])
+        phrase = next(self.pd.get({}, 40))
+        self.assertEqual(len(''.join(phrase)), 40)
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -0,0 +1,151 @@
+import os
+import random
+import time
+import unittest
+
+from littleboxes.cluedb import ClueDB, ClueDBRecord
+from littleboxes.fuzzy import NGramIndex
+from littleboxes.mapped import (
+    MappedStrings,
+    string_table_bytes,
+    uint32_bytes,
+    uint32_view,
+)
+
+try:
+    from ngram import NGram
+except ImportError:
+    NGram = None
+
+PERFORMANCE = bool(int(os.getenv('PERFORMANCE', False)))
+
+TEST_DB = os.path.join(os.path.dirname(__file__), 'fixtures', 'test.cluedb')
+
+
+def load_clues():
+    with open(TEST_DB) as istream:
+        return sorted(set(ClueDBRecord.parse(line).text.lower()
+                          for line in istream))
+
+
+class TestNGramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = NGramIndex()
+        for item in ['spam', 'spamalot', 'ham', 'eggs', 'spam']:
+            self.index.add(item)
+
+    def test_grams(self):
+        self.assertListEqual(self.index.grams('ham'),
+                             ['$$h', '$ha', 'ham', 'am$', 'm$$'])
+        self.assertEqual(len(self.index), 4)
+        self.assertIn('eggs', self.index)
+
+    def test_search(self):
+        self.assertListEqual(self.index.search('spam', 1.0), [('spam', 1.0)])
+        # 'spam' and 'spamalot' share 4 of their 6 and 10 trigrams.
+        self.assertListEqual(self.index.search('spam', 0.3),
+                             [('spam', 1.0), ('spamalot', 4.0 / 12)])
+        # 'ham' shares 'am$' and 'm$$' with 'spam'.
+        self.assertListEqual(self.index.search('spam', 0.0),
+                             [('spam', 1.0), ('spamalot', 4.0 / 12),
+                              ('ham', 2.0 / 9)])
+        self.assertListEqual(self.index.search('bacon', 0.0), [])
+
+    def test_search_many(self):
+        queries = ['spam', 'ham', 'bacon']
+        self.assertListEqual(self.index.search_many(queries, 0.2),
+                             [self.index.search(query, 0.2) for query in queries])
+        # Only the allowed ids are considered.
+        spamalot = self.index.add('spamalot')
+        self.assertEqual(spamalot, 1)
+        self.assertListEqual(
+            self.index.search_many(queries, 0.2, [{spamalot}, None, set()]),
+            [[('spamalot', 4.0 / 12)], self.index.search('ham', 0.2), []])
+
+    def test_repeated_grams(self):
+        index = NGramIndex()
+        for item in ['aaaa', 'aa', 'aaaaaaaa']:
+            index.add(item)
+        # 'aaaa' has 'aaa' twice and 'aaaaaaaa' six times, but 'aaa' only
+        # has it once; 'aa' shares 4 trigrams, all but 'aaa'.
+        self.assertListEqual(index.search('aaa', 0.5),
+                             [('aaaa', 5.0 / 6), ('aa', 4.0 / 5),
+                              ('aaaaaaaa', 5.0 / 10)])
+        self.assertListEqual(index.search('aaaaaaa', 0.6),
+                             [('aaaaaaaa', 9.0 / 10), ('aaaa', 6.0 / 9)])
+
+    def test_from_arrays(self):
+        items = sorted(self.index.items, key=lambda item: item.encode('utf-8'))
+        index = NGramIndex()
+        for item in items:
+            index.add(item)
+        gram_counts, grams, starts, ids = index.to_arrays()
+
+        def strings(values):
+            offsets, blob = string_table_bytes(values)
+            return MappedStrings(uint32_view(offsets, 0, len(values) + 1),
+                                 memoryview(blob))
+
+        def uint32s(values):
+            return uint32_view(uint32_bytes(values), 0, len(values))
+
+        mapped = NGramIndex.from_arrays(
+            strings(items), uint32s(gram_counts), strings(grams),
+            uint32s(starts), uint32s(ids))
+        self.assertEqual(len(mapped), 4)
+        self.assertIn('spamalot', mapped)
+        self.assertNotIn('bacon', mapped)
+        for query in ['spam', 'ham', 'spa', 'bacon']:
+            self.assertListEqual(mapped.search(query, 0.1),
+                                 index.search(query, 0.1))
+        self.assertRaises(TypeError, mapped.add, 'bacon')
+
+    @unittest.skipIf(NGram is None, 'ngram is not installed')
+    def test_matches_ngram(self):
+        clues = load_clues()
+        index = NGramIndex()
+        reference = NGram(N=3)
+        for clue in clues:
+            index.add(clue)
+            reference.add(clue)
+
+        random.seed(0)
+        queries = random.sample(clues, 20) + ['overseas', 'a', '', 'auto club']
+        for query in queries:
+            for threshold in (0.0, 0.2, 0.5, 0.8, 1.0):
+                self.assertListEqual(
+                    sorted(index.search(query, threshold)),
+                    sorted(reference.search(query, threshold)),
+                    (query, threshold))
+
+    def test_cluedb_search(self):
+        with open(TEST_DB) as istream:
+            db = ClueDB.load(istream)
+        self.assertEqual(db.search('Overseas', 1.0), {('overseas', 1.0)})
+        results = db.search('Overseas!', 0.5)
+        self.assertEqual(results[0][0], 'overseas')
+        self.assertTrue(all(similarity >= 0.5 for _, similarity in results))
+
+    @unittest.skipIf(not PERFORMANCE or NGram is None,
+                     'Not running performance tests')
+    def test_performance_versus_ngram(self):
+        clues = load_clues()
+        # Make up a larger archive from the words of the test clues.
+        random.seed(0)
+        words = ' '.join(clues).split()
+        archive = [' '.join(random.sample(words, random.randint(2, 6)))
+                   for _ in range(50000)]
+
+        index = NGramIndex()
+        reference = NGram(N=3)
+        for clue in archive:
+            index.add(clue)
+            reference.add(clue)
+
+        for name, searcher in [('NGramIndex', index), ('NGram', reference)]:
+            start = time.time()
+            for query in archive[:20]:
+                searcher.search(query, 0.5)
+            print('Fuzzy search test: %s, %0.4f seconds' % (
+                name, time.time() - start))
@@ -0,0 +1,541 @@
+import itertools
+import unittest
+
+import networkx
+
+from littleboxes.cluedb import ClueDB
+from littleboxes.dictionary import Dictionary, PhraseDictionary
+from littleboxes.solver.clique import (
+    ConflictGraph,
+    build_conflict_graph,
+    find_cliques,
+    find_independent_sets,
+)
+from littleboxes.solver.cluedb_solver import ClueDBCliqueSolver
+from littleboxes.solver.csp_solver import DictionaryCSPSolver
+from littleboxes.solver.dictionary_solver import (
+    DictionaryCliqueSolver,
+    DictionaryGuessSolver,
+    PhraseCliqueSolver,
+)
+from littleboxes.solver.solver import MultiStageSolver, Solver
+from littleboxes.xword import (
+    Crossword,
+    XWClue,
+    XWCoordinate,
+    XWDirection,
+    XWFill,
+    build_crossings,
+)
+
+
+def make_crossword(rows):
+    '''Build an empty Crossword from a list of row strings, where '#'
+    marks a black square and any other character a white one.
+    '''
+    height = len(rows)
+    width = len(rows[0])
+    white = [[c != '#' for c in row] for row in rows]
+    clues = []
+    num = 0
+    for r in range(height):
+        for c in range(width):
+            if not white[r][c]:
+                continue
+            starts_across = ((c == 0 or not white[r][c-1]) and
+                             c + 1 < width and white[r][c+1])
+            starts_down = ((r == 0 or not white[r-1][c]) and
+                           r + 1 < height and white[r+1][c])
+            if not (starts_across or starts_down):
+                continue
+            num += 1
+            if starts_across:
+                end = c
+                while end < width and white[r][end]:
+                    end += 1
+                indices = tuple(r * width + i for i in range(c, end))
+                clues.append(XWClue(XWCoordinate(num, XWDirection.ACROSS),
+                                    '%dA' % num, indices))
+            if starts_down:
+                end = r
+                while end < height and white[end][c]:
+                    end += 1
+                indices = tuple(i * width + c for i in range(r, end))
+                clues.append(XWClue(XWCoordinate(num, XWDirection.DOWN),
+                                    '%dD' % num, indices))
+    return Crossword(width, height, tuple(clues))
+
+
+def with_texts(xword, texts):
+    '''Replace the text of each clue in xword, by its current text.'''
+    clues = tuple(clue._replace(text=texts.get(clue.text, clue.text))
+                  for clue in xword.clues)
+    return Crossword(xword.width, xword.height, clues)
+
+
+def make_dictionary(words):
+    d = Dictionary()
+    for word in words:
+        d.add(word)
+    return d
+
+
+class CountingDictionary(Dictionary):
+    '''Dictionary that counts how many times it is queried.'''
+
+    def __init__(self, *args, **kwargs):
+        super(CountingDictionary, self).__init__(*args, **kwargs)
+        self.queries = 0
+
+    def get_words(self, **kwargs):
+        self.queries += 1
+        return super(CountingDictionary, self).get_words(**kwargs)
+
+    def iter_words(self, **kwargs):
+        self.queries += 1
+        return super(CountingDictionary, self).iter_words(**kwargs)
+
+
+class FillFirstEmptySolver(Solver):
+    '''Fills the first empty box of the grid with each of letters in turn,
+    with the given likelihoods, and counts how often it is called.
+    '''
+
+    def __init__(self, letters, likelihoods):
+        self.letters = letters
+        self.likelihoods = likelihoods
+        self.calls = 0
+
+    def solve(self, xword):
+        self.calls += 1
+        idx = xword.solution.index(None)
+        for letter, p in zip(self.letters, self.likelihoods):
+            solved = xword.copy()
+            solved.solution[idx] = letter
+            yield p, solved
+
+
+class TestBuildCrossings(unittest.TestCase):
+
+    def test_crossings(self):
+        x = make_crossword(['...', '.#.', '...'])
+        crossings = build_crossings(x.clues)
+        by_name = {clue.text: clue for clue in x.clues}
+        self.assertEqual(len(x.clues), 4)
+        self.assertListEqual(
+            sorted((other.text, offset, other_offset)
+                   for other, offset, other_offset in crossings[by_name['1A']]),
+            [('1D', 0, 0), ('2D', 2, 0)])
+        self.assertListEqual(
+            sorted((other.text, offset, other_offset)
+                   for other, offset, other_offset in crossings[by_name['2D']]),
+            [('1A', 0, 2), ('3A', 2, 2)])
+
+
+class TestConflictGraph(unittest.TestCase):
+    WORDS = ['CAT', 'COT', 'TEN', 'TOE', 'EAT', 'ONE', 'ACE', 'TAN',
+             'CANE', 'CONE', 'TONE', 'EAST', 'NEAT', 'OATS']
+
+    def reference_cliques(self, xword, possible_answers):
+        '''Maximal cliques of the full compatibility graph, built pairwise.'''
+        g = networkx.Graph()
+        for clue, words in possible_answers.items():
+            for word in words:
+                if not xword.would_conflict(clue, word):
+                    g.add_node(XWFill(clue, word))
+        for n in g:
+            testcopy = xword.copy()
+            testcopy.set_fill(n.clue, n.word)
+            for other_n in g:
+                if n.clue.coord == other_n.clue.coord:
+                    continue
+                if (n.clue.coord.direction == other_n.clue.coord.direction or
+                        not testcopy.would_conflict(other_n.clue, other_n.word)):
+                    g.add_edge(n, other_n)
+        return set(frozenset(c) for c in networkx.find_cliques(g))
+
+    def possible_answers(self, xword):
+        d = make_dictionary(self.WORDS)
+        return {clue: set(d.get_words(length=len(clue.box_indices)))
+                for clue in xword.clues}
+
+    def test_matches_pairwise_construction(self):
+        for rows in (['...', '.#.', '...'], ['....', '.#..', '...#']):
+            x = make_crossword(rows)
+            possible_answers = self.possible_answers(x)
+            g = build_conflict_graph(x, possible_answers)
+            cliques = set(frozenset(c) for c in find_cliques(g))
+            self.assertTrue(cliques)
+            self.assertSetEqual(cliques,
+                                self.reference_cliques(x, possible_answers))
+
+    def test_non_crossing_edges_are_implied(self):
+        x = make_crossword(['....', '.#..', '...#'])
+        g = build_conflict_graph(x, self.possible_answers(x))
+        self.assertTrue(g.edges())
+        for u, v in g.edges():
+            self.assertIn(v.clue, [other for other, _, _ in x.crossings[u.clue]])
+
+    def test_existing_fill(self):
+        x = make_crossword(['...', '.#.', '...'])
+        x.set_fill(x.clues[0], 'CAT')
+        possible_answers = self.possible_answers(x)
+        g = build_conflict_graph(x, possible_answers)
+        for n in g:
+            self.assertFalse(x.would_conflict(n.clue, n.word))
+        self.assertSetEqual(set(frozenset(c) for c in find_cliques(g)),
+                            self.reference_cliques(x, possible_answers))
+
+    def test_empty(self):
+        x = make_crossword(['...', '.#.', '...'])
+        self.assertListEqual(
+            list(find_cliques(build_conflict_graph(x, {}))), [])
+        self.assertListEqual(
+            list(find_independent_sets(ConflictGraph(x, {}), x)), [])
+
+    def n_set(self, xword, fills):
+        solved = xword.copy()
+        for fill in fills:
+            solved.set_fill(fill.clue, fill.word)
+        return solved.n_set
+
+    def test_independent_sets_match_cliques(self):
+        for rows, first in ((['...', '.#.', '...'], None),
+                            (['...', '.#.', '...'], 'CAT'),
+                            (['....', '.#..', '...#'], 'CANE')):
+            x = make_crossword(rows)
+            if first:
+                x.set_fill(x.clues[0], first)
+            possible_answers = self.possible_answers(x)
+            results = list(find_independent_sets(
+                ConflictGraph(x, possible_answers), x))
+            self.assertSetEqual(set(frozenset(fills) for _, fills in results),
+                                self.reference_cliques(x, possible_answers))
+
+            # Best first, scored by the number of boxes filled in.
+            scores = [score for score, _ in results]
+            self.assertListEqual(scores, sorted(scores, reverse=True))
+            for score, fills in results:
+                self.assertEqual(score + x.n_set, self.n_set(x, fills))
+
+    def test_independent_sets_weights(self):
+        x = make_crossword(['...', '.#.', '...'])
+        graph = ConflictGraph(x, self.possible_answers(x))
+        weights = {fill: 1.0 if fill.word == 'TOE' else 0.1
+                   for fill in graph.conflicts}
+        results = list(find_independent_sets(graph, x, weights))
+        scores = [score for score, _ in results]
+        self.assertListEqual(scores, sorted(scores, reverse=True))
+        best = results[0][1]
+        self.assertEqual(sum(1 for fill in best if fill.word == 'TOE'), 2)
+        for score, fills in results:
+            self.assertAlmostEqual(score, sum(weights[f] for f in fills))
+
+    def test_solver_engines(self):
+        x = make_crossword(['....', '.#..', '...#'])
+        d = make_dictionary(self.WORDS)
+        with self.assertRaises(ValueError):
+            DictionaryCliqueSolver(d, engine='nope')
+
+        cliques = list(DictionaryCliqueSolver(d).solve(x))
+        independent = list(DictionaryCliqueSolver(
+            d, engine='independent_set').solve(x))
+        self.assertEqual(len(cliques), len(independent))
+        self.assertEqual(independent[0][0], max(n for n, _ in cliques))
+        self.assertSetEqual(set(tuple(s.solution) for _, s in cliques),
+                            set(tuple(s.solution) for _, s in independent))
+
+
+class TestClueDBCliqueSolver(unittest.TestCase):
+    TEXTS = {'1A': 'Feline pet', '1D': 'Baby bed',
+             '2D': 'Number of toes', '3A': 'Sun-dried color'}
+    ENTRIES = [('Feline pet', 'CAT'), ('Feline pets', 'TOM'),
+               ('Baby bed', 'COT'), ('Baby bed', 'CRIB'),
+               ('Number of toes', 'TEN'), ('Sun-dried color', 'TAN'),
+               ('Sun-dried colour', 'TIN')]
+
+    def setUp(self):
+        self.db = ClueDB()
+        for text, answer in self.ENTRIES:
+            self.db.add(text, answer)
+        self.x = with_texts(make_crossword(['...', '.#.', '...']), self.TEXTS)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            ClueDBCliqueSolver(self.db, score='nope')
+        with self.assertRaises(ValueError):
+            ClueDBCliqueSolver(self.db, top_k=0)
+
+    def test_query_scored_answers(self):
+        solver = ClueDBCliqueSolver(self.db, clue_threshold=0.5)
+        answers = {clue.text: a for clue, a in
+                   solver.query_scored_answers(self.x).items()}
+        self.assertEqual(answers['Feline pet']['CAT'], 1.0)
+        self.assertLess(answers['Feline pet']['TOM'], 1.0)
+        self.assertNotIn('CRIB', answers['Baby bed'])
+        self.assertEqual(solver.query_answers(self.x)[self.x.clues[0]],
+                         set(['CAT', 'TOM']))
+
+    def test_searches_once(self):
+        calls = []
+
+        class CountingClueDB(ClueDB):
+            def search(self, *args):
+                calls.append('search')
+                return super(CountingClueDB, self).search(*args)
+
+            def search_many(self, *args):
+                calls.append('search_many')
+                return super(CountingClueDB, self).search_many(*args)
+
+        db = CountingClueDB()
+        for text, answer in self.ENTRIES:
+            db.add(text, answer)
+        solver = ClueDBCliqueSolver(db, clue_threshold=0.5)
+        self.assertDictEqual(solver.query_scored_answers(self.x),
+                             ClueDBCliqueSolver(self.db, clue_threshold=0.5)
+                             .query_scored_answers(self.x))
+        self.assertListEqual(calls, ['search_many'])
+
+    def test_top_k(self):
+        solver = ClueDBCliqueSolver(self.db, clue_threshold=0.5, top_k=2)
+        solutions = list(solver.solve(self.x))
+        self.assertEqual(len(solutions), 2)
+        self.assertEqual(solutions[0][0], 9)
+        self.assertEqual(''.join(l if l != Crossword.black_square else '#'
+                                 for l in solutions[0][1].solution),
+                         'CATO#ETAN')
+        self.assertGreaterEqual(solutions[0][0], solutions[1][0])
+
+        everything = list(ClueDBCliqueSolver(
+            self.db, clue_threshold=0.5).solve(self.x))
+        self.assertEqual(max(n for n, _ in everything), 9)
+        self.assertGreater(len(everything), 2)
+
+    def test_similarity_score(self):
+        solver = ClueDBCliqueSolver(self.db, clue_threshold=0.5, top_k=10,
+                                    score='similarity')
+        solutions = list(solver.solve(self.x))
+        scores = [score for score, _ in solutions]
+        self.assertListEqual(scores, sorted(scores, reverse=True))
+        self.assertAlmostEqual(scores[0], 4.0)
+
+
+class TestDictionaryGuessSolver(unittest.TestCase):
+    SQUARE = ['CAT', 'ARE', 'TEN']
+
+    def test_fills_word_square(self):
+        x = make_crossword(['...', '...', '...'])
+        # Seed the first row so that every other clue has one candidate.
+        x.set_fill(x.clues[0], 'CAT')
+        solver = DictionaryGuessSolver(make_dictionary(self.SQUARE))
+        solutions = list(solver.solve(x))
+        self.assertEqual(len(solutions), 1)
+        n_set, solved = solutions[0]
+        self.assertEqual(n_set, 9)
+        self.assertEqual(''.join(solved.solution), 'CATARETEN')
+        # The input puzzle is not modified.
+        self.assertEqual(x.n_set, 3)
+
+    def test_does_not_list_words(self):
+        x = make_crossword(['...', '...', '...'])
+        x.set_fill(x.clues[0], 'CAT')
+        d = CountingDictionary()
+        for word in self.SQUARE:
+            d.add(word)
+        n_set, solved = next(DictionaryGuessSolver(d).solve(x))
+        self.assertEqual(n_set, 9)
+        self.assertEqual(d.queries, 0)
+
+    def test_stops_at_dead_end(self):
+        x = make_crossword(['...', '...', '...'])
+        solver = DictionaryGuessSolver(make_dictionary(['CAT', 'DOG']))
+        n_set, solved = next(solver.solve(x))
+        # One word across and one down, sharing their first letter.
+        self.assertEqual(n_set, 5)
+        for clue in x.clues:
+            fill = solved.get_fill(clue)
+            if None not in fill:
+                self.assertIn(''.join(fill), ('CAT', 'DOG'))
+
+
+class TestPhraseCliqueSolver(unittest.TestCase):
+
+    def test_fills_with_phrases(self):
+        x = make_crossword(['...', '...', '...'])
+        x.set_fill(x.clues[0], 'CAT')
+        # Every answer but CAT is only a phrase: A RE, TE N.
+        pd = PhraseDictionary(make_dictionary(['CAT', 'A', 'RE', 'TE', 'N']))
+        solutions = list(PhraseCliqueSolver(pd).solve(x))
+        self.assertIn((9, list('CATARETEN')),
+                      [(n, list(s.solution)) for n, s in solutions])
+        self.assertEqual(x.n_set, 3)
+
+    def test_tries_best_phrases(self):
+        x = make_crossword(['...'])
+        pd = PhraseDictionary(make_dictionary(['CAT', 'COT', 'CUT', 'C', 'AT']),
+                              weights={'COT': 10, 'CUT': 5})
+        self.assertDictEqual(PhraseCliqueSolver(pd, k=1).query_answers(x),
+                             {x.clues[0]: ['COT']})
+        self.assertDictEqual(PhraseCliqueSolver(pd, k=2).query_answers(x),
+                             {x.clues[0]: ['COT', 'CUT']})
+        answers = PhraseCliqueSolver(pd, max_words=1).query_answers(x)
+        self.assertSetEqual(set(answers[x.clues[0]]), {'CAT', 'COT', 'CUT'})
+
+
+class TestDictionaryCSPSolver(unittest.TestCase):
+    WORDS = ['CAT', 'ARE', 'TEN', 'COT', 'ORE', 'TEA', 'ATE', 'EAT',
+             'TAN', 'NET', 'ONE', 'TOE', 'ERA', 'RAT', 'ART', 'CAR']
+
+    def brute_force(self, words):
+        '''All 3x3 word squares (rows and columns are words).'''
+        words = set(words)
+        squares = set()
+        for rows in itertools.product(sorted(words), repeat=3):
+            cols = [''.join(r[i] for r in rows) for i in range(3)]
+            if all(c in words for c in cols):
+                squares.add(''.join(rows))
+        return squares
+
+    def test_finds_all_fills(self):
+        x = make_crossword(['...', '...', '...'])
+        solver = DictionaryCSPSolver(make_dictionary(self.WORDS))
+        fills = set()
+        for n_set, solved in solver.solve(x):
+            self.assertEqual(n_set, 9)
+            fills.add(''.join(solved.solution))
+        self.assertTrue(fills)
+        self.assertSetEqual(fills, self.brute_force(self.WORDS))
+
+    def test_respects_existing_fill(self):
+        x = make_crossword(['...', '...', '...'])
+        x.set_fill(x.clues[0], 'CAT')
+        solver = DictionaryCSPSolver(make_dictionary(self.WORDS))
+        fills = set(''.join(s.solution) for _, s in solver.solve(x))
+        expected = set(f for f in self.brute_force(self.WORDS)
+                       if f.startswith('CAT'))
+        self.assertSetEqual(fills, expected)
+
+    def test_max_solutions(self):
+        x = make_crossword(['...', '...', '...'])
+        solver = DictionaryCSPSolver(make_dictionary(self.WORDS),
+                                     max_solutions=1)
+        self.assertEqual(len(list(solver.solve(x))), 1)
+
+    def test_unsatisfiable(self):
+        x = make_crossword(['...', '.#.', '...'])
+        solver = DictionaryCSPSolver(make_dictionary(['CAT', 'DOG']))
+        self.assertListEqual(list(solver.solve(x)), [])
+
+    def test_black_squares(self):
+        x = make_crossword(['...', '.#.', '...'])
+        solver = DictionaryCSPSolver(make_dictionary(
+            ['CAT', 'COT', 'TEN', 'TOE', 'EAT']))
+        fills = set()
+        for _, solved in solver.solve(x):
+            fills.add(''.join(l if l != Crossword.black_square else '#'
+                              for l in solved.solution))
+            for clue in solved.clues:
+                self.assertIn(''.join(solved.get_fill(clue)),
+                              ('CAT', 'COT', 'TEN', 'TOE', 'EAT'))
+        self.assertIn('CATO#ETEN', fills)
+
+    def test_multi_stage(self):
+        x = make_crossword(['...', '...', '...'])
+        solver = MultiStageSolver([
+            DictionaryCSPSolver(make_dictionary(self.WORDS), max_solutions=1),
+            DictionaryGuessSolver(make_dictionary(self.WORDS)),
+        ])
+        solutions = list(solver.solve(x))
+        self.assertEqual(len(solutions), 1)
+        self.assertEqual(solutions[0][1].n_set, 9)
+
+
+class TestMultiStageSolver(unittest.TestCase):
+
+    def setUp(self):
+        self.x = make_crossword(['...', '...', '...'])
+
+    def stages(self):
+        return [FillFirstEmptySolver('ABCD', [0.1, 0.4, 0.3, 0.2]),
+                FillFirstEmptySolver('AB', [0.5, 0.5]),
+                FillFirstEmptySolver('ABC', [0.2, 0.7, 0.1])]
+
+    def test_exhaustive(self):
+        stages = self.stages()
+        solutions = list(MultiStageSolver(stages).solve(self.x))
+        self.assertEqual(len(solutions), 4 * 2 * 3)
+        self.assertListEqual([s.calls for s in stages], [1, 4, 8])
+
+    def test_beam(self):
+        stages = self.stages()
+        exhaustive = sorted(MultiStageSolver(self.stages()).solve(self.x),
+                            key=lambda s: -s[0])
+        solutions = list(MultiStageSolver(stages, beam_width=2).solve(self.x))
+        self.assertListEqual([s.calls for s in stages], [1, 2, 2])
+        self.assertEqual(len(solutions), 2)
+        self.assertAlmostEqual(solutions[0][0], exhaustive[0][0])
+        self.assertEqual(''.join(solutions[0][1].solution[:3]), 'BAB')
+        self.assertEqual(''.join(solutions[1][1].solution[:3]), 'BBB')
+        self.assertGreaterEqual(solutions[0][0], solutions[1][0])
+
+    def test_beam_dedupe(self):
+        # Both stages can produce the same grid along different paths.
+        class Swap(Solver):
+            def solve(self, xword):
+                for p in (0.9, 0.8):
+                    solved = xword.copy()
+                    idx = solved.solution.index(None)
+                    solved.solution[idx] = 'A'
+                    yield p, solved
+
+        solutions = list(MultiStageSolver([Swap(), Swap()], beam_width=3)
+                         .solve(self.x))
+        self.assertEqual(len(solutions), 3)
+        deduped = list(MultiStageSolver([Swap(), Swap()], beam_width=3,
+                                        dedupe=True).solve(self.x))
+        self.assertEqual(len(deduped), 1)
+        self.assertAlmostEqual(deduped[0][0], 0.81)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            MultiStageSolver([])
+        with self.assertRaises(ValueError):
+            MultiStageSolver(self.stages(), beam_width=0)
+        with self.assertRaises(ValueError):
+            MultiStageSolver(self.stages(), processes=0)
+
+    def grids(self, solutions):
+        return sorted((round(p, 6), tuple(sol.solution)) for p, sol in solutions)
+
+    def test_parallel(self):
+        sequential = list(MultiStageSolver(self.stages()).solve(self.x))
+        parallel = list(MultiStageSolver(self.stages(),
+                                         processes=2).solve(self.x))
+        self.assertListEqual(self.grids(parallel), self.grids(sequential))
+        for _, sol in parallel:
+            self.assertEqual(sol.solution[-1], None)
+            self.assertEqual(len(sol.clues), len(self.x.clues))
+
+    def test_parallel_beam(self):
+        sequential = list(MultiStageSolver(self.stages(),
+                                           beam_width=3).solve(self.x))
+        parallel = list(MultiStageSolver(self.stages(), beam_width=3,
+                                         processes=2).solve(self.x))
+        self.assertListEqual([p for p, _ in parallel],
+                             [p for p, _ in sequential])
+        self.assertListEqual(self.grids(parallel), self.grids(sequential))
+
+    def test_parallel_single_stage(self):
+        solver = MultiStageSolver(self.stages()[:1], processes=2)
+        self.assertEqual(len(list(solver.solve(self.x))), 4)
+
+    def test_parallel_black_squares(self):
+        x = make_crossword(['...', '.#.', '...'])
+        solver = MultiStageSolver(self.stages(), processes=2)
+        for _, sol in solver.solve(x):
+            self.assertIs(sol.solution[4], Crossword.black_square)
+
+
+if __name__ == "__main__":
+    unittest.main()
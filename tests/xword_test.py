@@ -1,7 +1,12 @@
 import os
+import pickle
 import unittest
 
-from littleboxes.xword import Crossword, XWDirection
+from littleboxes.xword import (
+    Crossword,
+    InvalidCrosswordException,
+    XWDirection,
+)
 
 
 class TestCrossword(unittest.TestCase):
@@ -9,7 +14,8 @@ class TestCrossword(unittest.TestCase):
                                'fixtures', 'test.puz')
 
     def setUp(self):
-        self.x = Crossword.load(open(self.TEST_PUZZLE))
+        with open(self.TEST_PUZZLE, 'rb') as fd:
+            self.x = Crossword.load(fd)
 
     def test_load(self):
         self.assertEqual(len(self.x.clues), 138)
@@ -40,6 +46,99 @@ class TestCrossword(unittest.TestCase):
         fill = self.x.get_fill(clue)
         self.assertListEqual(fill, ['H', 'E', 'L', 'L', 'O'])
 
+    def test_set_conflict(self):
+        clue = self.x.clues[0]
+        self.x.set_fill(clue, 'HELLO')
+        self.assertFalse(self.x.would_conflict(clue, 'HELLO'))
+        self.assertTrue(self.x.would_conflict(clue, 'JELLO'))
+        with self.assertRaises(InvalidCrosswordException):
+            self.x.set_fill(clue, 'JELLO')
+        with self.assertRaises(ValueError):
+            self.x.set_fill(clue, 'HELL')
+
+    def test_black_squares(self):
+        black = [idx for idx, box in enumerate(self.x.solution)
+                 if box is Crossword.black_square]
+        self.assertTrue(black)
+        self.assertEqual(self.x.n_set, len(black))
+        with self.assertRaises(InvalidCrosswordException):
+            Crossword(self.x.width, self.x.height, self.x.clues,
+                      [Crossword.black_square] * len(self.x.solution))
+
+    def test_load_solution(self):
+        with open(self.TEST_PUZZLE, 'rb') as fd:
+            x = Crossword.load(fd, include_solution=True)
+        self.assertEqual(x.n_set, x.width * x.height)
+        self.assertEqual(''.join(x.get_fill(x.clues[0])), 'AMPLE')
+
+    def test_copy(self):
+        clue = self.x.clues[0]
+        self.x.set_fill(clue, 'HELLO')
+        copy = self.x.copy()
+        self.assertEqual(copy.solution, self.x.solution)
+        self.assertEqual(copy.boxes, self.x.boxes)
+        copy.set_fill(self.x.clues[1], 'A' * len(self.x.clues[1].box_indices))
+        self.assertNotEqual(copy.n_set, self.x.n_set)
+        self.assertNotEqual(copy.boxes, self.x.boxes)
+        self.assertIs(copy.clues, self.x.clues)
+
+    def test_rollback(self):
+        before = self.x.boxes
+        n_set = self.x.n_set
+        checkpoint = self.x.checkpoint()
+        self.x.set_fill(self.x.clues[0], 'HELLO')
+        inner = self.x.checkpoint()
+        self.x.set_fill(self.x.clues[-1], 'ABC')
+        self.x.solution[0] = 'Z'
+        self.x.rollback(inner)
+        self.assertListEqual(self.x.get_fill(self.x.clues[0]),
+                             ['H', 'E', 'L', 'L', 'O'])
+        self.assertListEqual(self.x.get_fill(self.x.clues[-1]),
+                             [None, None, None])
+        self.x.rollback(checkpoint)
+        self.assertEqual(self.x.boxes, before)
+        self.assertEqual(self.x.n_set, n_set)
+
+    def test_topology(self):
+        for clue in self.x.clues:
+            for offset, idx in enumerate(clue.box_indices):
+                self.assertIn((clue, offset), self.x.cell_clues[idx])
+            for other, offset, other_offset in self.x.crossings[clue]:
+                self.assertNotEqual(other.coord.direction,
+                                    clue.coord.direction)
+                self.assertEqual(clue.box_indices[offset],
+                                 other.box_indices[other_offset])
+        for idx, box in enumerate(self.x.solution):
+            n = 0 if box is Crossword.black_square else 2
+            self.assertEqual(len(self.x.cell_clues[idx]), n)
+        self.assertIs(self.x.copy().crossings, self.x.crossings)
+
+    def test_n_set(self):
+        n_set = sum(1 for box in self.x.solution if box is not None)
+        self.assertEqual(self.x.n_set, n_set)
+        across, down = self.x.clues[0], self.x.crossings[self.x.clues[0]][0][0]
+        self.x.set_fill(across, 'HELLO')
+        n_set += 5
+        self.assertEqual(self.x.n_set, n_set)
+        fill = self.x.get_fill(down)
+        answer = ''.join(l or 'A' for l in fill)
+        self.x.set_fill(down, answer)
+        n_set += len(answer) - 1
+        self.assertEqual(self.x.n_set, n_set)
+        self.x.solution[down.box_indices[-1]] = None
+        self.assertEqual(self.x.n_set, n_set - 1)
+        self.assertEqual(self.x.n_set,
+                         sum(1 for box in self.x.solution if box is not None))
+        self.x.rollback(0)
+        self.assertEqual(self.x.n_set, n_set - 5 - len(answer) + 1)
+
+    def test_pickle(self):
+        self.x.set_fill(self.x.clues[0], 'HELLO')
+        x = pickle.loads(pickle.dumps(self.x))
+        self.assertEqual(x.solution, self.x.solution)
+        self.assertEqual(x.n_set, self.x.n_set)
+        self.assertIn(Crossword.black_square, list(x.solution))
+
 
 if __name__ == "__main__":
     unittest.main()